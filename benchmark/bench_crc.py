@@ -0,0 +1,64 @@
+# ----------------------------
+# Micro benchmark of the DC09 CRC16 calculation
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+"""
+    Compare the table driven dc09_crc with the original bit by bit calculation
+    on typical frame sizes.
+
+    run with : python -m benchmark.bench_crc
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import random
+import timeit
+from dc09_spt.msg.dc09_crc import dc09_crc
+
+def bitwise_crc(data):
+    """
+    The original bit by bit implementation, used as reference
+    """
+    def calc_crc(crc, debyte):
+        deze = ord(debyte)
+        for i in range(0, 8):
+            deze ^= crc & 1
+            crc >>= 1
+            if deze & 1:
+                crc ^= 0xa001
+            deze >>= 1
+        return crc
+    crc = 0
+    for j in range(0, len(data)):
+        crc = calc_crc(crc, data[j])
+    return crc
+
+def frame(size):
+    return ''.join(chr(random.randint(0x20, 0x7e)) for i in range(size))
+
+def main(sizes=(60, 120, 200, 300),  number=2000):
+    print('{:>6} {:>12} {:>12} {:>12} {:>8}'.format('bytes', 'bitwise us', 'table str us', 'table b us', 'speedup'))
+    for size in sizes:
+        data = frame(size)
+        bdata = data.encode()
+        if bitwise_crc(data) != dc09_crc.calc(data) or dc09_crc.calc(data) != dc09_crc.calc(bdata):
+            raise Exception('CRC mismatch for frame of {} bytes'.format(size))
+        old = min(timeit.repeat(lambda: bitwise_crc(data), number=number, repeat=3)) / number * 1e6
+        new = min(timeit.repeat(lambda: dc09_crc.calc(data), number=number, repeat=3)) / number * 1e6
+        newb = min(timeit.repeat(lambda: dc09_crc.calc(bdata), number=number, repeat=3)) / number * 1e6
+        print('{:>6} {:>12.2f} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(size, old, new, newb, old / newb))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# ----------------------------
+# Benchmark suite of the encode, transmit and decode path
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+"""
+    Time the separate steps of sending an event and full transfers over loopback
+    against a local dc09_receiver, report throughput and p50/p99 latency
+    and keep JSON baselines to compare releases.
+
+    run with : python -m benchmark.suite [--save baseline.json] [--compare baseline.json]
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from dc09_spt.msg.dc03_msg import dc03_msg
+from dc09_spt.msg.dc05_msg import dc05_msg
+from dc09_spt.msg.dc09_msg import dc09_msg
+from dc09_spt.msg.dc09_crypt import dc09_crypt
+from dc09_spt.comm.transpath import TransPath
+from dc09_spt.dc09_spt import dc09_spt
+from dc09_spt.receiver import dc09_receiver
+
+ACCOUNT = '1234'
+KEY = bytes(range(16))
+SIA = {'code': 'BA',  'zone': 3,  'areaname': 'Boven etage hoofdgebouw',  'text': 'Inbraakmelding magneetcontact'}
+CID = {'code': 401,  'q': 1,  'zone': 14,  'area': 2}
+
+def percentile(samples,  pct):
+    """
+    Return the -pct- percentile of the sorted list -samples-
+    """
+    return samples[min(len(samples) - 1,  int(len(samples) * pct / 100))]
+
+def measure(func,  number,  batch=1):
+    """
+    Call -func- -number- times, in batches of -batch- calls per time sample
+
+    returns a map with the number of calls, the throughput in calls per second
+    and the mean, p50 and p99 latency per call in microseconds
+    """
+    for i in range(min(number // 10,  100) or 1):
+        func()
+    samples = []
+    clock = time.perf_counter
+    start = clock()
+    for i in range(max(number // batch,  1)):
+        t0 = clock()
+        for j in range(batch):
+            func()
+        samples.append((clock() - t0) / batch)
+    total = clock() - start
+    samples.sort()
+    calls = len(samples) * batch
+    return {'calls': calls,
+        'throughput': calls / total,
+        'mean_us': total / calls * 1e6,
+        'p50_us': percentile(samples,  50) * 1e6,
+        'p99_us': percentile(samples,  99) * 1e6}
+
+def micro_benchmarks():
+    """
+    Return a list of (name, function, number of calls, batch) for the steps of encoding and decoding
+    """
+    plain = dc09_msg(ACCOUNT)
+    crypted = dc09_msg(ACCOUNT,  KEY)
+    crypt = dc09_crypt(KEY)
+    sia = dc03_msg.dc03event(ACCOUNT,  SIA)
+    frame = plain.dc09block(1,  'SIA-DCS',  sia)
+    ciphertext = crypt.encrypt(sia)
+    rcv = dc09_receiver(KEY)
+    answer = rcv.answer(b'ACK',  1,  account=ACCOUNT.encode())
+    answer_crypted = rcv.answer(b'ACK',  1,  account=ACCOUNT.encode(),  crypt=dc09_crypt(KEY))
+    return [
+        ('dc09crc',  lambda: dc09_msg.dc09crc(frame),  20000,  10),
+        ('dc09crypt',  lambda: crypted.dc09crypt(sia),  20000,  10),
+        ('dc09decrypt',  lambda: crypted.dc09decrypt(ciphertext),  20000,  10),
+        ('dc03event',  lambda: dc03_msg.dc03event(ACCOUNT,  SIA),  20000,  10),
+        ('dc05event',  lambda: dc05_msg.dc05event(ACCOUNT,  CID),  20000,  10),
+        ('dc09block',  lambda: plain.dc09block(1,  'SIA-DCS',  sia),  20000,  10),
+        ('dc09block encrypted',  lambda: crypted.dc09block(1,  'SIA-DCS',  sia),  20000,  10),
+        ('dc09answer',  lambda: plain.dc09answer(1,  answer),  20000,  10),
+        ('dc09answer encrypted',  lambda: crypted.dc09answer(1,  answer_crypted),  20000,  10),
+    ]
+
+def transfer_benchmarks(rcv,  tcp_port,  udp_port,  number):
+    """
+    Return a list of (name, function, number of calls, batch) for full transfers over loopback
+    """
+    spt = dc09_spt(ACCOUNT)
+    sia = dc03_msg.dc03event(ACCOUNT,  SIA)
+    paths = [
+        ('transfer_msg tcp',  TransPath('127.0.0.1',  tcp_port,  ACCOUNT,  type='tcp')),
+        ('transfer_msg tcp persistent',  TransPath('127.0.0.1',  tcp_port,  ACCOUNT,  type='tcp',  persistent=True)),
+        ('transfer_msg tcp encrypted',  TransPath('127.0.0.1',  tcp_port,  ACCOUNT,  key=KEY,  type='tcp',  persistent=True)),
+        ('transfer_msg udp',  TransPath('127.0.0.1',  udp_port,  ACCOUNT,  type='udp')),
+    ]
+    ret = []
+    for name,  path in paths:
+        def transfer(path=path):
+            if not spt.transfer_msg(1,  'SIA-DCS',  sia,  path):
+                raise Exception('Transfer over {} failed'.format(path.type))
+        ret.append((name,  transfer,  number,  1))
+    return ret
+
+def run(pattern=None,  scale=1.0,  transfers=2000):
+    """
+    Run the benchmarks with -pattern- in their name, return a map of name to result
+    """
+    rcv = dc09_receiver(KEY)
+    tcp_port,  udp_port = rcv.start_thread()
+    results = {}
+    try:
+        print('{:<30} {:>10} {:>12} {:>10} {:>10}'.format('benchmark',  'calls',  'per second',  'p50 us',  'p99 us'))
+        benchmarks = [(name,  func,  max(int(number * scale),  batch),  batch) for name,  func,  number,  batch in micro_benchmarks()]
+        # the transfers run as often as asked, -scale- only applies to the micro benchmarks
+        benchmarks += transfer_benchmarks(rcv,  tcp_port,  udp_port,  transfers)
+        for name,  func,  number,  batch in benchmarks:
+            if pattern != None and pattern not in name:
+                continue
+            res = measure(func,  number,  batch)
+            results[name] = res
+            print('{:<30} {:>10} {:>12.0f} {:>10.2f} {:>10.2f}'.format(name,  res['calls'],  res['throughput'],  res['p50_us'],  res['p99_us']))
+    finally:
+        rcv.stop_thread()
+    return results
+
+def compare(results,  baseline,  threshold):
+    """
+    Print the change against a baseline, return the names of the benchmarks
+    of which the p50 latency grew more than -threshold- times
+    """
+    regressions = []
+    print('\n{:<30} {:>10} {:>10} {:>8}'.format('compared to baseline',  'p50 old',  'p50 new',  'ratio'))
+    for name,  res in results.items():
+        old = baseline['results'].get(name)
+        if old == None:
+            continue
+        ratio = res['p50_us'] / old['p50_us']
+        flag = ''
+        if ratio > threshold:
+            flag = ' regression'
+            regressions.append(name)
+        print('{:<30} {:>10.2f} {:>10.2f} {:>7.2f}x{}'.format(name,  old['p50_us'],  res['p50_us'],  ratio,  flag))
+    return regressions
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='dc09_spt benchmark suite')
+    parser.add_argument('--filter',  default=None,  help='only run benchmarks with this text in their name')
+    parser.add_argument('--scale',  type=float,  default=1.0,  help='multiply the number of calls of the micro benchmarks')
+    parser.add_argument('--transfers',  type=int,  default=2000,  help='number of calls of each transfer benchmark')
+    parser.add_argument('--save',  default=None,  help='save the results as JSON baseline to this file')
+    parser.add_argument('--compare',  default=None,  help='compare the results with this JSON baseline')
+    parser.add_argument('--threshold',  type=float,  default=1.25,  help='p50 ratio above which a benchmark counts as regression')
+    opts = parser.parse_args(args)
+    results = run(opts.filter,  opts.scale,  opts.transfers)
+    if opts.save != None:
+        with open(opts.save,  'w') as f:
+            json.dump({'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': results},  f,  indent=2)
+    if opts.compare != None:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+        if len(compare(results,  baseline,  opts.threshold)):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
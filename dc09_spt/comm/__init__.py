@@ -1,5 +1,6 @@
 from dc09_spt.comm.transpath import TransPath
 from dc09_spt.comm.transpathtcp import TransPathTCP
 from dc09_spt.comm.transpathudp import TransPathUDP
+from dc09_spt.comm.transpathaio import TransPathAio
 
-__all__ = ["TransPath", "TransPathTCP", "TransPathUDP"]
+__all__ = ["TransPath", "TransPathTCP", "TransPathUDP", "TransPathAio"]
@@ -0,0 +1,103 @@
+# ----------------------------
+# Circuit breaker of a transmission path
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import logging
+import threading
+import time
+
+class circuit_breaker:
+    """
+    Keep the senders away from a path that is known to be dead
+
+    closed
+        the path is used, -failures- transfers failing in a row open the breaker
+    open
+        the path is skipped when sending events, only the polls still use it
+    half-open
+        -reset- seconds after opening one event may try the path: when it gets an answer
+        the breaker closes, when it fails the breaker opens again for twice as long, at most -maximum-
+
+    A successful poll closes the breaker at once.
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self,  failures=3,  reset=30.0,  maximum=300.0,  name=''):
+        self.failures = failures
+        self.reset = reset
+        self.maximum = max(reset,  maximum)
+        self.name = name
+        self.state = self.CLOSED
+        self.failed = 0
+        self.open_time = reset
+        self.until = 0
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def usable(self):
+        """
+        True if an event may be sent over the path: closed, or open long enough for a trial
+        """
+        return self.state == self.CLOSED or time.monotonic() >= self.until
+
+    def attempt(self):
+        """
+        Called when a transfer over the path starts, the first one after the open time is the trial
+        while it runs the path is not usable for other events
+        """
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if self.state != self.CLOSED and now >= self.until:
+                if self.state == self.OPEN:
+                    self.state = self.HALF_OPEN
+                    logging.info('Path %s half-open, trying it again',  self.name)
+                # a trial that does not report back within -reset- does not block the next one
+                self.until = now + self.reset
+
+    def record(self,  ok):
+        """
+        Add the outcome of a transfer, -ok- when the receiver answered
+        """
+        if ok and self.state == self.CLOSED and self.failed == 0:
+            return
+        with self.lock:
+            if ok:
+                if self.state != self.CLOSED:
+                    logging.info('Path %s closed again',  self.name)
+                self.state = self.CLOSED
+                self.failed = 0
+                self.open_time = self.reset
+                return
+            self.failed += 1
+            if self.state == self.HALF_OPEN:
+                self.open_time = min(self.open_time * 2,  self.maximum)
+            elif self.state == self.CLOSED and self.failed < self.failures:
+                return
+            if self.state == self.CLOSED:
+                self.opened += 1
+                logging.warning('Path %s failed %s times, open for %.0f s',  self.name,  self.failed,  self.open_time)
+            self.state = self.OPEN
+            self.until = time.monotonic() + self.open_time
+
+    def snapshot(self):
+        with self.lock:
+            return {'state': self.state,  'failed': self.failed,  'opened': self.opened}
@@ -0,0 +1,246 @@
+# ----------------------------
+# Host resolution cache
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from dc09_spt import trace
+
+class host_cache:
+    """
+    Cache of the addresses of a receiver host, used by TransPath to connect
+
+    The addresses (A and AAAA records) are looked up once and kept for -ttl- seconds,
+    when that time is nearly over they are looked up again in the background so the transfers
+    do not wait for the name server, in a thread by resolve or in a task on the event loop
+    by the asyncio paths. When a lookup fails the last known addresses are used
+    for at most -stale- seconds after the last good lookup, tried again every -retry- seconds.
+
+    The addresses are tried in the order of getaddrinfo, starting with the one that worked last;
+    a path that fails on an address moves on to the next one.
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+    def __init__(self,  host,  port,  type='tcp',  ttl=300.0,  stale=86400.0,  retry=30.0):
+        """
+        parameters
+            host
+                IP address or DNS name of the receiver
+            port
+                port number of the receiver
+            type
+                'tcp' or 'udp'
+            ttl
+                seconds the looked up addresses are used, before they are looked up again
+            stale
+                seconds after the last good lookup the addresses are still used when lookups fail
+            retry
+                seconds between lookups while stale addresses are used
+        """
+        self.host = host
+        self.port = port
+        if type == 'udp':
+            self.socktype = socket.SOCK_DGRAM
+        else:
+            self.socktype = socket.SOCK_STREAM
+        self.ttl = ttl
+        self.stale = stale
+        self.retry = min(retry,  ttl)
+        try:
+            ipaddress.ip_address(host)
+            self.numeric = True
+        except ValueError:
+            self.numeric = False
+        self.addresses = []
+        self.current = 0
+        self.resolved = 0
+        self.expires = 0
+        self.refresh_at = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.lookup_lock = threading.Lock()
+        self.lookups = 0
+        self.failures = 0
+        self.stale_used = 0
+
+    def cached(self):
+        """
+        Return the cached addresses, or None when they have to be looked up first
+
+        When the addresses are about to expire refresh_due returns True, see resolve.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if len(self.addresses) == 0 or now >= self.expires:
+                return None
+            return self.addresses
+
+    def refresh_due(self):
+        """
+        Return True, once, when the cached addresses are to be looked up again in the background
+        the caller then runs refresh, or refresh_async on an event loop
+        """
+        now = time.monotonic()
+        with self.lock:
+            if len(self.addresses) == 0 or now < self.refresh_at or self.refreshing:
+                return False
+            self.refreshing = True
+            return True
+
+    def resolve(self):
+        """
+        Return the list of (family, sockaddr) of the host, ordered to be tried
+        raises OSError when the host can not be resolved and there are no stale addresses
+        """
+        addresses = self.cached()
+        if addresses == None:
+            addresses = self.lookup()
+        elif self.refresh_due():
+            threading.Thread(target=self.refresh,  daemon=True).start()
+        return self.order(addresses)
+
+    def lookup(self,  force=False):
+        """
+        Look up the addresses of the host, blocking
+        Without -force- a lookup that was just done by another thread is used.
+        """
+        with self.lookup_lock:
+            if not force:
+                addresses = self.cached()
+                if addresses != None:
+                    return addresses
+            self.lookup_begin()
+            try:
+                addresses = self.lookup_done(socket.getaddrinfo(self.host,  self.port,  socket.AF_UNSPEC,  self.socktype))
+            except OSError as e:
+                return self.lookup_failed(e)
+            return addresses
+
+    async def lookup_async(self,  loop,  force=False):
+        """
+        Look up the addresses of the host with loop.getaddrinfo, see lookup
+        """
+        if not force:
+            addresses = self.cached()
+            if addresses != None:
+                return addresses
+        self.lookup_begin()
+        try:
+            addresses = self.lookup_done(await loop.getaddrinfo(self.host,  self.port,  family=socket.AF_UNSPEC,  type=self.socktype))
+        except OSError as e:
+            return self.lookup_failed(e)
+        return addresses
+
+    def lookup_begin(self):
+        if trace.hooks:
+            trace.begin('dns',  host=self.host,  port=self.port)
+        self.lookups += 1
+
+    def lookup_done(self,  infos):
+        """
+        Keep the addresses of the getaddrinfo result -infos-
+        raises OSError when there are none
+        """
+        addresses = []
+        for family,  socktype,  proto,  canonname,  sockaddr in infos:
+            if (family,  sockaddr) not in addresses:
+                addresses.append((family,  sockaddr))
+        if len(addresses) == 0:
+            raise OSError('no addresses for host ' + str(self.host))
+        now = time.monotonic()
+        with self.lock:
+            if self.current < len(self.addresses) and self.addresses[self.current] in addresses:
+                self.current = addresses.index(self.addresses[self.current])
+            else:
+                self.current = 0
+            self.addresses = addresses
+            self.resolved = now
+            if self.numeric:
+                # an IP address does not change, it is never looked up again
+                self.expires = float('inf')
+                self.refresh_at = float('inf')
+            else:
+                self.expires = now + self.ttl
+                self.refresh_at = now + self.ttl * 0.8
+        if trace.hooks:
+            trace.end('dns',  addresses=len(addresses))
+        return addresses
+
+    def lookup_failed(self,  e):
+        """
+        Serve the stale addresses after a failed lookup, or raise the error
+        """
+        self.failures += 1
+        if trace.hooks:
+            trace.end('dns',  error=str(e))
+        now = time.monotonic()
+        with self.lock:
+            if len(self.addresses) and now - self.resolved < self.stale:
+                self.stale_used += 1
+                self.expires = now + self.retry
+                self.refresh_at = self.expires
+                logging.warning('Resolve host %s exception %s, using addresses of %.0f s ago',  self.host,  e,  now - self.resolved)
+                return self.addresses
+        raise e
+
+    def refresh(self):
+        try:
+            self.lookup(force=True)
+        except Exception as e:
+            logging.error('Resolve host %s exception %s',  self.host,  e)
+        finally:
+            self.refreshing = False
+
+    async def refresh_async(self,  loop):
+        try:
+            await self.lookup_async(loop,  force=True)
+        except Exception as e:
+            logging.error('Resolve host %s exception %s',  self.host,  e)
+        finally:
+            self.refreshing = False
+
+    def order(self,  addresses):
+        """
+        Return -addresses- starting with the current one
+        """
+        current = self.current
+        if current >= len(addresses):
+            current = 0
+        return addresses[current:] + addresses[:current]
+
+    def succeeded(self,  address):
+        with self.lock:
+            if address in self.addresses:
+                self.current = self.addresses.index(address)
+
+    def failed(self,  address):
+        """
+        Move to the next address after a failure on -address-
+        returns True when there is another address to try
+        """
+        with self.lock:
+            if len(self.addresses) < 2 or address not in self.addresses:
+                return False
+            if self.addresses.index(address) == self.current:
+                self.current = (self.current + 1) % len(self.addresses)
+                logging.warning('Host %s address %s failed, next is %s',  self.host,  address[1],  self.addresses[self.current][1])
+            return True
+
+    def counters(self):
+        return {'lookups': self.lookups,  'lookup failures': self.failures,  'stale used': self.stale_used,  'addresses': len(self.addresses)}
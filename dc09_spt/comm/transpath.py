@@ -4,14 +4,41 @@
 # Author : Jacq. van Ovost
 # ----------------------------
 import logging
+import time
+import threading
+from dc09_spt.msg.dc09_crypt import dc09_crypt
 from dc09_spt.comm.transpathtcp import TransPathTCP
-from dc09_spt.comm.transpathudp import TransPathUDP
+from dc09_spt.comm.transpathudp import TransPathUDP,  rtt_estimator
+from dc09_spt.comm.resolver import host_cache
+from dc09_spt.comm.breaker import circuit_breaker
+from dc09_spt.metrics import path_metrics,  path_health
+from dc09_spt import trace
 
 class TransPath:
     """
     Handle the basic tasks for establishing and maintaining a transmit path
     """
-    def __init__(self,  host,  port,  account, *, key=None,  receiver=None,  line=None,  timeout=5.0,  type=None):
+    def __init__(self,  host,  port,  account, *, key=None,  receiver=None,  line=None,  timeout=5.0,  type=None,  persistent=False,  idle_timeout=30.0,  dns_ttl=300.0,  dns_stale=86400.0,  breaker_failures=3,  breaker_reset=30.0):
+        """
+        parameters
+            persistent
+                keep the (TCP) connection open between transfers and reuse it
+            idle_timeout
+                close a persistent connection that is not used for this many seconds
+            dns_ttl
+                seconds the addresses of the host are cached, they are refreshed in the background
+            dns_stale
+                seconds the cached addresses are still used when the name server fails
+            breaker_failures
+                number of failed transfers in a row after which events skip this path, see circuit_breaker
+            breaker_reset
+                seconds before an event tries a skipped path again
+        note
+            an UDP path always keeps its socket, and estimates the round trip time
+            to decide when a block is repeated
+            when the host has several addresses a failing connect, or an UDP exchange without answer,
+            moves the path to the next address
+        """
         self.path_ok = 0
         self.host = host
         self.port = port
@@ -25,6 +52,24 @@ class TransPath:
         self.account = account
         self.key = key
         self.line = line
+        if key != None:
+            self.crypt = dc09_crypt(key)
+        else:
+            self.crypt = None
+        self.persistent = persistent
+        self.idle_timeout = idle_timeout
+        self.conn = None
+        self.conn_used = 0
+        self.conn_reused = False
+        self.conn_lock = threading.Lock()
+        self.connects = 0
+        self.reconnects = 0
+        self.reuses = 0
+        self.metrics = path_metrics()
+        self.health = path_health(timeout=timeout)
+        self.rtt = rtt_estimator(timeout / 5,  maximum=timeout / 2)
+        self.dns = host_cache(host,  port,  self.type,  dns_ttl,  dns_stale)
+        self.breaker = circuit_breaker(breaker_failures,  breaker_reset,  name='{}:{}'.format(host,  port))
 
     def set_offset(self, offset):
         self.offset = offset
@@ -34,6 +79,9 @@ class TransPath:
     
     def get_key(self):
         return self.key
+
+    def get_crypt(self):
+        return self.crypt
     
     def get_receiver(self):
         return self.receiver
@@ -44,22 +92,187 @@ class TransPath:
     def get_account(self):
         return self.account
 
+    def open(self):
+        """
+        Open a connection to the first address of the host that accepts it
+        """
+        if self.type not in ('tcp',  'udp'):
+            logging.error('Undefined connection type : %s',  self.type)
+            return None
+        try:
+            addresses = self.dns.resolve()
+        except Exception as e:
+            logging.error('Resolve host %s exception %s',  self.host,  e)
+            return None
+        for address in addresses:
+            if self.type == 'tcp':
+                conn = TransPathTCP(self.host, self.port,  self.timeout,  address)
+            else:
+                conn = TransPathUDP(self.host, self.port,  self.timeout,  self.rtt,  address)
+            if conn.connect() != None:
+                self.dns.succeeded(address)
+                self.connects += 1
+                return conn
+            self.dns.failed(address)
+        return None
+
     def connect(self):
-        if self.type == 'tcp':
-            conn = TransPathTCP(self.host, self.port)
-        elif self.type == 'udp':
-            conn = TransPathUDP(self.host, self.port)
+        """
+        Return a connection to the receiver
+        
+        For a persistent TCP path and an UDP path the open connection is reused if it is still alive,
+        the path stays locked for other users until disconnect is called.
+        returns None when no connection could be made
+        """
+        if trace.hooks:
+            trace.begin('connect',  host=self.host,  port=self.port)
+        if not self.keep_open():
+            conn = self.open()
         else:
-            conn = None
-            logging.error('Undefined connection type : %s',  self.type)
-        if conn != None:
-            conn.connect()
+            conn = self.persistent_conn()
+        if trace.hooks:
+            trace.end('connect',  reused=self.reused(),  connected=conn != None)
         return conn
-        
+
+    def persistent_conn(self):
+        """
+        Return the kept open connection, or a new one when it is idle too long or closed
+        the path lock is held when a connection is returned, and released on failure or exception
+        """
+        self.conn_lock.acquire()
+        try:
+            conn = self.conn
+            if conn != None:
+                if time.monotonic() - self.conn_used > self.idle_timeout:
+                    logging.debug('Close idle connection to host %s port %s',  self.host,  self.port)
+                    self.conn = None
+                    conn.disconnect()
+                    conn = None
+                elif not conn.alive():
+                    logging.debug('Connection to host %s port %s closed by peer',  self.host,  self.port)
+                    self.conn = None
+                    conn.disconnect()
+                    conn = None
+                    self.reconnects += 1
+                else:
+                    self.reuses += 1
+                    self.conn_reused = True
+                    return conn
+            self.conn_reused = False
+            self.conn = self.open()
+        except BaseException:
+            self.conn = None
+            self.conn_lock.release()
+            raise
+        if self.conn == None:
+            self.conn_lock.release()
+        return self.conn
+
+    def keep_open(self):
+        """
+        True if the connection is kept open between transfers
+        """
+        return self.type == 'udp' or (self.persistent and self.type == 'tcp')
+
+    def reused(self):
+        """
+        True if the last connection given by connect was a reused TCP connection,
+        which may have been closed by the receiver in the mean time
+        """
+        return self.persistent and self.type == 'tcp' and self.conn_reused
+
+    def reconnect(self,  conn):
+        """
+        Replace a (persistent) connection that turned out to be dead
+        the caller keeps the path lock, call disconnect with the returned value
+        """
+        try:
+            if conn != None:
+                if conn is self.conn:
+                    self.conn = None
+                conn.disconnect()
+            self.reconnects += 1
+            self.conn_reused = False
+            conn = self.open()
+        except BaseException:
+            if self.keep_open():
+                self.conn = None
+                self.conn_lock.release()
+            raise
+        if self.keep_open():
+            self.conn = conn
+            if conn == None:
+                self.conn_lock.release()
+        return conn
+
     def disconnect(self,  conn):
-        if conn != None:
+        if self.keep_open():
+            if conn != None and conn is self.conn:
+                if conn.s == None:
+                    self.conn = None
+                else:
+                    self.conn_used = time.monotonic()
+                self.conn_lock.release()
+        elif conn != None:
             conn.disconnect()
 
+    def close(self):
+        """
+        Close a kept open connection
+        """
+        with self.conn_lock:
+            if self.conn != None:
+                self.conn.disconnect()
+                self.conn = None
+
+    def exchange(self,  conn,  msg,  length=1024,  msg_nr=None):
+        """
+        Send a block and wait for the answer, the send and receive times are kept in the metrics
+        on UDP only the answer to -msg_nr- is accepted
+        
+        returns the answer, or None on a timeout
+        """
+        start = time.perf_counter()
+        if self.type == 'tcp':
+            if trace.hooks:
+                trace.begin('send',  host=self.host,  port=self.port,  length=len(msg))
+            conn.send(msg)
+            sent = time.perf_counter()
+            self.metrics.observe('send',  sent - start)
+            if trace.hooks:
+                trace.end('send')
+                trace.begin('receive',  host=self.host,  port=self.port)
+            antw = conn.receive(length)
+        else:
+            sent = start
+            if trace.hooks:
+                trace.begin('receive',  host=self.host,  port=self.port,  length=len(msg))
+            antw = conn.sendAndReceive(msg,  length,  msg_nr)
+            if conn.retransmits:
+                self.metrics.count('retry',  conn.retransmits)
+            if antw == None and self.dns.failed(conn.address):
+                # try the next address of the host on the next exchange
+                conn.disconnect()
+        self.metrics.observe('receive',  time.perf_counter() - sent)
+        if trace.hooks:
+            trace.end('receive',  answered=antw != None)
+        if antw == None or len(antw) == 0:
+            self.metrics.count('timeout')
+            return None
+        return antw
+
+    def counters(self):
+        """
+        Return the connection counters of this path
+        """
+        return {'connects': self.connects,  'reconnects': self.reconnects,  'reuses': self.reuses}
+
+    def dns_counters(self):
+        """
+        Return the name resolution counters of this path
+        """
+        return self.dns.counters()
+
 # --------------------------
 # return path status
 # ----------------------
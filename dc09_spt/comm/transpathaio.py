@@ -0,0 +1,372 @@
+# ----------------------------
+# Transmit classes for asyncio
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import asyncio
+import logging
+import socket
+import time
+from collections import deque
+from dc09_spt.comm.transpath import TransPath
+from dc09_spt.comm.transpathudp import rtt_estimator,  answer_matches,  answer_nr,  answer_sample
+from dc09_spt import trace
+
+class TransPathAioTCP:
+    """
+    TCP connection using asyncio streams
+    """
+    def __init__(self, host, port,  timeout=5,  address=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.address = address
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        try:
+            if self.address != None:
+                family,  sockaddr = self.address
+                coro = asyncio.open_connection(sockaddr[0],  sockaddr[1],  family=family,  flags=socket.AI_NUMERICHOST)
+            else:
+                coro = asyncio.open_connection(self.host, self.port)
+            self.reader,  self.writer = await asyncio.wait_for(coro,  self.timeout)
+        except Exception as e:
+            self.writer = None
+            if self.address != None:
+                logging.error('TCP Connect to host %s address %s port %s exception %s',  self.host,  self.address[1][0],  self.port,  e)
+            else:
+                logging.error('TCP Connect to host %s port %s exception %s',  self.host,  self.port,  e)
+        return self.writer
+
+    def alive(self):
+        return self.writer != None and not self.writer.is_closing() and not self.reader.at_eof()
+
+    async def send(self, msg):
+        if self.writer != None:
+            try:
+                self.writer.write(msg)
+                await asyncio.wait_for(self.writer.drain(),  self.timeout)
+            except Exception as e:
+                self.close()
+                logging.error('TCP send message to host %s port %s exception %s',  self.host, self.port, e)
+
+    async def receive(self, length=1024):
+        antw = None
+        if self.writer != None:
+            try:
+                antw = await asyncio.wait_for(self.reader.read(length),  self.timeout)
+                if len(antw) == 0:
+                    antw = None
+                    self.close()
+            except Exception as e:
+                self.close()
+                logging.error('TCP receive message from host %s port %s exception %s',  self.host, self.port, e)
+        return antw
+
+    async def sendAndReceive(self, msg, max_answ=1024):
+        await self.send(msg)
+        return await self.receive(max_answ)
+
+    def close(self):
+        if self.writer != None:
+            self.writer.close()
+            self.writer = None
+
+    async def disconnect(self):
+        writer = self.writer
+        self.close()
+        if writer != None:
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+class _udp_protocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.received = deque(maxlen=16)
+        self.waiter = None
+
+    def datagram_received(self,  data,  addr):
+        self.received.append(data)
+        if self.waiter != None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def error_received(self,  exc):
+        logging.debug('UDP error received %s',  exc)
+
+class TransPathAioUDP:
+    """
+    UDP socket using an asyncio datagram endpoint, see TransPathUDP
+    """
+    def __init__(self, host, port,  timeout=5,  rtt=None,  address=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.address = address
+        if rtt == None:
+            rtt = rtt_estimator(timeout / 5,  maximum=timeout / 2)
+        self.rtt = rtt
+        self.retransmits = 0
+        self.transport = None
+        self.protocol = None
+
+    async def connect(self):
+        try:
+            loop = asyncio.get_running_loop()
+            if self.address != None:
+                family,  sockaddr = self.address
+                self.transport,  self.protocol = await loop.create_datagram_endpoint(_udp_protocol,  remote_addr=sockaddr,  family=family)
+            else:
+                self.transport,  self.protocol = await loop.create_datagram_endpoint(_udp_protocol,  remote_addr=(self.host,  self.port))
+        except Exception as e:
+            self.transport = None
+            logging.error('UDP Socket creation exception %s',  e)
+        return self.transport
+
+    def alive(self):
+        return self.transport != None and not self.transport.is_closing()
+
+    async def send(self, msg):
+        if self.transport != None:
+            self.transport.sendto(msg)
+
+    async def receive(self, length=1024):
+        antw = None
+        if self.transport != None:
+            antw = await self.wait(time.monotonic() + self.timeout,  None)
+            if antw == None:
+                logging.error('UDP receive message from host %s port %s timeout',  self.host,  self.port)
+        return antw
+
+    async def sendAndReceive(self, msg,  max_antw=1024,  msg_nr=None):
+        """
+        Send a block and wait for its answer, see TransPathUDP.sendAndReceive
+        """
+        antw = None
+        self.retransmits = 0
+        if self.transport != None:
+            deadline = time.monotonic() + self.timeout
+            rto = self.rtt.rto
+            self.protocol.received.clear()
+            while antw == None:
+                sent = time.monotonic()
+                if sent >= deadline:
+                    break
+                self.transport.sendto(msg)
+                antw = await self.wait(min(sent + rto,  deadline),  msg_nr)
+                if antw == None:
+                    rto = self.rtt.backoff(rto)
+                    self.retransmits += 1
+            if antw != None:
+                if self.retransmits == 0:
+                    if answer_sample(antw,  msg_nr):
+                        self.rtt.sample(time.monotonic() - sent)
+                else:
+                    self.rtt.keep(rto)
+            else:
+                self.retransmits -= 1
+                self.rtt.keep(rto)
+                logging.error('UDP message exchange to host %s port %s timeout',  self.host,  self.port )
+        return antw
+
+    async def wait(self,  until,  msg_nr):
+        """
+        Wait until -until- for the answer to -msg_nr-, returns None when it did not come
+        a NAK received in the mean time is returned when no matching answer came, see TransPathUDP.wait
+        """
+        loop = asyncio.get_running_loop()
+        received = self.protocol.received
+        nak = None
+        while True:
+            while len(received):
+                antw = received.popleft()
+                if answer_matches(antw,  msg_nr):
+                    return antw
+                if nak == None and answer_nr(antw) == 0:
+                    nak = antw
+                    continue
+                logging.debug('UDP discarded answer %s from host %s port %s while waiting for message nr %s',  antw,  self.host,  self.port,  msg_nr)
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                return nak
+            self.protocol.waiter = loop.create_future()
+            try:
+                await asyncio.wait_for(self.protocol.waiter,  remaining)
+            except asyncio.TimeoutError:
+                return nak
+
+    def close(self):
+        if self.transport != None:
+            self.transport.close()
+            self.transport = None
+
+    async def disconnect(self):
+        self.close()
+
+class TransPathAio(TransPath):
+    """
+    Transmission path for use with asyncio
+
+    The configuration is the same as TransPath, connect and disconnect are coroutines
+    """
+    def __init__(self,  host,  port,  account, **kwargs):
+        TransPath.__init__(self,  host,  port,  account,  **kwargs)
+        self.aio_lock = None
+        self.refresh_task = None
+
+    async def open(self):
+        if self.type not in ('tcp',  'udp'):
+            logging.error('Undefined connection type : %s',  self.type)
+            return None
+        try:
+            loop = asyncio.get_running_loop()
+            addresses = self.dns.cached()
+            if addresses == None:
+                addresses = await self.dns.lookup_async(loop)
+            elif self.dns.refresh_due():
+                # look up again in the background, on the loop instead of in a thread
+                self.refresh_task = loop.create_task(self.dns.refresh_async(loop))
+            addresses = self.dns.order(addresses)
+        except Exception as e:
+            logging.error('Resolve host %s exception %s',  self.host,  e)
+            return None
+        for address in addresses:
+            if self.type == 'tcp':
+                conn = TransPathAioTCP(self.host, self.port,  self.timeout,  address)
+            else:
+                conn = TransPathAioUDP(self.host, self.port,  self.timeout,  self.rtt,  address)
+            try:
+                connected = await conn.connect()
+            except BaseException:
+                # cancelled while connecting, do not leave the socket behind
+                conn.close()
+                raise
+            if connected != None:
+                self.dns.succeeded(address)
+                self.connects += 1
+                return conn
+            self.dns.failed(address)
+        return None
+
+    async def connect(self):
+        """
+        Return a connection to the receiver, see TransPath.connect
+        """
+        if trace.hooks:
+            trace.begin('connect',  host=self.host,  port=self.port)
+        if not self.keep_open():
+            conn = await self.open()
+        else:
+            conn = await self.persistent_conn()
+        if trace.hooks:
+            trace.end('connect',  reused=self.reused(),  connected=conn != None)
+        return conn
+
+    async def persistent_conn(self):
+        """
+        Return the kept connection with aio_lock held, see TransPath.persistent_conn
+
+        The lock is released again when no connection is returned,
+        also when the task is cancelled while (re)connecting
+        """
+        if self.aio_lock == None:
+            self.aio_lock = asyncio.Lock()
+        await self.aio_lock.acquire()
+        try:
+            conn = self.conn
+            if conn != None:
+                if time.monotonic() - self.conn_used > self.idle_timeout:
+                    self.conn = None
+                    await conn.disconnect()
+                    conn = None
+                elif not conn.alive():
+                    self.conn = None
+                    await conn.disconnect()
+                    conn = None
+                    self.reconnects += 1
+                else:
+                    self.reuses += 1
+                    self.conn_reused = True
+                    return conn
+            self.conn_reused = False
+            self.conn = await self.open()
+        except BaseException:
+            self.conn = None
+            self.aio_lock.release()
+            raise
+        if self.conn == None:
+            self.aio_lock.release()
+        return self.conn
+
+    async def reconnect(self,  conn):
+        """
+        Replace a failed connection, see TransPath.reconnect
+        """
+        try:
+            if conn != None:
+                if conn is self.conn:
+                    self.conn = None
+                await conn.disconnect()
+            self.reconnects += 1
+            self.conn_reused = False
+            conn = await self.open()
+        except BaseException:
+            if self.keep_open():
+                self.conn = None
+                self.aio_lock.release()
+            raise
+        if self.keep_open():
+            self.conn = conn
+            if conn == None:
+                self.aio_lock.release()
+        return conn
+
+    async def disconnect(self,  conn):
+        if self.keep_open():
+            if conn != None and conn is self.conn:
+                if not conn.alive():
+                    self.conn = None
+                else:
+                    self.conn_used = time.monotonic()
+                self.aio_lock.release()
+        elif conn != None:
+            await conn.disconnect()
+
+    async def exchange(self,  conn,  msg,  length=1024,  msg_nr=None):
+        """
+        Send a block and wait for the answer, see TransPath.exchange
+        """
+        start = time.perf_counter()
+        if self.type == 'tcp':
+            if trace.hooks:
+                trace.begin('send',  host=self.host,  port=self.port,  length=len(msg))
+            await conn.send(msg)
+            sent = time.perf_counter()
+            self.metrics.observe('send',  sent - start)
+            if trace.hooks:
+                trace.end('send')
+                trace.begin('receive',  host=self.host,  port=self.port)
+            antw = await conn.receive(length)
+        else:
+            sent = start
+            if trace.hooks:
+                trace.begin('receive',  host=self.host,  port=self.port,  length=len(msg))
+            antw = await conn.sendAndReceive(msg,  length,  msg_nr)
+            if conn.retransmits:
+                self.metrics.count('retry',  conn.retransmits)
+            if antw == None and self.dns.failed(conn.address):
+                conn.close()
+        self.metrics.observe('receive',  time.perf_counter() - sent)
+        if trace.hooks:
+            trace.end('receive',  answered=antw != None)
+        if antw == None or len(antw) == 0:
+            self.metrics.count('timeout')
+            return None
+        return antw
+
+    async def close(self):
+        if self.conn != None:
+            await self.conn.disconnect()
+            self.conn = None
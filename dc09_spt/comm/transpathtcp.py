@@ -4,31 +4,42 @@
 # Author : Jacq. van Ovost
 # ----------------------------
 import socket
+import select
 import logging
 
 class TransPathTCP:
-    def __init__(self, host, port,  timeout=5):
+    def __init__(self, host, port,  timeout=5,  address=None):
+        """
+        -address- is an optional (family, sockaddr) of the host to connect to, as given by getaddrinfo
+        """
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.address = address
         self.s = None
 
     def connect(self):
+        if self.address != None:
+            family,  sockaddr = self.address
+        else:
+            family,  sockaddr = socket.AF_INET,  (self.host, self.port)
         try:
-            self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.s = socket.socket(family, socket.SOCK_STREAM)
             self.s.settimeout(self.timeout)
-            self.s.connect((self.host, self.port))
+            self.s.connect(sockaddr)
         except Exception as e:
+            if self.s != None:
+                self.s.close()
             self.s = None
-            logging.error('TCP Connect to host %s port %s exception %s',  self.host,  self.port,  e)
+            logging.error('TCP Connect to host %s address %s port %s exception %s',  self.host,  sockaddr[0],  self.port,  e)
         return self.s
         
     def send(self, msg):
         if self.s != None:
             try:
-                self.s.send(msg)
+                self.s.sendall(msg)
             except Exception as e:
-                self.s = None
+                self.disconnect()
                 logging.error('TCP send message to host %s port %s exception %s',  self.host, self.port, e)
     
     def receive(self, length=1024):
@@ -37,7 +48,7 @@ class TransPathTCP:
             try:
                 antw=self.s.recv(length)
             except Exception as e:
-                self.s = None
+                self.disconnect()
                 logging.error('TCP receive message from host %s port %s exception %s',  self.host, self.port, e)
         return antw
 
@@ -45,17 +56,34 @@ class TransPathTCP:
         antw = None
         if self.s != None:
             try:
-                self.s.send(msg)
+                self.s.sendall(msg)
             except Exception as e:
-                self.s = None
+                self.disconnect()
                 logging.error('TCP send message to host %s port %s exception %s',  self.host, self.port, e)
+                return antw
             try:
                 antw=self.s.recv(max_answ)
             except Exception as e:
-                self.s = None
+                self.disconnect()
                 logging.error('TCP receive message from host %s port %s exception %s',  self.host, self.port, e)
         return antw
 
+    def alive(self):
+        """
+        Check without blocking if the connection is still usable.
+        A connection closed or reset by the peer, or with unexpected data waiting, is not.
+        """
+        if self.s == None:
+            return False
+        try:
+            readable, writable, error = select.select([self.s], [], [], 0)
+            if readable:
+                return False
+        except Exception as e:
+            logging.debug('TCP connection check host %s port %s exception %s',  self.host,  self.port,  e)
+            return False
+        return True
+
     def disconnect(self):
         if self.s != None:
             self.s.close()
@@ -4,69 +4,216 @@
 # Author : Jacq. van Ovost
 # ----------------------------
 import socket
+import time
 import logging
+from dc09_spt.msg.dc09_msg import dc09_msg
+
+class rtt_estimator:
+    """
+    Estimate the round trip time of a path and derive the retransmission timeout
+
+    The smoothed round trip time and its variation are kept as in RFC 6298,
+    the timeout is srtt + 4 * rttvar, limited to [minimum, maximum].
+    Only ACK and DUH answers to blocks that were sent once are used as sample (Karn's algorithm).
+    After an exchange with repeats the backed off timeout is kept until the next sample.
+    """
+    def __init__(self,  initial=1.0,  minimum=0.2,  maximum=5.0):
+        self.minimum = minimum
+        self.maximum = max(minimum,  maximum)
+        self.srtt = None
+        self.rttvar = None
+        self.rto = min(max(initial,  minimum),  self.maximum)
+
+    def sample(self,  rtt):
+        if self.srtt == None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar,  self.minimum),  self.maximum)
+
+    def backoff(self,  rto):
+        """
+        Return the timeout after -rto- expired
+        """
+        return min(rto * 2,  self.maximum)
+
+    def keep(self,  rto):
+        """
+        Keep the backed off timeout -rto- after an exchange with repeats
+        """
+        self.rto = rto
+
+def answer_nr(antw):
+    """
+    Return the message number of the answer block -antw-, None when it is not an answer
+    a NAK carries message number 0
+    """
+    try:
+        return dc09_msg.dc09answer_nr(antw)
+    except Exception:
+        return None
+
+def answer_matches(antw,  msg_nr):
+    """
+    True if the answer block -antw- is the answer to message -msg_nr-
+
+    A NAK does not match, it carries message number 0 and may be a late answer to an earlier block.
+    The waiting loops keep a NAK aside and only return it when no matching answer came
+    before the block would be repeated.
+    """
+    return msg_nr == None or answer_nr(antw) == msg_nr
+
+def answer_sample(antw,  msg_nr):
+    """
+    True if the answer block -antw- may be used as round trip time sample of a block sent once:
+    an ACK or DUH to message -msg_nr-
+
+    A NAK is kept aside until the block would be repeated, its time says nothing about the path.
+    """
+    try:
+        kind = bytes(antw[11:14]) if antw[10] == 0x2a else bytes(antw[10:13])
+    except IndexError:
+        return False
+    return kind in (b'ACK',  b'DUH') and answer_matches(antw,  msg_nr)
 
 class TransPathUDP:
-    def __init__(self, host, port,  timeout=5):
+    """
+    UDP socket connected to the receiver, kept by TransPath for all exchanges of the path
+    """
+    def __init__(self, host, port,  timeout=5,  rtt=None,  address=None):
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.address = address
+        if rtt == None:
+            rtt = rtt_estimator(timeout / 5,  maximum=timeout / 2)
+        self.rtt = rtt
+        self.retransmits = 0
         self.s = None
 
     def connect(self):
+        if self.address != None:
+            family,  sockaddr = self.address
+        else:
+            family,  sockaddr = socket.AF_INET,  (self.host, self.port)
         try:
-            self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.s.settimeout(self.timeout)
+            self.s = socket.socket(family, socket.SOCK_DGRAM)
+            self.s.connect(sockaddr)
         except Exception as e:
+            if self.s != None:
+                self.s.close()
             self.s = None
             logging.error('UDP Socket creation exception %s',  e)
         return self.s
-        
+
+    def alive(self):
+        return self.s != None
+
     def send(self, msg):
         if self.s != None:
             try:
-                self.s.sendto(msg, (self.host, self.port))
+                self.s.send(msg)
             except Exception as e:
-                self.s = None
+                self.disconnect()
                 logging.error('UDP send message to host %s port %s exception %s',  self.host,  self.port,  e)
     
     def receive(self, length=1024):
         antw = None
         if self.s != None:
             try:
-                antw,  sender =self.s.recvfrom(length)
+                self.s.settimeout(self.timeout)
+                antw = self.s.recv(length)
             except Exception as e:
-                self.s = None
+                self.disconnect()
                 logging.error('UDP receive message from host %s port %s exception %s',  self.host,  self.port,  e)
         return antw
 
-    def sendAndReceive(self, msg,  max_antw=1024):
+    def sendAndReceive(self, msg,  max_antw=1024,  msg_nr=None):
+        """
+        Send a block and wait for its answer, repeat the block when no answer comes in time
+        
+        The first repeat is after the retransmission timeout of the path, every next one
+        waits twice as long, until -timeout- seconds have passed.
+        Datagrams that are not an answer to -msg_nr- (late answers to an earlier block)
+        are discarded, as are datagrams that were waiting before the block was sent.
+        A NAK is only used when no matching answer arrives before the block would be repeated.
+        """
         antw = None
+        self.retransmits = 0
         if self.s != None:
+            deadline = time.monotonic() + self.timeout
+            rto = self.rtt.rto
             try:
-                self.s.settimeout(self.timeout / 5)
-                for x in range(5):
-                    try:
-                        self.s.sendto(msg, (self.host, self.port))
-                        antw,  sender = self.s.recvfrom(max_antw)
-                        if sender[1] != self.port:
-                           antw=None 
-                    except Exception as e:
-                        if e != TimeoutError:
-                            raise
-                        else:
-                            pass
-                    else:
+                self.flush(max_antw)
+                while antw == None:
+                    sent = time.monotonic()
+                    if sent >= deadline:
                         break
+                    if self.retransmits:
+                        logging.debug('UDP repeat message to host %s port %s after %.3f s',  self.host,  self.port,  rto)
+                    self.s.send(msg)
+                    antw = self.wait(min(sent + rto,  deadline),  max_antw,  msg_nr)
+                    if antw == None:
+                        rto = self.rtt.backoff(rto)
+                        self.retransmits += 1
+                if antw != None:
+                    if self.retransmits == 0:
+                        if answer_sample(antw,  msg_nr):
+                            self.rtt.sample(time.monotonic() - sent)
+                    else:
+                        self.rtt.keep(rto)
+                else:
+                    self.retransmits -= 1
+                    self.rtt.keep(rto)
             except Exception as e:
-                self.s = None
+                antw = None
+                self.disconnect()
                 logging.error('UDP message exchange to host %s port %s exception %s',  self.host,  self.port,  e)
             if antw == None:
                 logging.error('UDP message exchange to host %s port %s timeout',  self.host,  self.port )
         return antw
 
+    def flush(self,  max_antw):
+        """
+        Discard the datagrams received before a block is sent, they can not be its answer
+        """
+        self.s.setblocking(False)
+        try:
+            while True:
+                antw = self.s.recv(max_antw)
+                logging.debug('UDP discarded late answer %s from host %s port %s',  antw,  self.host,  self.port)
+        except (BlockingIOError,  ConnectionRefusedError):
+            pass
+
+    def wait(self,  until,  max_antw,  msg_nr):
+        """
+        Wait until -until- for the answer to -msg_nr-, returns None when it did not come
+        a NAK received in the mean time is returned when no matching answer came
+        """
+        nak = None
+        while True:
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                return nak
+            self.s.settimeout(remaining)
+            try:
+                antw = self.s.recv(max_antw)
+            except socket.timeout:
+                return nak
+            except ConnectionRefusedError:
+                # port unreachable, the receiver may be restarting
+                time.sleep(max(0,  until - time.monotonic()))
+                return nak
+            if answer_matches(antw,  msg_nr):
+                return antw
+            if nak == None and answer_nr(antw) == 0:
+                nak = antw
+                continue
+            logging.debug('UDP discarded answer %s from host %s port %s while waiting for message nr %s',  antw,  self.host,  self.port,  msg_nr)
+
     def disconnect(self):
         if self.s != None:
             self.s.close()
             self.s=None
-
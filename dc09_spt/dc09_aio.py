@@ -0,0 +1,440 @@
+# ----------------------------
+# Dialler class for asyncio
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+from dc09_spt.msg.dc09_msg import *
+import asyncio
+import time
+from collections import deque
+import logging
+from dc09_spt.dc09_base import dc09_base,  window_exchange
+from dc09_spt.comm.transpathaio import TransPathAio
+from dc09_spt import trace
+
+class dc09_aio_spt(dc09_base):
+    """
+    Handle the basic tasks of SPT (Secured Premises Transciever) on an asyncio event loop
+
+    The configuration is the same as for dc09_spt, both are in dc09_base, but instead of a poll
+    and a send thread per dialler, each dialler uses at most one poll task and one send task.
+    This allows many thousands of diallers to share one event loop.
+
+    All methods, except send_msg_threadsafe, must be called from the thread running the event loop.
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+    path_class = TransPathAio
+
+    def __init__(self,  account, receiver=None,  line=None,  *,  loop=None,  limiter=None):
+        """
+        Define a basic dialler (SPT Secure Premises Transceiver)
+
+        parameters
+            account
+                Account number to be used.
+                Most receivers expect a numeric string of 4 to 8 digits
+            receiver
+                an optional integer to be used as receiver number in the block header
+            line
+                an optional integer to be used as line number in the block header
+            loop
+                the event loop to use, default the running loop
+            limiter
+                an optional asyncio.Semaphore, shared between diallers,
+                to limit the number of simultaneous transfers
+        """
+        dc09_base.__init__(self,  account,  receiver,  line)
+        self.loop = loop
+        self.limiter = limiter
+        self.send_task = None
+        self.send_wakeup = None
+        self.poll_task = None
+        self.poll_wakeup = None
+
+    def get_loop(self):
+        if self.loop == None:
+            self.loop = asyncio.get_running_loop()
+        return self.loop
+
+    def wake_send(self):
+        """
+        Start the send task if not running or wake it up
+        """
+        if self.send_task == None or self.send_task.done():
+            self.send_task = self.get_loop().create_task(self.send_run())
+        elif self.send_wakeup != None:
+            self.send_wakeup.set()
+
+    def poll_changed(self):
+        """
+        Start the poll task or wake it up after a configuration change
+        """
+        if self.poll_task == None or self.poll_task.done():
+            if self.polls.active():
+                self.poll_wakeup = asyncio.Event()
+                self.poll_task = self.get_loop().create_task(self.poll_run())
+        else:
+            self.poll_wakeup.set()
+
+    def poll_running(self):
+        return self.poll_task != None and not self.poll_task.done()
+
+    def send_active(self):
+        if self.send_task == None:
+            return None
+        return int(not self.send_task.done())
+
+    def send_msg_threadsafe(self,  type,  param,  priority=None):
+        """
+        Schedule a message for sending from a thread not running the event loop
+
+        parameters
+            as for send_msg
+        note
+            the event loop must be known, pass it as -loop- or use the dialler on its loop first,
+            otherwise RuntimeError is raised
+        """
+        if self.loop == None:
+            raise RuntimeError('dialler %s has no event loop yet, pass loop= or use it on its loop first' % self.account)
+        self.loop.call_soon_threadsafe(self.send_msg,  type,  param,  priority)
+
+    async def close(self):
+        """
+        Stop polling and sending and close all kept open connections
+        """
+        for task in (self.poll_task,  self.send_task):
+            if task != None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        for mb in ('main',  'back-up'):
+            for ps in ('primary',  'secondary'):
+                if self.tpaths[mb][ps]['path'] != None:
+                    await self.tpaths[mb][ps]['path'].close()
+
+    async def transfer_msg(self,  msg_nr,  type,  message,  path,  answers=None):
+        """
+        Transfer a message and decode the answer, see dc09_spt.transfer_msg
+        """
+        if self.limiter != None:
+            async with self.limiter:
+                return await self.transfer(msg_nr,  type,  message,  path,  answers)
+        return await self.transfer(msg_nr,  type,  message,  path,  answers)
+
+    async def transfer(self,  msg_nr,  type,  message,  path,  answers=None):
+        ret = 0
+        answered = 0
+        if trace.hooks:
+            trace.begin('transfer_msg',  msg_nr,  type=type,  host=path.host,  port=path.port)
+        metrics = path.metrics
+        start = time.perf_counter()
+        dc09 = dc09_msg(path.get_account(), path.get_key(), path.get_receiver(), path.get_line(), path.get_offset(), crypt=path.get_crypt())
+        mesg = str.encode(dc09.dc09block(msg_nr, type,  message))
+        connecting = time.perf_counter()
+        path.breaker.attempt()
+        conn = None
+        try:
+            # inside the try, a race lost while connecting still disconnects
+            conn = await path.connect()
+            metrics.observe('connect',  time.perf_counter() - connecting)
+            if conn == None:
+                metrics.count('error')
+            else:
+                antw = await path.exchange(conn,  mesg,  512,  msg_nr)
+                if antw == None and path.reused():
+                    metrics.count('retry')
+                    conn = await path.reconnect(conn)
+                    if conn != None:
+                        antw = await path.exchange(conn,  mesg,  512,  msg_nr)
+                if antw != None:
+                    answered = 1
+                    res = dc09.dc09answer(msg_nr,  antw)
+                    metrics.count(res[0])
+                    if res[1] != None:
+                        path.set_offset(res[1])
+                    if res[0] == 'NAK' and res[1] != None:
+                        if trace.hooks:
+                            trace.begin('nak resync',  msg_nr,  offset=res[1])
+                        dc09.set_offset(res[1])
+                        metrics.count('retry')
+                        mesg = str.encode(dc09.dc09block(msg_nr, type,  message))
+                        antw = await path.exchange(conn,  mesg,  1024,  msg_nr)
+                        if antw != None:
+                            res = dc09.dc09answer(msg_nr,  antw)
+                            metrics.count(res[0])
+                        if trace.hooks:
+                            trace.end('nak resync',  msg_nr)
+                    if res[0] == 'ACK':
+                        ret = 1
+                    if answers != None:
+                        answers.append(res[0])
+                logging.debug('Sent message nr %s type %s content %s to %s port %s answer %s',  msg_nr, type,  message,  path.host,  path.port,  antw)
+                metrics.observe('total',  time.perf_counter() - start)
+        except asyncio.CancelledError:
+            # lost a race, the answer may still arrive so the connection can not be reused
+            if conn != None:
+                conn.close()
+            if trace.hooks:
+                trace.end('transfer_msg',  msg_nr,  result='cancelled')
+            raise
+        except Exception as e:
+            metrics.count('error')
+            logging.error('Message nr %s to host %s port %s exception %s',  msg_nr,  path.host,  path.port,  e)
+        finally:
+            await path.disconnect(conn)
+        self.transfer_done(path,  msg_nr,  ret,  answered,  start)
+        if trace.hooks:
+            trace.end('transfer_msg',  msg_nr,  result=ret)
+        return ret
+
+    async def transfer_window(self,  messages,  path,  rejected=None):
+        """
+        Transfer a number of messages at once over a TCP path, see dc09_spt.transfer_window
+        """
+        if path.type != 'tcp':
+            # no pipelining on UDP, stop at the first failure
+            acked = set()
+            for mess in messages:
+                answers = []
+                if await self.transfer_msg(mess[0],  mess[1],  mess[2],  path,  answers):
+                    acked.add(mess[0])
+                elif len(answers) and rejected != None:
+                    rejected[mess[0]] = answers[-1]
+                else:
+                    break
+            return acked
+        if self.limiter != None:
+            async with self.limiter:
+                return await self.transfer_blocks(messages,  path,  rejected)
+        return await self.transfer_blocks(messages,  path,  rejected)
+
+    async def transfer_blocks(self,  messages,  path,  rejected):
+        dc09 = dc09_msg(path.get_account(), path.get_key(), path.get_receiver(), path.get_line(), path.get_offset(), crypt=path.get_crypt())
+        if trace.hooks:
+            trace.begin('transfer_window',  messages[0][0],  count=len(messages),  host=path.host,  port=path.port)
+        metrics = path.metrics
+        start = time.perf_counter()
+        exchange = window_exchange(dc09,  messages,  path,  rejected)
+        connecting = time.perf_counter()
+        path.breaker.attempt()
+        conn = None
+        try:
+            conn = await path.connect()
+            metrics.observe('connect',  time.perf_counter() - connecting)
+            if conn == None:
+                metrics.count('error')
+            else:
+                block = exchange.block
+                while block != None:
+                    sending = time.perf_counter()
+                    await conn.send(block)
+                    metrics.observe('send',  time.perf_counter() - sending)
+                    exchange.sent()
+                    while exchange.waiting():
+                        receiving = time.perf_counter()
+                        antw = await conn.receive(1024)
+                        metrics.observe('receive',  time.perf_counter() - receiving)
+                        if antw == None or len(antw) == 0:
+                            metrics.count('timeout')
+                            break
+                        exchange.received(antw)
+                    block = exchange.resend()
+                logging.debug('Sent %s messages to %s port %s, acknowledged %s',  len(messages),  path.host,  path.port,  len(exchange.acked))
+                metrics.observe('total',  time.perf_counter() - start)
+        except asyncio.CancelledError:
+            # the answers may still arrive so the connection can not be reused
+            if conn != None:
+                conn.close()
+            if trace.hooks:
+                trace.end('transfer_window',  messages[0][0],  acked='cancelled')
+            raise
+        except Exception as e:
+            metrics.count('error')
+            logging.error('Message window to host %s port %s exception %s',  path.host,  path.port,  e)
+        finally:
+            await path.disconnect(conn)
+        acked = exchange.acked
+        self.transfer_done(path,  messages[0][0],  int(len(acked) > 0),  len(acked) > 0 or len(exchange.pending) < len(messages),  start)
+        if trace.hooks:
+            trace.end('transfer_window',  messages[0][0],  acked=len(acked))
+        return acked
+
+# -----------------
+# send events while needed
+# ------------------
+    async def send_run(self):
+        retries = 0
+        self.send_wakeup = asyncio.Event()
+        while len(self.queue):
+            if self.queue.ready() == 0:
+                # only refused messages waiting for their retry, or a new message
+                self.send_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.send_wakeup.wait(),  max(0,  self.queue.next_due() - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if self.window > 1 and not self.racing(self.queue[0]):
+                sent = await self.send_window()
+            else:
+                sent = await self.send_next()
+            if sent:
+                retries = 0
+            else:
+                await asyncio.sleep(self.retry_delay(retries))
+                retries += 1
+                self.send_retries += 1
+
+    async def send_next(self):
+        """
+        Send the first message of the queue
+
+        returns 1 when the message was sent or refused by the receiver,
+        0 when no path could deliver it
+        """
+        # take the message out while sending, an urgent message queued meanwhile goes before it
+        mess = self.queue.popleft()
+        answers = []
+        self.sending = 1
+        try:
+            sent = await self.send(mess,  answers)
+        except asyncio.CancelledError:
+            self.requeue([mess])
+            raise
+        finally:
+            self.sending = 0
+        if sent:
+            return 1
+        if len(answers):
+            # refused by the receiver, retry later without blocking the other messages
+            self.reject(mess,  answers[-1])
+            return 1
+        self.requeue([mess])
+        return 0
+
+    async def send(self,  mess,  answers=None):
+        """
+        Send a message, the answers of the receiver are added to -answers-
+        returns 1 when the message was acknowledged
+        """
+        if self.racing(mess):
+            return await self.send_race(mess,  answers)
+        # first try known good paths, best first, then the other paths, each once
+        for mb,  ps in self.send_paths():
+            path = self.tpaths[mb][ps]['path']
+            started = time.monotonic()
+            if await self.transfer_msg(mess[0], mess[1],  mess[2],  path,  answers):
+                self.set_path_ok(mb,  ps,  1)
+                self.acknowledge(mess,  started)
+                return 1
+            if answers != None and len(answers):
+                # refused by the receiver, not tried on the next path
+                return 0
+        return 0
+
+    async def send_race(self,  mess,  answers=None):
+        """
+        Send a message on all paths, each one -race delay- after the previous,
+        until one acknowledges it, see dc09_base.set_race
+        The attempts still in progress when one path acknowledges are cancelled.
+        """
+        waiting = deque(self.send_paths())
+        attempts = {}
+        winner = None
+        try:
+            while winner == None and (len(waiting) or len(attempts)):
+                if len(waiting):
+                    mb,  ps = waiting.popleft()
+                    task = self.get_loop().create_task(self.transfer_msg(mess[0], mess[1],  mess[2],  self.tpaths[mb][ps]['path'],  answers))
+                    attempts[task] = (mb,  ps,  time.monotonic())
+                # wait for the next path to be started, or for all when none is left
+                timeout = self.race_delay if len(waiting) else None
+                pending = set(attempts)
+                while winner == None and len(pending):
+                    done,  pending = await asyncio.wait(pending,  timeout=timeout,  return_when=asyncio.FIRST_COMPLETED)
+                    if len(done) == 0:
+                        break
+                    for task in done:
+                        mb,  ps,  started = attempts.pop(task)
+                        if not task.cancelled() and task.result() and winner == None:
+                            winner = (mb,  ps,  started)
+                    if len(pending) and len(waiting):
+                        # a path failed, start the next one at once
+                        break
+        finally:
+            for task in attempts:
+                task.cancel()
+            if len(attempts):
+                await asyncio.gather(*attempts,  return_exceptions=True)
+        if winner == None:
+            return 0
+        mb,  ps,  started = winner
+        logging.debug('Message nr %s raced, acknowledged on %s %s path',  mess[0],  mb,  ps)
+        self.set_path_ok(mb,  ps,  1)
+        self.acknowledge(mess,  started)
+        return 1
+
+    async def send_window(self):
+        """
+        Send up to -window- messages at once, queue the ones not acknowledged again
+        """
+        messes = self.take_window()
+        if len(messes) == 0:
+            return 1
+        count = len(messes)
+        self.sending = count
+        try:
+            # first try known good paths, best first, then the other paths;
+            # the messages refused by the receiver are not tried on the next path
+            for mb,  ps in self.send_paths():
+                path = self.tpaths[mb][ps]['path']
+                if len(messes) and path != None:
+                    rejected = {}
+                    started = time.monotonic()
+                    acked = await self.transfer_window(messes,  path,  rejected)
+                    messes = self.window_done(messes,  acked,  rejected,  started,  mb,  ps)
+        finally:
+            self.requeue(messes)
+            self.sending = 0
+        return int(len(messes) < count)
+
+# -----------------
+# send polls and routines while needed
+# ------------------
+    async def poll_run(self):
+        polls = self.polls
+        while polls.active():
+            self.poll_wakeup.clear()
+            polling = polls.round(time.monotonic())
+            try:
+                mb,  ps = next(polling)
+                while True:
+                    ok = await self.transfer_msg(0,  "NULL", "]",  self.tpaths[mb][ps]['path'])
+                    mb,  ps = polling.send(ok)
+            except StopIteration:
+                pass
+            # -------------------------
+            # sleep until the next deadline or a configuration change
+            # -------------------------
+            due = polls.next_due()
+            if due != None:
+                due = max(0,  due - time.monotonic())
+            try:
+                await asyncio.wait_for(self.poll_wakeup.wait(),  due)
+            except asyncio.TimeoutError:
+                pass
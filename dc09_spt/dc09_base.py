@@ -0,0 +1,1149 @@
+# ----------------------------
+# Dialler logic shared by the threaded and the asyncio dialler
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+from dc09_spt.msg.dc09_msg import dc09_msg
+from dc09_spt.msg.dc05_msg import dc05_msg
+from dc09_spt.msg.dc03_msg import dc03_msg
+import abc
+import time
+import heapq
+import json
+import threading
+from collections import deque
+import logging
+from dc09_spt.scheduler import schedule_spread
+from dc09_spt.journal import event_journal
+from dc09_spt.metrics import histogram
+from dc09_spt.event_queue import event_queue,  event_priority,  priority_map,  NORMAL
+
+class dc09_base(abc.ABC):
+    """
+    The configuration, queue and path selection of a dialler, without the I/O
+
+    dc09_spt (threads) and dc09_aio_spt (asyncio) add the transfers and decide when they run.
+    They set -path_class- and implement the hooks
+        wake_send()
+            a message was queued, called with the queuelock held
+        poll_changed()
+            the polls or routines were changed, start, wake up or stop the poll runner
+        poll_running()
+            True while the poll runner runs
+        send_active()
+            1 while the sender runs, 0 when it is idle, None when there is no sender
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+    path_class = None
+
+    def __init__(self,  account, receiver=None,  line=None):
+        """
+        Define a basic dialler (SPT Secure Premises Transceiver)
+
+        parameters
+            account
+                Account number to be used.
+                Most receivers expect a numeric string of 4 to 8 digits
+            receiver
+                an optional integer to be used as receiver number in the block header
+            line
+                an optional integer to be used as line number in the block header
+        """
+        self.account = account
+        self.receiver = receiver
+        self.line = line
+        self.tpaths = {
+            'main': {
+                'primary': {
+                    'path': None,
+                    'ok':   0
+                },
+                'secondary': {
+                    'path': None,
+                    'ok':   0
+                }
+            },
+            'back-up': {
+                'primary': {
+                    'path': None,
+                    'ok':   0
+                },
+                'secondary': {
+                    'path': None,
+                    'ok':   0
+                }
+            },
+        }
+        self.tpaths_lock = threading.Lock()
+        self.msg_nr = 0
+        self.queue = event_queue()
+        self.queuelock = threading.Condition()
+        self.priorities = priority_map
+        self.default_priority = NORMAL
+        self.dead_attempts = 10
+        self.dead_letters = deque(maxlen=1000)
+        self.dead_file = None
+        self.dead_count = 0
+        self.send_retry = [0.5,  1.0,  2.0,  5.0,  10.0]
+        self.window = 1
+        self.journal = None
+        self.sending = 0
+        self.counter = 0
+        self.counterlock = threading.Lock()
+        self.queue_wait = histogram()
+        self.send_retries = 0
+        self.polls = poll_schedule(self)
+        self.race_delay = None
+        self.race_select = None
+        self.traffic_as_poll = False
+        self.hysteresis = 0.3
+        self.margin = 0.05
+        self.spread = None
+        self.preferred = {'main': 'primary',  'back-up': 'primary'}
+# ---------------------
+# configure transmission paths
+# ---------------------
+    def set_path(self, mb,  pb,  host,  port,  *,  account=None,  key=None,  receiver=None,  line=None,  type=None,  persistent=False,  idle_timeout=30.0,  dns_ttl=300.0,  dns_stale=86400.0,  breaker_failures=3,  breaker_reset=30.0):
+        """
+        Define the transmission path
+
+        parameters
+            main/back-up
+                value 'main' or 'back-up'
+            primary/secondary
+                value 'primary' or 'secondary'
+            host
+                IP address or DNS name of receiver
+            port
+                Port number to be used at this receiver
+            account
+                Optional different account number to be used for this path.
+                Most receivers expect a numeric string of 4 to 8 digits
+            key
+                Optional encryption key.
+                This key should be byte string of 16 or 32 bytes
+            receiver
+                an optional integer to be used as receiver number in the block header
+            line
+                an optional integer to be used as line number in the block header
+            type
+                Optional 'tcp' (default) or 'udp'
+            persistent
+                Optionally keep the TCP connection open and reuse it for the next transfers
+            idle_timeout
+                Seconds after which an unused persistent connection is closed
+            dns_ttl
+                Seconds the resolved addresses of the host are cached
+            dns_stale
+                Seconds the cached addresses are still used while the name server fails
+            breaker_failures
+                Number of failed transfers in a row after which events skip this path until it is
+                polled successfully, or tried again after breaker_reset seconds
+            breaker_reset
+                Seconds before an event tries a skipped path again
+        note
+            The routing of the back-up path to use the secondary network adapter has to be done
+            in the operating system. The decision which adapter to use is made at the moment of routing.
+        """
+        if account != None:
+            acc = account
+            if self.account == None:
+                self.account = account
+        else:
+            acc = self.account
+        if receiver != None:
+            rec = receiver
+            if self.receiver == None:
+                self.receiver = receiver
+        else:
+            rec = self.receiver
+        if line != None:
+            lin = line
+            if self.line == None:
+                self.line = lin
+        else:
+            lin = self.line
+        self.tpaths_lock.acquire()
+        self.tpaths[mb][pb]['path'] = self.path_class(host,  port,  acc, key=key, receiver=rec, line=lin,  type=type,  persistent=persistent,  idle_timeout=idle_timeout,  dns_ttl=dns_ttl,  dns_stale=dns_stale,  breaker_failures=breaker_failures,  breaker_reset=breaker_reset)
+        self.tpaths[mb][pb]['ok'] = 0
+        self.tpaths_lock.release()
+
+    def del_path(self, mb,  pb):
+        """
+        Remove a transmission path
+
+        parameters
+            main/back-up
+                value 'main' or 'back-up'
+            primary/secondary
+                value 'primary' or 'secondary'
+        """
+        self.tpaths_lock.acquire()
+        self.tpaths[mb][pb]['path'] = None
+        self.tpaths_lock.release()
+
+    def set_path_ok(self,  mb,  ps,  ok):
+        """
+        Set the state of a path, returns True when it changed
+        """
+        if self.tpaths[mb][ps]['ok'] == ok:
+            return False
+        self.tpaths_lock.acquire()
+        self.tpaths[mb][ps]['ok'] = ok
+        self.tpaths_lock.release()
+        return True
+
+    def start_poll(self,  main,  backup=None,  retry_delay=5,  ok_msg=None,  fail_msg=None,  traffic_as_poll=False):
+        """
+        Start the automatic polling to the receiver(s)
+
+        parameters
+            main
+                Polling interval of the main path
+            backup
+                Optional polling interval of the back-up path
+            retry_delay
+                delay in seconds before a failed poll is tried again
+            ok_msg
+                Optional map with message to sent on poll restore
+            fail_msg
+                optional map with message to send when poll fails
+            traffic_as_poll
+                When set an acknowledged event counts as a poll: it moves the next poll of main or back-up
+                to one interval after the event. Only an event over the path that the poll checks first
+                (primary, or secondary when there is no primary) counts, and only while that path is ok,
+                so every path is still supervised within its interval.
+        """
+        self.traffic_as_poll = traffic_as_poll
+        self.polls.set_poll(main,  backup,  retry_delay,  ok_msg,  fail_msg)
+        self.poll_changed()
+
+    def stop_poll(self):
+        """
+        Stop the automatic polling, the routine reports go on
+        """
+        self.polls.set_poll(None,  None,  self.polls.retry_delay,  None,  None)
+        self.poll_changed()
+
+    def start_routine(self,  list):
+        """
+        Start sending routine reports, an empty list stops them
+
+        parameters
+            list
+                list of maps with the content of a message as for send_msg, extended with
+                'interval', seconds between two reports (default 86400),
+                'start', seconds after midnight (UTC) of the first report,
+                and optionally 'type', 'SIA-DCS' or 'ADM-CID'
+        """
+        self.polls.set_routines(list)
+        self.poll_changed()
+
+    def send_msg(self,  type,  param,  priority=None,  sync=True):
+        """
+        Schedule a message for sending to the receiver
+
+        parameters
+            type
+                type of message to send
+                current implemented is :
+                    'SIA' or 'SIA-DCS' for sending a message with a SIA-DC03 payload
+                    'CID' or 'ADM-CID' for sending a message with a SIA-DC05 payload
+            param
+                a map of key value pairs defining the message content.
+                for a description of possible values see the documentation of the payload
+            priority
+                optional priority, messages with a higher priority are sent first.
+                By default it follows from the event code, see set_priorities
+            sync
+                with a journal, False does not wait for the message to be on disk,
+                the caller then calls journal.sync() for a batch of messages
+
+        note
+            this method can be called from more than one thread
+        """
+        dc09type,  msg = dc09_base.payload(self.account,  type,  param)
+        if priority == None:
+            priority = self.priority(param.get('code'),  param.get('q'))
+        self.queue_msg(dc09type,  msg,  priority,  sync)
+
+    def template(self,  type,  param):
+        """
+        Compile a message for repeated sending with send_template
+
+        parameters
+            type
+                type of message, as with send_msg
+            param
+                a map with the fixed content of the message, as with send_msg
+        """
+        return msg_template(self.account,  type,  param)
+
+    def send_template(self,  template,  param={},  priority=None):
+        """
+        Schedule a precompiled message for sending to the receiver
+
+        parameters
+            template
+                a template made with the template method
+            param
+                a map with the variable fields zone, user and time (SIA) or q (CID)
+            priority
+                optional priority, as with send_msg
+        """
+        dc09type,  msg = template.render(param)
+        if priority == None:
+            priority = self.priority(template.code,  param.get('q',  template.q))
+        self.queue_msg(dc09type,  msg,  priority)
+
+    def set_priorities(self,  mapping=None,  default=NORMAL):
+        """
+        Set the priorities of the event codes
+
+        parameters
+            mapping
+                map of event code, or the start of an event code, to priority.
+                The longest matching code is used, so {'B': 3, 'BC': 1} gives all
+                burglary codes priority 3 except BC.
+                None restores the default dc09_spt.event_queue.priority_map,
+                in which alarms have priority 3, troubles 2, tests and routine reports 0
+            default
+                priority of the codes not in the map, and of polls state messages without code
+        note
+            ADM-CID restores (q=3) get at most the default priority
+        """
+        if mapping == None:
+            mapping = priority_map
+        self.priorities = mapping
+        self.default_priority = default
+
+    def priority(self,  code,  q=None):
+        """
+        Return the priority of event -code-, -q- is the ADM-CID qualifier
+        """
+        priority = event_priority(code,  self.priorities,  self.default_priority)
+        if q == 3:
+            priority = min(priority,  self.default_priority)
+        return priority
+
+    def queue_msg(self,  dc09type,  msg,  priority=NORMAL,  sync=True):
+        """
+        Number and queue a payload and wake up the sender, -sync- as for send_msg
+        """
+        self.counterlock.acquire()
+        self.msg_nr += 1
+        self.counter += 1
+        if self.msg_nr > 9999:
+            self.msg_nr = 1
+        msg_nr = self.msg_nr
+        self.counterlock.release()
+        tup = msg_nr,  dc09type,  msg
+        if self.journal != None:
+            tup = tup + (time.monotonic(),  self.journal.append(tup + (priority, ),  sync),  priority)
+        else:
+            tup = tup + (time.monotonic(),  None,  priority)
+        logging.debug('Message queued nr %s type %s priority %s content "%s"',  msg_nr,  dc09type,  priority,  msg)
+        self.queuelock.acquire()
+        self.queue.append(tup)
+        self.wake_send()
+        self.queuelock.release()
+
+    def set_journal(self,  filename,  compact_min=1000):
+        """
+        Keep the queued messages in a journal file, so they survive a restart
+
+        Messages left in the journal by a previous run are queued again, before any new messages.
+
+        parameters
+            filename
+                name of the journal file
+            compact_min
+                minimum number of sent messages before the journal is rewritten
+        """
+        journal = event_journal(filename,  compact_min)
+        pending = journal.pending()
+        self.queuelock.acquire()
+        self.journal = journal
+        for id,  mess in reversed(pending):
+            if len(mess) > 3:
+                priority = mess[3]
+            else:
+                priority = self.default_priority
+            self.queue.appendleft((mess[0],  mess[1],  mess[2],  time.monotonic(),  id,  priority))
+        if len(pending):
+            logging.info('%s messages replayed from journal %s',  len(pending),  filename)
+            self.counterlock.acquire()
+            self.msg_nr = pending[-1][1][0]
+            self.counterlock.release()
+            self.wake_send()
+        self.queuelock.release()
+
+    def acknowledge(self,  mess,  started):
+        """
+        Called by the sender when a message is sent,
+        -started- is the time.monotonic() at which the successful transfer started
+        """
+        self.queue_wait.observe(started - mess[3])
+        self.queuelock.acquire()
+        self.queue.done(mess)
+        self.queuelock.release()
+        if self.journal != None and mess[4] != None:
+            self.journal.ack(mess[4])
+
+    def set_dead_letter(self,  attempts=10,  filename=None,  keep=1000):
+        """
+        Set when a message the receiver keeps refusing is given up
+
+        A message answered with DUH, or NAK after the time was corrected, is retried on its own
+        after the send retry delays, while the other messages are sent. After -attempts- refusals
+        it is moved to the dead letters. Messages that could not be sent because no path answered
+        are not counted, they wait for the paths to come back.
+
+        parameters
+            attempts
+                number of refusals after which a message is given up, None retries for ever
+            filename
+                optional file to which the dead letters are appended, one JSON object per line
+            keep
+                number of dead letters kept in the dead_letters list
+        """
+        self.dead_attempts = attempts
+        self.dead_file = filename
+        self.dead_letters = deque(self.dead_letters,  maxlen=keep)
+
+    def reject(self,  mess,  answer):
+        """
+        Called by the sender when the receiver refused message -mess- with -answer-,
+        defers the message or moves it to the dead letters
+        """
+        self.queuelock.acquire()
+        attempts = self.queue.tries(mess) + 1
+        if self.dead_attempts == None or attempts < self.dead_attempts:
+            delay = self.send_retry[min(attempts - 1,  len(self.send_retry) - 1)]
+            self.queue.defer(mess,  time.monotonic() + delay)
+            self.queuelock.release()
+            logging.warning('Message nr %s refused with %s, attempt %s, retry in %s s',  mess[0],  answer,  attempts,  delay)
+            return
+        self.queue.done(mess)
+        self.queuelock.release()
+        letter = {'msg_nr': mess[0],  'type': mess[1],  'msg': mess[2],  'priority': mess[-1],
+            'attempts': attempts,  'answer': answer,  'time': time.time()}
+        logging.error('Message nr %s refused %s times, last with %s, moved to dead letters',  mess[0],  attempts,  answer)
+        self.dead_letters.append(letter)
+        self.dead_count += 1
+        if self.dead_file != None:
+            try:
+                with open(self.dead_file,  'a') as f:
+                    f.write(json.dumps(letter) + '\n')
+            except Exception as e:
+                logging.error('Dead letter file %s exception %s',  self.dead_file,  e)
+        if self.journal != None and mess[4] != None:
+            self.journal.ack(mess[4])
+
+    def resend_dead_letters(self):
+        """
+        Queue the kept dead letters again, with a new message number
+        """
+        letters = list(self.dead_letters)
+        self.dead_letters.clear()
+        for letter in letters:
+            self.queue_msg(letter['type'],  letter['msg'],  letter['priority'])
+
+    def set_send_retry(self,  delays):
+        """
+        Set the delays between retries of a message that could not be sent
+
+        parameters
+            delays
+                list of delays in seconds, the n-th retry waits delays[n],
+                after the last entry that delay is used for all further retries
+        """
+        self.send_retry = list(delays)
+
+    def retry_delay(self,  retries):
+        """
+        Return the delay before retry number -retries- (from 0) of a message that could not be sent
+        """
+        return self.send_retry[min(retries,  len(self.send_retry) - 1)]
+
+    def set_race(self,  delay=0.25,  select=None):
+        """
+        Transmit messages on several paths at once and accept the first acknowledge
+
+        The known good paths are started first, then the others, each next path
+        -delay- seconds after the previous one when that has not answered yet, or at once when it failed.
+        When one path acknowledges the message the attempts not started yet are cancelled,
+        attempts in progress are stopped at their next step.
+        The receiver gets the message on more than one path with the same message number
+        and handles the duplicates.
+
+        parameters
+            delay
+                seconds before the next path is started, 0 starts all paths at once,
+                None switches racing off
+            select
+                optional function(dc09type, msg) returning True for the messages to race,
+                by default all messages are raced
+        note
+            racing bounds the delivery time when a network is degraded, at the cost of
+            extra traffic, so it is meant for the urgent alarms
+        """
+        self.race_delay = delay
+        self.race_select = select
+
+    def set_spread(self,  phase=True,  jitter=0.1,  max_jitter=30.0):
+        """
+        Spread the polls and routine reports, so diallers started together do not poll together
+
+        Call before start_poll and start_routine, see dc09_spt.scheduler.schedule_spread.
+
+        parameters
+            phase
+                True to poll in a slot within the interval derived from the account,
+                the first poll comes in that slot instead of at once
+            jitter
+                part of the interval a poll or routine comes earlier at random,
+                the retries after a failed poll are spread by the same part
+            max_jitter
+                seconds a poll or routine comes earlier at most
+        note
+            setting phase False and jitter 0 switches spreading off
+        """
+        if phase or jitter:
+            self.spread = schedule_spread(self.account,  phase,  jitter,  max_jitter)
+        else:
+            self.spread = None
+
+    def set_selection(self,  hysteresis=0.3,  margin=0.05):
+        """
+        Set how the dialler chooses between the primary and secondary path
+
+        Each path keeps a moving average of its transfer time and success, fed by events and polls.
+        Of the known good paths the main ones are still tried before the back-up ones, but within main
+        and within back-up the path with the best score is tried first. The dialler only moves to the
+        other path when its score is better by more than the fraction -hysteresis- and by more than
+        -margin- seconds.
+
+        parameters
+            hysteresis
+                fraction, 0.3 moves when the other path is expected to be 30 % faster,
+                None always tries primary before secondary
+            margin
+                minimum gain in seconds, so differences in the order of the measuring noise are ignored
+        """
+        self.hysteresis = hysteresis
+        self.margin = margin
+
+    def path_order(self):
+        """
+        Return the (main/back-up, primary/secondary) of the known good paths in the order to try them
+        """
+        return dc09_base.rank_paths(self.tpaths,  self.preferred,  self.hysteresis,  self.margin)
+
+    def send_paths(self):
+        """
+        Return the (main/back-up, primary/secondary) of the paths to try for an event, each once:
+        the known good paths in the order of path_order, then the other usable paths
+        """
+        usable = dc09_base.usable_paths(self.tpaths)
+        paths = [(mb,  ps) for mb,  ps in self.path_order() if (mb,  ps) in usable]
+        for mb in ('main',  'back-up'):
+            for ps in ('primary',  'secondary'):
+                if (mb,  ps) in usable and (mb,  ps) not in paths:
+                    paths.append((mb,  ps))
+        return paths
+
+    @staticmethod
+    def polled_path(tpaths,  mb):
+        """
+        Return 'primary' or 'secondary', the path of main or back-up a poll checks first, or None
+        """
+        for ps in ('primary',  'secondary'):
+            if tpaths[mb][ps]['path'] != None:
+                return ps
+        return None
+
+    @staticmethod
+    def usable_paths(tpaths):
+        """
+        Return the set of (main/back-up, primary/secondary) of the paths events may use now,
+        the paths with an open circuit breaker are left out unless all paths are open
+        """
+        every = set()
+        usable = set()
+        for mb in ('main',  'back-up'):
+            for ps in ('primary',  'secondary'):
+                path = tpaths[mb][ps]['path']
+                if path != None:
+                    every.add((mb,  ps))
+                    if path.breaker.usable():
+                        usable.add((mb,  ps))
+        if len(usable) == 0:
+            return every
+        return usable
+
+    @staticmethod
+    def rank_paths(tpaths,  preferred,  hysteresis,  margin=0.0):
+        """
+        Order the known good paths, main before back-up, within those the preferred one first
+        The -preferred- map of main/back-up to primary/secondary is updated when the other path
+        scores better by more than the fraction -hysteresis- and more than -margin- seconds.
+        """
+        order = []
+        for mb in ('main',  'back-up'):
+            good = [ps for ps in ('primary',  'secondary') if tpaths[mb][ps]['path'] != None and tpaths[mb][ps]['ok']]
+            if len(good) == 2 and hysteresis != None:
+                current = preferred[mb]
+                other = 'secondary' if current == 'primary' else 'primary'
+                current_score = tpaths[mb][current]['path'].health.score()
+                other_score = tpaths[mb][other]['path'].health.score()
+                if current_score != None and other_score != None and other_score < min(current_score * (1.0 - hysteresis),  current_score - margin):
+                    logging.info('Prefer %s %s path, expected %.3f s instead of %.3f s',  mb,  other,  other_score,  current_score)
+                    preferred[mb] = other
+                if preferred[mb] == 'secondary':
+                    good.reverse()
+            order.extend((mb,  ps) for ps in good)
+        return order
+
+    def racing(self,  mess):
+        """
+        True if the queued message -mess- is to be sent on several paths at once
+        """
+        if self.race_delay == None:
+            return False
+        return self.race_select == None or self.race_select(mess[1],  mess[2])
+
+    def set_window(self,  window):
+        """
+        Set the number of messages that can be sent before their answers are received
+
+        parameters
+            window
+                maximum number of messages in flight, 1 (default) sends one message at a time.
+                A window is only used on TCP paths, preferably persistent ones.
+                The answers are matched to the messages by message number,
+                messages not acknowledged are queued again.
+        """
+        self.window = max(1,  int(window))
+
+    def take_window(self):
+        """
+        Take up to -window- messages that are ready from the queue
+        """
+        self.queuelock.acquire()
+        messes = []
+        while self.queue.ready() and len(messes) < self.window:
+            messes.append(self.queue.popleft())
+        self.queuelock.release()
+        return messes
+
+    def window_done(self,  messes,  acked,  rejected,  started,  mb,  ps):
+        """
+        Handle the outcome of sending the window -messes- over a path:
+        acknowledge the -acked- messages, reject the -rejected- ones,
+        returns the messages still to send
+        """
+        for mess in messes:
+            if mess[0] in acked:
+                self.acknowledge(mess,  started)
+            elif mess[0] in rejected:
+                # refused by the receiver, not tried on the next path
+                self.reject(mess,  rejected[mess[0]])
+        if len(acked):
+            self.set_path_ok(mb,  ps,  1)
+        return [mess for mess in messes if mess[0] not in acked and mess[0] not in rejected]
+
+    def requeue(self,  messes):
+        """
+        Put messages that could not be sent back in front of the queue
+        """
+        if len(messes):
+            self.queuelock.acquire()
+            self.queue.extendleft(reversed(messes))
+            self.queuelock.release()
+
+    def transfer_done(self,  path,  msg_nr,  ok,  answered,  start):
+        """
+        Record the outcome of a transfer over -path- that started at time.perf_counter() -start-
+        """
+        path.health.record(ok,  time.perf_counter() - start)
+        path.breaker.record(answered)
+        if ok and msg_nr != 0:
+            self.traffic(path)
+
+    def traffic(self,  path):
+        """
+        Called when an event was acknowledged over -path-, counts as a poll with traffic_as_poll
+        """
+        if self.traffic_as_poll and self.polls.active() & 1:
+            self.polls.traffic(path)
+
+    def poll_result(self,  mb,  ps,  ok):
+        """
+        Called by the poll schedule with the outcome of a poll of a path,
+        sends the ok or fail message when the state of the path changed
+        """
+        path = self.tpaths[mb][ps]['path']
+        if ok:
+            path.metrics.count('polls')
+        if self.set_path_ok(mb,  ps,  ok):
+            if mb == 'main':
+                zone = 1
+            else:
+                zone = 2
+            if ok:
+                self.poll_msg(self.polls.ok_msg,  zone,  1)
+            else:
+                self.poll_msg(self.polls.fail_msg,  zone,  0)
+
+    def poll_msg(self,  msg,  zone,  ok):
+        """
+        Send a message on poll state change
+        """
+        if msg != None:
+            nmsg = dict(msg)
+            nmsg['zone'] = zone
+            type = nmsg.get('type')
+            if type == None and 'code' in nmsg:
+                if len(nmsg['code']) == 3:
+                    type = 'ADM-CID'
+                    if ok:
+                        nmsg['q'] = 1
+                    else:
+                        nmsg['q'] = 3
+                elif len(nmsg['code']) == 2:
+                    type = 'SIA-DCS'
+            if type != None:
+                self.send_msg(type,  nmsg)
+
+    @staticmethod
+    def payload(account,  type,  param):
+        """
+        Build the DC09 type and payload of a message for send_msg
+
+        returns a tuple with the DC09 type and the payload
+        """
+        return dc09_msg.dc09payload(account,  type,  param)
+
+    def state(self):
+        ret = {'msgs queued': len(self.queue), 'msgs sent': self.counter}
+        for priority,  count in self.queue.counts().items():
+            ret['msgs queued priority ' + str(priority)] = count
+        for mb in ('main',  'back-up'):
+            for ps in ('primary',  'secondary'):
+                path = self.tpaths[mb][ps]['path']
+                if path != None:
+                    ret[mb + ' ' + ps + ' path ok'] = self.tpaths[mb][ps]['ok']
+                    if path.breaker.state != 'closed':
+                        ret[mb + ' ' + ps + ' path breaker'] = path.breaker.state
+                    if path.keep_open():
+                        for name, value in path.counters().items():
+                            ret[mb + ' ' + ps + ' path ' + name] = value
+        if self.poll_running():
+            ret['poll active'] = self.polls.active()
+            ret['poll count'] = self.polls.counter
+            if self.traffic_as_poll:
+                ret['poll suppressed'] = self.polls.suppressed
+        send = self.send_active()
+        if send != None:
+            ret['send active'] = send
+        return ret
+
+    def metrics(self):
+        """
+        Return the metrics of the dialler and its paths
+
+        The map contains
+            account, queued, sent
+                the account, the number of messages waiting and the number of messages queued in total
+            send retries
+                the number of times sending failed on all paths and was retried later
+            dead letters
+                the number of messages given up after being refused by the receiver
+            queue wait
+                histogram snapshot of the time from queueing a message until its successful transfer started
+            paths
+                map of 'main primary' etc. to the metrics of the path, see path_metrics,
+                extended with 'ok', the connection counters in 'connections',
+                the name resolution counters in 'dns', the moving averages in 'health'
+                and the circuit breaker state in 'breaker'
+        For the Prometheus text format use dc09_spt.metrics.prometheus
+        """
+        ret = {'account': self.account,  'queued': len(self.queue),  'sent': self.counter,
+            'send retries': self.send_retries,  'dead letters': self.dead_count,  'queue wait': self.queue_wait.snapshot(),  'paths': {}}
+        for mb in ('main',  'back-up'):
+            for ps in ('primary',  'secondary'):
+                path = self.tpaths[mb][ps]['path']
+                if path != None:
+                    pm = path.metrics.snapshot()
+                    pm['ok'] = self.tpaths[mb][ps]['ok']
+                    pm['connections'] = path.counters()
+                    pm['dns'] = path.dns_counters()
+                    pm['health'] = path.health.snapshot()
+                    pm['breaker'] = path.breaker.snapshot()
+                    ret['paths'][mb + ' ' + ps] = pm
+        return ret
+
+    def isConnected(self):
+        antw = False
+        for mb in ('main',  'back-up'):
+            for ps in ('primary',  'secondary'):
+                if self.tpaths[mb][ps]['path'] != None:
+                    if self.tpaths[mb][ps]['ok']  > 0:
+                        antw = True
+        return antw
+
+    def notSent(self):
+        return len(self.queue) + self.sending
+
+    @abc.abstractmethod
+    def wake_send(self):
+        pass
+
+    @abc.abstractmethod
+    def poll_changed(self):
+        pass
+
+    def poll_running(self):
+        return False
+
+    def send_active(self):
+        return None
+
+class msg_template:
+    """
+    A precompiled message, see dc09_base.template
+    """
+    def __init__(self,  account,  type,  param):
+        if type == 'SIA' or type == 'SIA-DCS':
+            self.template = dc03_msg.dc03template(account,  param)
+            self.dc09type = 'SIA-DCS'
+        if type == 'CID' or type == 'ADM-CID':
+            self.template = dc05_msg.dc05template(account,  param)
+            self.dc09type = 'ADM-CID'
+        self.extra = dc09_msg.dc09_extra(param)
+        self.code = param.get('code')
+        self.q = param.get('q')
+
+    def render(self,  param={}):
+        """
+        Return the DC09 type and payload with the variable fields of -param-
+        """
+        msg = self.template.render(param)
+        if self.extra != None:
+            msg = msg + self.extra
+        return self.dc09type,  msg
+
+class poll_schedule:
+    """
+    The deadlines of the polls and routine reports of a dialler, without the I/O
+
+    The poll runner of the dialler sleeps until next_due(), then drives round():
+    it yields the (main/back-up, primary/secondary) of each path to poll,
+    and is sent True or False with the outcome of that poll.
+    A round polls main when it is due, back-up when it is due or main failed,
+    and queues the routine reports that are due.
+    Until main and back-up were both polled successfully, a round polls all their paths,
+    after that the secondary path is only polled when the primary fails.
+
+    The deadlines are in time.monotonic(), so a change of the wall clock does not delay
+    or bunch the polls. The slots of set_spread and the 'start' of a routine are computed
+    on the wall clock and converted.
+    """
+    def __init__(self,  parent):
+        self.parent = parent
+        self.main_poll = None
+        self.backup_poll = None
+        self.retry_delay = 5
+        self.ok_msg = None
+        self.fail_msg = None
+        self.main_next = 0
+        self.backup_next = 0
+        self.first = 1
+        self.counter = 0
+        self.suppressed = 0
+        self.routines = []
+        self.routine_nexts = []
+        self.routine_slots = []
+        self.routine_templates = []
+
+    def set_poll(self,  main,  backup,  retry_delay,  ok_msg,  fail_msg):
+        self.main_poll = main
+        self.backup_poll = backup
+        self.retry_delay = retry_delay
+        self.ok_msg = ok_msg
+        self.fail_msg = fail_msg
+        self.main_next = 0
+        self.backup_next = 0
+        self.first = 1
+        self.counter = 0
+        spread = self.parent.spread
+        if spread != None:
+            now = time.monotonic()
+            wall = self.wall(now)
+            if main:
+                self.main_next = now + spread.first(wall,  'main',  main) - wall
+            if backup:
+                self.backup_next = now + spread.first(wall,  'back-up',  backup) - wall
+
+    def set_routines(self,  routines):
+        """
+        Set the routine reports, the next due times are kept in a heap of (time, index)
+        each routine is compiled to a message template once
+        """
+        nexts = []
+        slots = []
+        templates = []
+        mono = time.monotonic()
+        now = self.wall(mono)
+        spread = self.parent.spread
+        for n,  routine in enumerate(routines):
+            interval = routine.get('interval',  86400)
+            if 'start' in routine:
+                start = (now % 86400 ) + routine['start']
+            else:
+                start = now
+            if spread != None:
+                start += spread.routine_offset(n,  routine,  interval)
+            while start < now:
+                start += interval
+            slots.append(start - now + mono)
+            if spread != None:
+                start = max(now,  start - spread.early(interval))
+            nexts.append((start - now + mono,  n))
+            if 'type' in routine:
+                type = routine['type']
+            elif len(routine.get('code',  '')) == 3:
+                type = 'ADM-CID'
+            else:
+                type = 'SIA-DCS'
+            templates.append(self.parent.template(type,  routine))
+        heapq.heapify(nexts)
+        self.routine_templates = templates
+        self.routine_slots = slots
+        self.routine_nexts = nexts
+        self.routines = routines
+
+    @staticmethod
+    def wall(now):
+        """
+        Return the time.time() of the time.monotonic() -now-
+        """
+        return now + time.time() - time.monotonic()
+
+    def active(self):
+        """
+        Return 1 when polling, + 2 when sending routine reports
+        """
+        ret = 0
+        if self.main_poll or self.backup_poll:
+            ret += 1
+        if len(self.routines) > 0:
+            ret += 2
+        return ret
+
+    def next_due(self):
+        """
+        Return the time of the first poll or routine due, None when there is none
+        """
+        nexts = []
+        if self.main_poll != None:
+            nexts.append(self.main_next)
+        if self.backup_poll != None:
+            nexts.append(self.backup_next)
+        if len(self.routine_nexts):
+            nexts.append(self.routine_nexts[0][0])
+        if len(nexts) == 0:
+            return None
+        return min(nexts)
+
+    def round(self,  now):
+        """
+        Generator of the paths to poll at -now- (time.monotonic()), send it the outcome of each poll
+        """
+        main_polled = 0
+        main_failed = 0
+        backup_polled = 0
+        if self.main_poll != None and self.main_next <= now:
+            main_polled = yield from self.poll_paths('main')
+            if main_polled == 0:
+                main_failed = 1
+            self.main_next = self.poll_due(now,  'main',  self.main_poll,  main_polled)
+        # the back-up poll is also triggered when the main poll failed
+        if self.backup_poll != None and (main_failed or self.backup_next <= now):
+            backup_polled = yield from self.poll_paths('back-up')
+            self.backup_next = self.poll_due(now,  'back-up',  self.backup_poll,  backup_polled)
+        if self.main_poll != None and main_polled and (self.backup_poll == None or backup_polled):
+            self.first = 0
+        self.do_routines(now)
+
+    def poll_paths(self,  mb):
+        """
+        Poll the primary and, when it fails or in the first rounds, the secondary path of main or back-up
+
+        returns 1 if a path could be polled
+        """
+        polled = 0
+        for ps in ('primary',  'secondary'):
+            if self.parent.tpaths[mb][ps]['path'] != None and (self.first or polled == 0):
+                ok = yield (mb,  ps)
+                if ok:
+                    polled = 1
+                    self.counter += 1
+                self.parent.poll_result(mb,  ps,  int(bool(ok)))
+        return polled
+
+    def poll_due(self,  now,  mb,  interval,  polled):
+        """
+        Return the time of the next poll of main or back-up after the one at -now-
+        """
+        spread = self.parent.spread
+        if polled == 0:
+            if spread != None:
+                return spread.retry(now,  self.retry_delay)
+            return now + self.retry_delay
+        if spread != None:
+            wall = self.wall(now)
+            return now + spread.next(wall,  mb,  interval) - wall
+        return now + interval
+
+    def traffic(self,  path):
+        """
+        An event was acknowledged over -path-, moves the next poll when it would check that path
+        """
+        tpaths = self.parent.tpaths
+        for mb,  interval in (('main',  self.main_poll),  ('back-up',  self.backup_poll)):
+            first = dc09_base.polled_path(tpaths,  mb)
+            if first != None and tpaths[mb][first]['path'] is path:
+                path.metrics.count('implicit polls')
+                if interval != None and tpaths[mb][first]['ok'] == 1:
+                    if mb == 'main':
+                        self.main_next = max(self.main_next,  time.monotonic() + interval)
+                    else:
+                        self.backup_next = max(self.backup_next,  time.monotonic() + interval)
+                    self.suppressed += 1
+
+    def do_routines(self,  now):
+        """
+        Queue the routine reports due at -now-
+        """
+        while len(self.routine_nexts) and self.routine_nexts[0][0] <= now:
+            n = self.routine_nexts[0][1]
+            interval = self.routines[n].get('interval',  86400)
+            self.parent.send_template(self.routine_templates[n])
+            if self.parent.spread != None:
+                due = self.parent.spread.routine_next(self.routine_slots,  n,  now,  interval)
+            else:
+                due = now + interval
+            heapq.heapreplace(self.routine_nexts,  (due,  n))
+
+class window_exchange:
+    """
+    The answers to a window of messages sent at once over one connection, without the I/O
+
+    The sender sends -block-, calls sent(), and feeds what it receives to received()
+    while waiting() is True. Then resend() gives the block to send once more, or None when done.
+    Every block sent gets one answer. A NAK carries message number 0, so it is not matched
+    to a message: when all answers are in and some were NAK's, every message not acknowledged
+    or refused got one, and the rest of the window is sent once more with the time of the receiver.
+    NAK's after that refuse the rest of the window.
+    """
+    def __init__(self,  dc09,  messages,  path,  rejected=None):
+        """
+        parameters
+            dc09
+                the dc09_msg of the path
+            messages
+                list of (msg_nr, type, message) tuples, or the queued message tuples
+            path
+                the path the messages are sent over
+            rejected
+                optional map, the numbers of the messages the receiver did not accept
+                are added with the answer
+        """
+        self.dc09 = dc09
+        self.path = path
+        self.rejected = rejected
+        self.pending = {}
+        for mess in messages:
+            self.pending[mess[0]] = mess
+        self.acked = set()
+        self.resynced = False
+        self.expected = 0
+        self.naks = 0
+        self.offset = None
+        self.rest = b''
+        self.block = dc09.dc09blocks([mess[:3] for mess in messages])[0]
+
+    def sent(self):
+        self.expected = len(self.pending)
+        self.naks = 0
+        self.offset = None
+        self.rest = b''
+
+    def waiting(self):
+        return self.expected > 0
+
+    def received(self,  data):
+        """
+        Handle the received bytes -data-
+        """
+        metrics = self.path.metrics
+        answers,  self.rest = dc09_msg.dc09split(self.rest + data)
+        for answer in answers:
+            try:
+                nr = dc09_msg.dc09answer_nr(answer)
+                res = self.dc09.dc09answer(nr,  answer)
+            except Exception as e:
+                # an invalid answer is skipped, the answers of the rest of the window still count
+                metrics.count('error')
+                logging.warning('Invalid answer from %s port %s exception %s',  self.path.host,  self.path.port,  e)
+                continue
+            if res[0] != 'NAK' and nr not in self.pending:
+                logging.debug('Answer %s for unknown message nr %s from %s port %s',  res[0],  nr,  self.path.host,  self.path.port)
+                continue
+            metrics.count(res[0])
+            self.expected -= 1
+            if res[1] != None:
+                self.path.set_offset(res[1])
+                self.offset = res[1]
+            if res[0] == 'NAK':
+                self.naks += 1
+            elif res[0] == 'ACK':
+                self.pending.pop(nr,  None)
+                self.acked.add(nr)
+            else:
+                self.pending.pop(nr,  None)
+                if self.rejected != None:
+                    self.rejected[nr] = res[0]
+
+    def resend(self):
+        """
+        Return the block to send again after a NAK, None when the exchange is done
+        """
+        if self.expected > 0 or self.naks == 0 or len(self.pending) == 0:
+            return None
+        if self.resynced or self.offset == None:
+            if self.rejected != None:
+                for nr in self.pending:
+                    self.rejected[nr] = 'NAK'
+            self.pending.clear()
+            return None
+        self.resynced = True
+        self.dc09.set_offset(self.offset)
+        self.path.metrics.count('retry',  len(self.pending))
+        self.block = self.dc09.dc09blocks([mess[:3] for mess in self.pending.values()])[0]
+        return self.block
@@ -8,14 +8,20 @@ from dc09_spt.msg.dc05_msg import *
 from dc09_spt.msg.dc03_msg import *
 import time
 import threading
-from collections import deque
 import logging
 from dc09_spt.comm.transpath import TransPath
+from dc09_spt.scheduler import timer_scheduler
+from dc09_spt.dc09_base import dc09_base,  window_exchange
+from dc09_spt import trace
 
-class dc09_spt():
+class dc09_spt(dc09_base):
     """
     Handle the basic tasks of SPT (Secured Premises Transciever)
 
+    The configuration, queue and path selection are in dc09_base,
+    this class sends the messages in an event thread; the polls and routine reports
+    run on the timer_scheduler shared by all diallers, see poll_runner.
+
     Copyright (c) 2018  van Ovost Automatisering b.v.
 
     Licensed under the Apache License, Version 2.0 (the "License");
@@ -30,6 +36,7 @@ class dc09_spt():
     See the License for the specific language governing permissions and
     limitations under the License.
     """
+    path_class = TransPath
 
     def __init__(self,  account, receiver=None,  line=None):
         """
@@ -44,232 +51,84 @@ class dc09_spt():
             line
                 an optional integer to be used as line number in the block header
         """
-        self.account = account
-        self.receiver = receiver
-        self.line = line
-        self.tpaths = {
-            'main': {
-                'primary': {
-                    'path': None,
-                    'ok':   0
-                },  
-                'secondary': {
-                    'path': None,
-                    'ok':   0
-                }  
-            }, 
-            'back-up': {
-                'primary': {
-                    'path': None,
-                    'ok':   0
-                },   
-                'secondary': {
-                    'path': None,
-                    'ok':   0
-                }  
-            }, 
-        }
-        self.tpaths_lock = threading.Lock()
-        self.backup_prim = None
-        self.backup_sec = None
-        self.main_ok = 0
-        self.backup_ok = 0
-        self.main_poll = None
-        self.backup_poll = None
-        self.msg_nr = 0
-        self.queue = deque()
-        self.queuelock = threading.Lock()
-        self.running = 0
+        dc09_base.__init__(self,  account,  receiver,  line)
         self.poll = None
+        self.poll_lock = threading.Lock()
         self.send = None
-        self.counter = 0
-        self.counterlock = threading.Lock()
-        self.routines = []
-        self.routines_changed = 0
-# ---------------------
-# configure transmission paths
-# ---------------------
-    def set_path(self, mb,  pb,  host,  port,  *,  account=None,  key=None,  receiver=None,  line=None,  type=None):
-        """
-        Define the transmission path 
-        
-        parameters
-            main/back-up
-                value 'main' or 'back-up'
-            primary/secondary
-                value 'primary' or 'secondary'
-            host
-                IP address or DNS name of receiver
-            port
-                Port number to be used at this receiver
-            account
-                Optional different account number to be used for this path. 
-                Most receivers expect a numeric string of 4 to 8 digits
-            key
-                Optional encryption key.
-                This key should be byte string of 16 or 32 bytes                
-            receiver
-                an optional integer to be used as receiver number in the block header
-            line
-                an optional integer to be used as line number in the block header
-        note
-            The routing of the back-up path to use the secondary network adapter has to be done
-            in the operating system. The decision which adapter to use is made at the moment of routing.
+
+    def wake_send(self):
         """
-        if account != None:
-            acc = account
-            if self.account == None:
-                self.account = account
-        else:
-            acc = self.account
-        if receiver != None:
-            rec = receiver
-            if self.receiver == None:
-                self.receiver = receiver
-        else:
-            rec = self.receiver
-        if line != None:
-            lin = line
-            if self.line == None:
-                self.line = lin
-        else:
-            lin = self.line
-        self.tpaths_lock.acquire()
-        self.tpaths[mb][pb]['path'] = TransPath(host,  port,  acc, key=key, receiver=rec, line=lin,  type=type)
-        self.tpaths[mb][pb]['ok'] = 0
-        self.tpaths_lock.release()
-            
-    def del_path(self, mb,  pb):
+        Start the send thread if not running and wake it up, call with the queuelock held
         """
-        Remove a transmission path
-        
-        parameters
-            main/back-up
-                value 'main' or 'back-up'
-            primary/secondary
-                value 'primary' or 'secondary'
-        """
-        self.tpaths_lock.acquire()
-        self.tpaths[mb][pb]['path'] = None
-        self.tpaths_lock.release()
-                
-    def start_poll(self,  main,  backup=None,  retry_delay=5,  ok_msg=None,  fail_msg=None):
-        """
-        Start the automatic polling to the receiver(s)
-        
-        parameters
-            main
-                Polling interval of the main path
-            backup
-                Optional polling interval of the back-up path
-            ok_msg  
-                Optional map with message to sent on poll restore
-            fail_msg
-                optional map with message to send when poll fails
-        """
-        if self.poll == None:
-            self.poll = poll_thread(self.account, self.receiver, self.line, self.tpaths, self.tpaths_lock, retry_delay,  self)
-            self.poll.set_poll(main,  backup,   ok_msg,  fail_msg)
-            self.poll_active = 1
-            self.poll.start()
-        else:
-            self.poll.set_poll(main,  backup,  ok_msg,  fail_msg)
-
-    def stop_poll(self):
-        if self.poll != None and self.poll.active() == 1:
-            self.poll.stop()
-            self.poll_active = -1
-            self.poll.join()
-            self.poll_active = 0
+        if self.send == None:
+            self.send = event_thread(self)
+            self.send.start()
+        self.queuelock.notify()
+
+    def poll_changed(self):
+        """
+        Schedule the polls and routines after a change, or stop the runner when there is nothing left to do
+        """
+        self.poll_lock.acquire()
+        poll = self.poll
+        if self.polls.active():
+            if poll == None:
+                poll = self.poll = poll_runner(self)
+            poll.changed()
+        elif poll != None:
             self.poll = None
+            poll.stop()
+        self.poll_lock.release()
 
-    def start_routine(self,  list):
-        if self.poll == None:
-            if len(list):
-                self.poll = poll_thread(self.account, self.receiver, self.line, self.tpaths, self.tpaths_lock, 5.0,  self)
-                self.poll.set_routines(list)
-                self.poll_active = 1
-                self.poll.start()
-        else:
-            self.poll.set_routines(list)
-            if len(list) == 0:
-                if self.poll.active() == 2:
-                    self.poll.stop()
-                    self.poll_active = -1
-                    self.poll.join()
-                    self.poll_active = 0
-                    self.poll = None
-
-    def send_msg(self,  type,  param):
-        """
-        Schedule a message for sending to the receiver
-        
-        parameters
-            type    
-                type of message to send
-                current implemented is :
-                    'SIA' or 'SIA-DCS' for sending a message with a SIA-DC03 payload
-                    'CID' or 'ADM-CID' for sending a message with a SIA-DC05 payload
-            param  
-                a map of key value pairs defining the message content.
-                for a description of possible values see the documentation of the payload
-        
-        note
-            this method can be called from more than one thread
-        """
-        self.counterlock.acquire()
-        self.msg_nr += 1
-        self.counter += 1
-        self.counterlock.release()
-        if self.msg_nr > 9999:
-            self.msg_nr = 1
-        if type == 'SIA' or type == 'SIA-DCS':
-            msg = dc03_msg.dc03event(self.account,  param)
-            dc09type = 'SIA-DCS'
-        if type == 'CID' or type == 'ADM-CID':
-            msg = dc05_msg.dc05event(self.account,  param)
-            dc09type = 'ADM-CID'
-        extra = dc09_msg.dc09_extra(param)
-        if extra != None:
-            msg = msg + extra
-        tup = self.msg_nr,  dc09type,  msg
-        logging.debug('Message queued nr %s type %s content "%s"',  self.msg_nr,  dc09type,  msg)
+    def poll_running(self):
+        return self.poll != None
+
+    def send_active(self):
+        send = self.send
+        if send == None:
+            return None
+        return send.active()
+
+    def stop_send(self):
+        """
+        Stop the send thread, messages not sent stay in the queue
+        """
         self.queuelock.acquire()
-        self.queue.append(tup)
+        send = self.send
+        self.send = None
+        if send != None:
+            send.stop()
         self.queuelock.release()
-        if self.send != None and self.send.active() == 0:
-            self.send.join()
-            self.send = None
-        if self.send == None:
-            self.send = event_thread(self.account, self.receiver, self.line, self.queue,  self.queuelock,  self.tpaths, self.tpaths_lock,  self)
-            self.send.start()
+        if send != None:
+            send.join()
     
-    def state(self):
-        ret = {'msgs queued': len(self.queue), 'msgs sent': self.counter}
-        for mb in ('main',  'back-up'):
-            for ps in ('primary',  'secondary'):
-                if self.tpaths[mb][ps]['path'] != None:
-                    ret[mb + ' ' + ps + ' path ok'] = self.tpaths[mb][ps]['ok']
-        if self.poll != None:
-            ret['poll active'] = self.poll.active()
-            ret['poll count'] = self.poll.count()
-        if self.send != None:
-            ret['send active'] = self.send.active()
-        return ret
+    def flush(self,  timeout=None):
+        """
+        Wait until all queued messages are sent, or refused, and the send thread is idle
 
-    def isConnected(self):
-        antw = False
-        for mb in ('main',  'back-up'):
-            for ps in ('primary',  'secondary'):
-                if self.tpaths[mb][ps]['path'] != None:
-                    if self.tpaths[mb][ps]['ok']  > 0:
-                        antw = True
-        return antw
-    
-    def notSent(self):
-        return len(self.queue)
+        parameters
+            timeout
+                maximum number of seconds to wait, None waits as long as needed
+        return value
+            True when the queue is empty, False on a timeout or when the send thread was stopped
+        """
+        until = None
+        if timeout != None:
+            until = time.monotonic() + timeout
+        self.queuelock.acquire()
+        try:
+            while self.send != None and (len(self.queue) or self.send.running):
+                if until == None:
+                    self.queuelock.wait()
+                elif until > time.monotonic():
+                    self.queuelock.wait(until - time.monotonic())
+                else:
+                    break
+            return len(self.queue) == 0
+        finally:
+            self.queuelock.release()
 
-    def transfer_msg(self,  msg_nr,  type,  message,  path):
+    def transfer_msg(self,  msg_nr,  type,  message,  path,  cancel=None,  answers=None):
         """
         Transfer a message and decode the answer
         if needed repeat with correct time offset
@@ -279,337 +138,480 @@ class dc09_spt():
                 the message to transfer
             path
                 the path to transfer the message over
+            cancel
+                optional threading.Event, when set the transfer stops before its next step
+            answers
+                optional list, the final answer of the receiver ('ACK', 'NAK' or 'DUH') is appended
         return value
             true if message is transferred correct
         """
         ret = 0
-        dc09 = dc09_msg(path.get_account(), path.get_key(), path.get_receiver(), path.get_line(), path.get_offset())
+        answered = 0
+        if cancel != None and cancel.is_set():
+            return ret
+        if trace.hooks:
+            trace.begin('transfer_msg',  msg_nr,  type=type,  host=path.host,  port=path.port)
+        metrics = path.metrics
+        start = time.perf_counter()
+        dc09 = dc09_msg(path.get_account(), path.get_key(), path.get_receiver(), path.get_line(), path.get_offset(), crypt=path.get_crypt())
         mesg = str.encode(dc09.dc09block(msg_nr, type,  message))
-        conn = path.connect()
-        if conn != None:
-            antw = conn.sendAndReceive(mesg,  512)
-            if antw != None:
-                res = dc09.dc09answer(msg_nr,  antw.decode())
-                if res != None:
-                    path.set_offset(res[1])
-                    if res[0] == 'NAK':
-                        dc09.set_offset(res[1])
-                        mesg = str.encode(dc09.dc09block(msg_nr, type,  msg))
-                        conn.send(mesg)
-                        antw = conn.receive(1024)
-                        if antw != None:
-                            res = dc09answer(self.msg_nr,  antw)
-                    if res[0] == 'ACK':
-                        ret = 1
-            logging.debug('Sent message nr %s type %s content %s to %s port %s answer %s',  msg_nr, type,  message,  path.host,  path.port,  antw)
-        if conn != None:
-            conn.disconnect()
+        connecting = time.perf_counter()
+        path.breaker.attempt()
+        conn = None
+        try:
+            conn = path.connect()
+            metrics.observe('connect',  time.perf_counter() - connecting)
+            if conn == None:
+                metrics.count('error')
+            else:
+                antw = path.exchange(conn,  mesg,  512,  msg_nr)
+                if cancel != None and cancel.is_set():
+                    antw = None
+                elif antw == None and path.reused():
+                    # kept open connection was dead, retry once on a fresh one
+                    metrics.count('retry')
+                    conn = path.reconnect(conn)
+                    if conn != None:
+                        antw = path.exchange(conn,  mesg,  512,  msg_nr)
+                if antw != None:
+                    answered = 1
+                    res = dc09.dc09answer(msg_nr,  antw)
+                    if res != None:
+                        metrics.count(res[0])
+                        if res[1] != None:
+                            path.set_offset(res[1])
+                        if res[0] == 'NAK' and res[1] != None and (cancel == None or not cancel.is_set()):
+                            if trace.hooks:
+                                trace.begin('nak resync',  msg_nr,  offset=res[1])
+                            dc09.set_offset(res[1])
+                            metrics.count('retry')
+                            mesg = str.encode(dc09.dc09block(msg_nr, type,  message))
+                            antw = path.exchange(conn,  mesg,  1024,  msg_nr)
+                            if antw != None:
+                                res = dc09.dc09answer(msg_nr,  antw)
+                                metrics.count(res[0])
+                            if trace.hooks:
+                                trace.end('nak resync',  msg_nr)
+                        if res[0] == 'ACK':
+                            ret = 1
+                        if answers != None:
+                            answers.append(res[0])
+                logging.debug('Sent message nr %s type %s content %s to %s port %s answer %s',  msg_nr, type,  message,  path.host,  path.port,  antw)
+                metrics.observe('total',  time.perf_counter() - start)
+        except Exception as e:
+            ret = 0
+            metrics.count('error')
+            logging.error('Message nr %s to host %s port %s exception %s',  msg_nr,  path.host,  path.port,  e)
+        finally:
+            path.disconnect(conn)
+        if ret or cancel == None or not cancel.is_set():
+            self.transfer_done(path,  msg_nr,  ret,  answered,  start)
+        if trace.hooks:
+            trace.end('transfer_msg',  msg_nr,  result=ret)
         return ret
 
-class poll_thread(threading.Thread):
+    def transfer_window(self,  messages,  path,  rejected=None):
+        """
+        Transfer a number of messages at once over a TCP path and decode the answers
+        
+        parameters
+            messages
+                list of (msg_nr, type, message) tuples
+            path
+                the path to transfer the messages over
+            rejected
+                optional map, the numbers of the messages the receiver did not accept
+                are added with the answer
+        return value
+            set with the numbers of the acknowledged messages
+        note
+            the answers are handled by dc09_base.window_exchange, a NAK on the window
+            sends the whole rest of the window once more with the time of the receiver
+        """
+        if path.type != 'tcp':
+            # no pipelining on UDP, stop at the first failure
+            acked = set()
+            for mess in messages:
+                answers = []
+                if self.transfer_msg(mess[0],  mess[1],  mess[2],  path,  answers=answers):
+                    acked.add(mess[0])
+                elif len(answers) and rejected != None:
+                    rejected[mess[0]] = answers[-1]
+                else:
+                    break
+            return acked
+        dc09 = dc09_msg(path.get_account(), path.get_key(), path.get_receiver(), path.get_line(), path.get_offset(), crypt=path.get_crypt())
+        if trace.hooks:
+            trace.begin('transfer_window',  messages[0][0],  count=len(messages),  host=path.host,  port=path.port)
+        metrics = path.metrics
+        start = time.perf_counter()
+        exchange = window_exchange(dc09,  messages,  path,  rejected)
+        connecting = time.perf_counter()
+        path.breaker.attempt()
+        conn = None
+        try:
+            conn = path.connect()
+            metrics.observe('connect',  time.perf_counter() - connecting)
+            if conn == None:
+                metrics.count('error')
+            else:
+                block = exchange.block
+                while block != None:
+                    sending = time.perf_counter()
+                    conn.send(block)
+                    metrics.observe('send',  time.perf_counter() - sending)
+                    exchange.sent()
+                    while exchange.waiting():
+                        receiving = time.perf_counter()
+                        antw = conn.receive(1024)
+                        metrics.observe('receive',  time.perf_counter() - receiving)
+                        if antw == None or len(antw) == 0:
+                            metrics.count('timeout')
+                            break
+                        exchange.received(antw)
+                    block = exchange.resend()
+                    if block != None and trace.hooks:
+                        trace.begin('nak resync',  next(iter(exchange.pending)),  offset=exchange.offset,  count=len(exchange.pending))
+                        trace.end('nak resync',  next(iter(exchange.pending)))
+                logging.debug('Sent %s messages to %s port %s, acknowledged %s',  len(messages),  path.host,  path.port,  len(exchange.acked))
+                metrics.observe('total',  time.perf_counter() - start)
+        except Exception as e:
+            metrics.count('error')
+            logging.error('Message window to host %s port %s exception %s',  path.host,  path.port,  e)
+        finally:
+            path.disconnect(conn)
+        acked = exchange.acked
+        self.transfer_done(path,  messages[0][0],  int(len(acked) > 0),  len(acked) > 0 or len(exchange.pending) < len(messages),  start)
+        if trace.hooks:
+            trace.end('transfer_window',  messages[0][0],  acked=len(acked))
+        return acked
+
+class poll_runner:
     """
     Handle the polling tasks of SPT (Secured Premises Transciever)
     extra task is handle the routine events if any
+
+    The runner has no thread of its own: a timer of the shared timer_scheduler fires when
+    the next poll or routine of the poll_schedule of the dialler is due, and the round runs
+    on one of the shared workers of the scheduler. So an idle dialler costs one timer.
     """
-    def __init__(self,  account, receiver,  line,  paths,  pathlock,  retry_delay,  parent):
+    def __init__(self,  parent):
         """
-        Create polling thread 
-        
-        parameters
-            main
-                polling interval in seconds of main path(s)
-            backup
-                polling interval in seconds of back-up path(s)
-            retry_delay
-                delay in seconds before retrying an poll
-            ok_msg
-                map defining the message to be sent when a path recovers
-            fail_msg
-                map defining the message to be sent when a path fails
+        Create the poll runner of dialler -parent-
         """
-        threading.Thread.__init__(self)
-        self.account = account
-        self.receiver = receiver
-        self.line = line
-        self.tpaths = paths
-        self.tpaths_lock = pathlock
         self.parent = parent
-        self.poll_retry_delay = retry_delay
-        self.main_poll = None
-        self.backup_poll = None
-        self.routines = []
-        
-    def set_poll(self,  main,  backup,  ok_msg,  fail_msg):
-        self.main_poll = main
-        self.backup_poll = backup
-        self.ok_msg = ok_msg
-        self.fail_msg = fail_msg
-        self.main_poll_next = 0
-        self.backup_poll_next = 0
-        self.main_poll_ok = 0
-        self.backup_poll_ok = 0
-        self.counter = 0
-    
-    def set_routines(self,  routines):
-        self.routines = routines
-        self.routine_nexts = []
-        now = time.time()
-        for routine in self.routines:
-            if  'interval' in routine:
-                interval = routine['interval']
-            else:
-                interval = 86400
-            if 'start' in routine:
-                start = (now % 86400 ) + routine['start']
-            else:
-                start = now
-            while start < now:
-                start += interval
-            self.routine_nexts.append(start )
+        self.scheduler = timer_scheduler.shared()
+        self.cond = threading.Condition()
+        self.timer = None
+        self.busy = False
+        self.worker = None
+        self.stopping = False
+
+    def changed(self):
+        """
+        Schedule the next round after a change of the polls or routines
+        """
+        with self.cond:
+            # a running round schedules the next one when it ends
+            if not self.busy:
+                self.schedule()
+
+    def schedule(self):
+        """
+        Set the timer to the next deadline, call with the cond held
+        """
+        self.scheduler.cancel(self.timer)
+        self.timer = None
+        if not self.stopping:
+            due = self.parent.polls.next_due()
+            if due != None:
+                self.timer = self.scheduler.schedule(due,  self.fire)
+
+    def fire(self):
+        """
+        Called on the scheduler thread when a poll or routine is due
+        """
+        with self.cond:
+            if self.busy or self.stopping:
+                return
+            self.busy = True
+            self.timer = None
+        if not self.scheduler.submit(self.run):
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
 
 # -----------------
-# send polls while needed (call in thread)
+# send the polls and routines that are due (call in a worker)
 # at first run check all paths
 # ------------------
     def run(self):
-        first = 1
-        while self.main_poll or self.backup_poll or len(self.routines) > 0:
-            # on first poll check validity of all paths
-            self.running = 1
-            now = time.time()
-            # ---------------
-            # main poll 
-            # ---------------
-            main_polled = 0
-            back_up_for_main = 0
-            backup_polled = 0
-            if self.main_poll != None and self.main_poll_next <= now:
-                for ps in ('primary',  'secondary'):
-                    if first or main_polled == 0:
-                        if self.tpaths['main'][ps]['path'] != None:
-                            if self.parent.transfer_msg(0,  "NULL", "]", self.tpaths['main'][ps]['path']):
-                                main_polled = 1
-                                self.counter += 1
-                                if self.tpaths['main'][ps]['ok'] != 1:
-                                    self.tpaths_lock.acquire()
-                                    self.tpaths['main'][ps]['ok'] = 1
-                                    self.tpaths_lock.release()
-                                    self.msg(self.ok_msg, 1,  1)
-                            else:
-                                if self.tpaths['main'][ps]['ok'] != 0:
-                                    self.tpaths_lock.acquire()
-                                    self.tpaths['main'][ps]['ok'] = 0
-                                    self.tpaths_lock.release()
-                                    self.msg(self.fail_msg, 1,  0)
-                if main_polled == 0:
-                    self.main_poll_ok = 0
-                    self.main_ok = 0
-                    back_up_for_main = 1
-                else:
-                    self.main_poll_ok = 1
-                    self.main_ok = 1
-                    self.main_poll_next = now + self.main_poll
-            # ---------------
-            # backup poll 
-            # also triggered when main poll failed 
-            # ---------------
-            if self.backup_poll != None and (self.main_poll_next <= now or self.backup_poll_next <= now):
-                for ps in ('primary',  'secondary'):
-                    if first or backup_polled == 0:
-                        if self.tpaths['back-up'][ps]['path'] != None:
-                            if self.parent.transfer_msg(0,  "NULL",  "]", self.tpaths['main'][ps]['path']):
-                                backup_polled = 1
-                                self.counter += 1
-                                if self.tpaths['back-up'][ps]['ok'] != 1:
-                                    self.tpaths_lock.acquire()
-                                    self.tpaths['back-up'][ps]['ok'] = 1
-                                    self.tpaths_lock.release()
-                                    self.msg(self.ok_msg, 2,  1)
-                            else:
-                                if self.tpaths['back-up'][ps]['ok'] != 0:
-                                    self.tpaths_lock.acquire()
-                                    self.tpaths['back-up'][ps]['ok'] = 0
-                                    self.tpaths_lock.release()
-                                    self.msg(self.fail_msg, 2,  0)
-                if backup_polled == 0:
-                    self.backup_poll_ok = 0
-                    self.backup_ok = 0
-                else:
-                    self.backup_poll_ok = 1
-                    self.backup_ok = 1
-                    self.backup_poll_next = now + self.backup_poll
-            if self.main_poll != None and main_polled and (self.backup_poll == None or backup_polled):
-                first = 0
-            # -----------------
-            # schedule retry of main
-            # -----------------
-            if main_polled != 0 or (back_up_for_main and backup_polled):
-                if self.main_poll != None and self.main_poll_next < now:
-                        self.main_poll_next = now + self.main_poll
-            # ------------------------------
-            # handle routine messages
-            # -----------------------------
-            if len(self.routines) > 0:
-                self.do_routines()
-            # -------------------------
-            # decide how long to sleep
-            # -------------------------
-            time.sleep(self.poll_retry_delay)
-                
-    def msg(self,  msg,  ps,  ok):
-        """
-        Send a message on poll state change
-        """
-        if msg != None:
-            nmsg = msg
-            nmsg['zone'] = ps
-            if 'type' in msg:
-                type = msg['type']
-            else:
-                if 'code' in msg:
-                    code = msg['code']
-                    if len(code) == 3:
-                        type = 'ADM-CID'
-                        if ok:
-                            nmsg['q'] = 1
-                        else:
-                            nmsg['q'] = 3
-                    elif len(code) == 2:
-                        type = 'SIA-DCS'
-            if type != None:
-                self.parent.send_msg(type, msg)
+        self.worker = threading.current_thread()
+        polls = self.parent.polls
+        try:
+            polling = polls.round(time.monotonic())
+            try:
+                mb,  ps = next(polling)
+                while not self.stopping:
+                    ok = self.parent.transfer_msg(0,  "NULL", "]",  self.parent.tpaths[mb][ps]['path'])
+                    mb,  ps = polling.send(ok)
+            except StopIteration:
+                pass
+        except Exception as e:
+            logging.error('Poll of account %s exception %s',  self.parent.account,  e)
+        finally:
+            with self.cond:
+                self.worker = None
+                self.busy = False
+                self.schedule()
+                self.cond.notify_all()
 
     def stop(self):
-        self.main_poll = None
-        self.backup_poll = None
-        self.routines = []
-        
-    def active(self):
-        ret = 0
-        if self.main_poll or self.backup_poll:
-            ret += 1
-        if len(self.routines) > 0:
-            ret += 2
-        return ret
-    
-    def count(self):
-        return self.counter
-
-    def do_routines(self):
-        now = time.time()
-        cnt = 0
-        for n,  r in zip(self.routine_nexts,  self.routines):
-            if n <= now:
-                if 'type' in r:
-                    type = r['type']
-                else:
-                    if 'code' in r:
-                        code = r['code']
-                        if len(code) == 3:
-                            type = 'ADM-CID'
-                        else:
-                            type = 'SIA-DCS'
-                    else:
-                        type = 'SIA-DCS'
-                self.parent.send_msg(type,  r)
-                if  'interval' in r:
-                    interval = r['interval']
-                else:
-                    interval = 86400
-                self.routine_nexts[cnt] = now + interval
-            cnt += 1            
+        """
+        Stop polling, waits for a round in progress
+        """
+        with self.cond:
+            self.stopping = True
+            self.scheduler.cancel(self.timer)
+            self.timer = None
+            if self.worker is not threading.current_thread():
+                while self.busy:
+                    self.cond.wait()
+
+class main_watch:
+    """
+    Wake the event threads when the main thread ends, so they send the messages left and stop
+
+    One daemon thread serves the event threads of all diallers,
+    so an idle event thread can wait for its queue without a timeout.
+    """
+    lock = threading.Lock()
+    threads = set()
+    thread = None
+
+    @staticmethod
+    def add(thread):
+        with main_watch.lock:
+            main_watch.threads.add(thread)
+            if main_watch.thread == None:
+                main_watch.thread = threading.Thread(target=main_watch.run,  name='dc09 main watch',  daemon=True)
+                main_watch.thread.start()
+
+    @staticmethod
+    def remove(thread):
+        with main_watch.lock:
+            main_watch.threads.discard(thread)
+
+    @staticmethod
+    def run():
+        threading.main_thread().join()
+        with main_watch.lock:
+            threads = list(main_watch.threads)
+        for thread in threads:
+            thread.queuelock.acquire()
+            thread.queuelock.notify_all()
+            thread.queuelock.release()
 
 class event_thread(threading.Thread):
     """
     Handle the transmitting of events of SPT (Secured Premises Transciever)
     """
-    def __init__(self,  account, receiver,  line,  queue,  queuelock,  tpaths,  tpaths_lock,  parent):
+    def __init__(self,  parent):
         """
         Handle the Transmitting of events as defined in 
             SIA DC09 specification
             EN 50136-1
         
+        The thread lives as long as the dialler and waits on the queue condition,
+        without a timeout, until send_msg adds a message or main_watch sees the program end.
+        It is not a daemon thread: when the program ends the messages still queued are sent
+        (or refused) first, after that the thread ends by itself.
+        
         parameters
-            account
-                Account number to be used. 
-                Most receivers expect a numeric string of 4 to 8 digits
-            receiver
-                an optional integer to be used as receiver number in the block header
-            line
-                an optional integer to be used as line number in the block header
+            parent
+                the dc09_spt dialler, its queue, paths, send retry delays and window are used
         """
         threading.Thread.__init__(self)
-        self.account = account
-        self.receiver = receiver
-        self.line = line
-        self.queue = queue
-        self.queuelock = queuelock
-        self.tpaths = tpaths
-        self.tpaths_lock = tpaths_lock
-        self.send_retry_delay = 0.5
         self.parent = parent
+        self.queue = parent.queue
+        self.queuelock = parent.queuelock
+        self.tpaths = parent.tpaths
+        self.retries = 0
+        self.running = 0
+        self.stopping = 0
+
+    def stop(self):
+        """
+        Stop the thread, call with the queuelock held
+        """
+        self.stopping = 1
+        self.queuelock.notify_all()
 # -----------------
 # send events while needed (call in thread)
 # checks message queue and retries
 # ------------------
     def run(self):
-        while  len(self.queue) > 0:
-            # --------------------
-            # first handle queue
-            # --------------------
+        main_watch.add(self)
+        while not self.stopping:
+            self.queuelock.acquire()
+            while self.queue.ready() == 0 and not self.stopping:
+                if self.running:
+                    self.running = 0
+                    # wake flush
+                    self.queuelock.notify_all()
+                due = self.queue.next_due()
+                if due == None:
+                    if len(self.queue) == 0 and not threading.main_thread().is_alive():
+                        # the program ended and everything is sent
+                        self.stopping = 1
+                        break
+                    self.queuelock.wait()
+                else:
+                    self.queuelock.wait(max(0,  due - time.monotonic()))
             self.running = 1
-            sent = 1
-            while sent and len(self.queue):
+            self.queuelock.release()
+            if self.stopping:
+                break
+            try:
                 sent = self.send()
-#            now = time.time()
+            finally:
+                self.parent.sending = 0
+            if sent:
+                self.retries = 0
+            else:
                 # -------------------------
-                # decide how long to sleep
+                # back off before the next try
                 # -------------------------
-    #            if self.main_poll_next < self.backup_poll_next:
-    #                next = self.main_poll_next
-    #            else:
-    #                next = self.backup_poll_next
-    #            if next > now:
-                if len(self.queue):
-                    time.sleep(self.send_retry_delay)
+                until = time.monotonic() + self.parent.retry_delay(self.retries)
+                self.retries += 1
+                self.parent.send_retries += 1
+                self.queuelock.acquire()
+                while not self.stopping and until > time.monotonic():
+                    self.queuelock.wait(until - time.monotonic())
+                self.queuelock.release()
+        main_watch.remove(self)
+        self.queuelock.acquire()
         self.running = 0
+        self.queuelock.notify_all()
+        self.queuelock.release()
             
     def send(self):
+        """
+        Send the next message, or window of messages
+        
+        returns 1 when a message was sent or refused by the receiver,
+        0 when no path could deliver it
+        """
         self.queuelock.acquire()
-        if len(self.queue) == 0:
+        if self.queue.ready() == 0:
+            self.queuelock.release()
+            return 1
+        if self.parent.racing(self.queue[0]):
+            mess = self.queue.popleft()
+            self.parent.sending = 1
             self.queuelock.release()
-            return
+            return self.send_race(mess)
+        if self.parent.window > 1:
+            self.queuelock.release()
+            return self.send_window()
         mess = self.queue.popleft()
+        self.parent.sending = 1
         self.queuelock.release()
         msg_sent = 0
+        answers = []
         # ---------------------------
-        # first try known good paths
-        # --------------------------
-        for mb in ('main',  'back-up'):
-            for ps in ('primary',  'secondary'):
-                if msg_sent == 0 and self.tpaths[mb][ps]['path'] != None:
-                    if self.tpaths[mb][ps]['ok']:
-                        if self.parent.transfer_msg(mess[0], mess[1],  mess[2],  self.tpaths[mb][ps]['path']):
-                            msg_sent = 1
-        # ---------------------------
-        # then try all available paths
+        # first try known good paths, best first, then the other paths,
+        # except those with an open circuit breaker; stop when the receiver refuses it
         # --------------------------
-        if msg_sent == 0:
-            for mb in ('main',  'back-up'):
-                for ps in ('primary',  'secondary'):
-                    if msg_sent == 0 and self.tpaths[mb][ps]['path'] != None:
-                        if self.parent.transfer_msg(mess[0], mess[1],  mess[2],  self.tpaths[mb][ps]['path']):
-                            msg_sent = 1
-                            self.tpaths_lock.acquire()
-                            self.tpaths[mb][ps]['ok'] = 1
-                            self.tpaths_lock.release()
-        if msg_sent == 0:
-            self.queuelock.acquire()
-            tup = mess[0], mess[1],  mess[2]
-            self.queue.appendleft(tup)
-            self.queuelock.release()
+        for mb,  ps in self.parent.send_paths():
+            started = time.monotonic()
+            if self.parent.transfer_msg(mess[0], mess[1],  mess[2],  self.tpaths[mb][ps]['path'],  answers=answers):
+                msg_sent = 1
+                self.parent.set_path_ok(mb,  ps,  1)
+                break
+            if len(answers):
+                break
+        if msg_sent:
+            self.parent.acknowledge(mess,  started)
+        elif len(answers):
+            # refused by the receiver, retry later without blocking the other messages
+            self.parent.reject(mess,  answers[-1])
+            msg_sent = 1
+        else:
+            self.parent.requeue([mess])
         return msg_sent
     
+    def send_race(self,  mess):
+        """
+        Send a message on all paths, each one -race delay- after the previous,
+        until one acknowledges it, see dc09_base.set_race
+        """
+        race = threading.Condition()
+        cancel = threading.Event()
+        outcome = {'winner': None,  'done': 0}
+        answers = []
+
+        def attempt(mb,  ps,  path):
+            started = time.monotonic()
+            ok = self.parent.transfer_msg(mess[0], mess[1],  mess[2],  path,  cancel,  answers)
+            with race:
+                outcome['done'] += 1
+                if ok and outcome['winner'] == None:
+                    outcome['winner'] = (mb,  ps,  started)
+                race.notify_all()
+
+        paths = self.parent.send_paths()
+        with race:
+            for n,  (mb,  ps) in enumerate(paths):
+                path = self.tpaths[mb][ps]['path']
+                if path == None:
+                    continue
+                threading.Thread(target=attempt,  args=(mb,  ps,  path),  daemon=True).start()
+                if n < len(paths) - 1:
+                    # start the next path after the delay, or when all started ones failed
+                    until = time.monotonic() + self.parent.race_delay
+                    while outcome['winner'] == None and outcome['done'] <= n and until > time.monotonic():
+                        race.wait(until - time.monotonic())
+                    if outcome['winner'] != None:
+                        break
+            while outcome['winner'] == None and outcome['done'] < len(paths) and not self.stopping:
+                race.wait(1.0)
+            cancel.set()
+            winner = outcome['winner']
+        if winner == None:
+            if len(answers):
+                self.parent.reject(mess,  answers[-1])
+                return 1
+            self.parent.requeue([mess])
+            return 0
+        mb,  ps,  started = winner
+        logging.debug('Message nr %s raced, acknowledged on %s %s path',  mess[0],  mb,  ps)
+        self.parent.set_path_ok(mb,  ps,  1)
+        self.parent.acknowledge(mess,  started)
+        return 1
+
+    def send_window(self):
+        """
+        Send up to -window- messages at once, queue the ones not acknowledged again
+        """
+        messes = self.parent.take_window()
+        if len(messes) == 0:
+            return 1
+        self.parent.sending = len(messes)
+        count = len(messes)
+        # ---------------------------
+        # first try known good paths, best first, then the other paths;
+        # the messages refused by the receiver are not tried on the next path
+        # --------------------------
+        for mb,  ps in self.parent.send_paths():
+            path = self.tpaths[mb][ps]['path']
+            if len(messes) and path != None:
+                rejected = {}
+                started = time.monotonic()
+                acked = self.parent.transfer_window(messes,  path,  rejected)
+                messes = self.parent.window_done(messes,  acked,  rejected,  started,  mb,  ps)
+        self.parent.requeue(messes)
+        return int(len(messes) < count)
+
     def active(self):
         return self.running
-            
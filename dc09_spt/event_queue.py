@@ -0,0 +1,176 @@
+# ----------------------------
+# Priority queue of events
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import heapq
+import time
+
+# priorities of the event codes, SIA codes and ADM-CID event codes or their first digits
+# a code is looked up as a whole, then by ever shorter prefixes
+ALARM = 3
+TROUBLE = 2
+NORMAL = 1
+ROUTINE = 0
+
+priority_map = {
+    # SIA-DCS alarms
+    'BA': ALARM,  'FA': ALARM,  'PA': ALARM,  'HA': ALARM,  'MA': ALARM,  'GA': ALARM,  'KA': ALARM,  'QA': ALARM,
+    # SIA-DCS troubles and tampers
+    'TA': TROUBLE,  'WA': TROUBLE,  'FT': TROUBLE,  'BT': TROUBLE,  'AT': TROUBLE,  'YS': TROUBLE,  'YT': TROUBLE,
+    # SIA-DCS tests and routine reports
+    'RP': ROUTINE,  'RX': ROUTINE,  'RS': ROUTINE,
+    # ADM-CID: 1xx alarms, 3xx troubles, 6xx tests
+    '1': ALARM,  '3': TROUBLE,  '6': ROUTINE,
+}
+
+def event_priority(code,  mapping=None,  default=NORMAL):
+    """
+    Return the priority of event -code- in -mapping- (default priority_map)
+    """
+    if mapping == None:
+        mapping = priority_map
+    if code == None:
+        return default
+    code = str(code)
+    for n in range(len(code),  0,  -1):
+        if code[:n] in mapping:
+            return mapping[code[:n]]
+    return default
+
+class event_queue:
+    """
+    Queue of messages ordered by priority, first in first out within a priority
+
+    It replaces the deque of the dialler: append adds a message at the end of its priority,
+    popleft takes the first message of the highest priority and appendleft puts a message back
+    in front of its priority, as the send thread does when a transfer failed.
+    Both adding and taking cost O(log n).
+    The priority of a message is read with -key-, by default the last item of the message tuple.
+
+    A message the receiver refused can be deferred: it waits in a second heap, ordered by
+    the time of its next attempt, and returns to its priority when that time has come.
+    The number of attempts is kept per message until done is called.
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+    def __init__(self,  key=None):
+        if key == None:
+            key = lambda mess: mess[-1]
+        self.key = key
+        self.heap = []
+        self.deferred = []
+        self.attempts = {}
+        self.first = 0
+        self.last = 0
+
+    def append(self,  mess):
+        self.last += 1
+        heapq.heappush(self.heap,  (-self.key(mess),  self.last,  mess))
+
+    def appendleft(self,  mess):
+        self.first -= 1
+        heapq.heappush(self.heap,  (-self.key(mess),  self.first,  mess))
+
+    def extendleft(self,  messes):
+        for mess in messes:
+            self.appendleft(mess)
+
+    def popleft(self):
+        self.promote()
+        if len(self.heap) == 0:
+            raise IndexError('pop from an empty event_queue')
+        return heapq.heappop(self.heap)[2]
+
+    def defer(self,  mess,  until):
+        """
+        Count an attempt of -mess- and keep it out of the queue until time.monotonic() -until-
+        returns the number of attempts
+        """
+        attempts = self.attempts.get(mess,  0) + 1
+        self.attempts[mess] = attempts
+        self.last += 1
+        heapq.heappush(self.deferred,  (until,  self.last,  mess))
+        return attempts
+
+    def tries(self,  mess):
+        """
+        Return the number of attempts counted for -mess-
+        """
+        return self.attempts.get(mess,  0)
+
+    def done(self,  mess):
+        """
+        Forget the attempts of -mess-, after it was sent or given up
+        """
+        if len(self.attempts):
+            self.attempts.pop(mess,  None)
+
+    def promote(self):
+        """
+        Move the deferred messages that are due back to their priority, in front of it
+        """
+        if len(self.deferred):
+            now = time.monotonic()
+            while len(self.deferred) and self.deferred[0][0] <= now:
+                self.appendleft(heapq.heappop(self.deferred)[2])
+
+    def ready(self):
+        """
+        Return the number of messages that can be sent now
+        """
+        self.promote()
+        return len(self.heap)
+
+    def next_due(self):
+        """
+        Return the time.monotonic() at which the first deferred message is due, or None
+        """
+        if len(self.deferred):
+            return self.deferred[0][0]
+        return None
+
+    def __getitem__(self,  index):
+        """
+        Only the first message, queue[0], can be read
+        """
+        self.promote()
+        if index != 0 or len(self.heap) == 0:
+            raise IndexError('event_queue index out of range')
+        return self.heap[0][2]
+
+    def __len__(self):
+        """
+        Return the number of messages waiting, including the deferred ones
+        """
+        return len(self.heap) + len(self.deferred)
+
+    def __iter__(self):
+        for entry in sorted(self.heap):
+            yield entry[2]
+        for entry in sorted(self.deferred):
+            yield entry[2]
+
+    def counts(self):
+        """
+        Return a map of priority to the number of messages waiting, including the deferred ones
+        """
+        ret = {}
+        for entry in self.heap:
+            ret[-entry[0]] = ret.get(-entry[0],  0) + 1
+        for entry in self.deferred:
+            priority = self.key(entry[2])
+            ret[priority] = ret.get(priority,  0) + 1
+        return ret
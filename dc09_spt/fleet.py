@@ -0,0 +1,486 @@
+# ----------------------------
+# Fleet of diallers over worker processes
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from dc09_spt.dc09_aio import dc09_aio_spt
+
+# configuration methods of the diallers that can be called on a fleet_dialler,
+# the ones in -starting- are applied after the journal is opened
+configure = ('set_path',  'del_path',  'start_poll',  'stop_poll',  'start_routine',  'set_priorities',  'set_dead_letter',
+    'resend_dead_letters',  'set_send_retry',  'set_race',  'set_spread',  'set_selection',  'set_window')
+starting = ('start_poll',  'start_routine',  'resend_dead_letters')
+
+def journal_name(journal_dir,  account):
+    """
+    Return the file name of the journal of -account- in -journal_dir-
+    """
+    return os.path.join(journal_dir,  re.sub(r'[^0-9A-Za-z_-]',  '_',  str(account)) + '.jnl')
+
+def fleet_worker(conn,  journal_dir,  level):
+    """
+    Main function of a worker process: runs the diallers of one shard on an event loop
+    and executes the commands of the fleet
+
+    commands
+        ('add', account, receiver, line, calls)
+            create the dialler, apply the configuration -calls- and open its journal
+        ('call', account, name, args, kwargs)
+            call configuration method -name- of the dialler
+        ('send', seq, account, type, param, priority)
+            queue a message; the messages received together are answered with one
+            ('queued', [seq, ...]) once they are in the journals of their diallers
+        ('state', id) and ('metrics', id)
+            answered with (kind, id, map of account to the state or metrics of the dialler)
+        ('stop', )
+            stop all diallers, answered with ('stopped', )
+    """
+    if level != None:
+        logging.basicConfig(level=level)
+    asyncio.run(fleet_serve(conn,  journal_dir))
+    conn.close()
+
+def fleet_reader(conn,  loop,  commands,  lock,  wakeup):
+    """
+    Reader thread of a worker process: receives the commands of the fleet into -commands-
+    and wakes up the event loop when the first one of a batch arrives, None marks the end
+    """
+    while True:
+        try:
+            cmd = conn.recv()
+        except (EOFError,  OSError):
+            cmd = None
+        with lock:
+            commands.append(cmd)
+            first = len(commands) == 1
+        if first:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # the loop has ended
+                return
+        if cmd == None:
+            return
+
+async def fleet_serve(conn,  journal_dir):
+    """
+    Execute the commands of the fleet on the event loop, see fleet_worker
+
+    The commands that arrived while the previous batch was handled form the next batch,
+    its messages are written to the journals without fsync and each journal touched
+    is synced once, in the executor, before the batch is confirmed.
+    """
+    loop = asyncio.get_running_loop()
+    commands = deque()
+    lock = threading.Lock()
+    wakeup = asyncio.Event()
+    threading.Thread(target=fleet_reader,  args=(conn,  loop,  commands,  lock,  wakeup),  name='dc09 fleet reader',  daemon=True).start()
+    diallers = {}
+    running = True
+    while running:
+        await wakeup.wait()
+        wakeup.clear()
+        with lock:
+            batch = list(commands)
+            commands.clear()
+        queued = []
+        journals = set()
+        stop = False
+        for cmd in batch:
+            if cmd == None:
+                running = False
+                break
+            kind = cmd[0]
+            try:
+                if kind == 'send':
+                    seq,  account,  type,  param,  priority = cmd[1:]
+                    try:
+                        spt = diallers[account]
+                        spt.send_msg(type,  param,  priority,  sync=False)
+                        if spt.journal != None:
+                            journals.add(spt.journal)
+                    except Exception as e:
+                        logging.error('Fleet account %s message %s %s exception %s',  account,  type,  param,  e)
+                    queued.append(seq)
+                elif kind == 'add':
+                    account,  receiver,  line,  calls = cmd[1:]
+                    spt = dc09_aio_spt(account,  receiver,  line,  loop=loop)
+                    for name,  args,  kwargs in calls:
+                        if name not in starting:
+                            fleet_call(spt,  name,  args,  kwargs)
+                    spt.set_journal(journal_name(journal_dir,  account))
+                    for name,  args,  kwargs in calls:
+                        if name in starting:
+                            fleet_call(spt,  name,  args,  kwargs)
+                    diallers[account] = spt
+                elif kind == 'call':
+                    account,  name,  args,  kwargs = cmd[1:]
+                    fleet_call(diallers[account],  name,  args,  kwargs)
+                elif kind == 'state':
+                    conn.send(('state',  cmd[1],  {account: spt.state() for account,  spt in diallers.items()}))
+                elif kind == 'metrics':
+                    conn.send(('metrics',  cmd[1],  {account: spt.metrics() for account,  spt in diallers.items()}))
+                elif kind == 'stop':
+                    stop = True
+                    running = False
+                    break
+            except (EOFError,  OSError):
+                running = False
+                break
+            except Exception as e:
+                logging.error('Fleet worker command %s exception %s',  kind,  e)
+        try:
+            if len(journals):
+                await asyncio.gather(*(loop.run_in_executor(None,  journal.sync) for journal in journals))
+            if len(queued):
+                conn.send(('queued',  queued))
+        except (EOFError,  OSError):
+            break
+        if stop:
+            for spt in diallers.values():
+                spt.start_routine([])
+                spt.stop_poll()
+                await spt.close()
+            try:
+                conn.send(('stopped', ))
+            except (EOFError,  OSError):
+                pass
+
+def fleet_call(spt,  name,  args,  kwargs):
+    try:
+        getattr(spt,  name)(*args,  **kwargs)
+    except Exception as e:
+        logging.error('Fleet account %s %s exception %s',  spt.account,  name,  e)
+
+class fleet_dialler:
+    """
+    Stand-in for a dialler running in a worker process of a dc09_fleet
+
+    send_msg and the configuration methods of the dialler (see -configure-) are forwarded to the worker,
+    they do not return a value. Their arguments are pickled, so functions passed must be defined
+    at module level, not lambdas.
+    """
+    def __init__(self,  fleet,  account):
+        self.fleet = fleet
+        self.account = account
+
+    def send_msg(self,  type,  param,  priority=None):
+        self.fleet.send_msg(self.account,  type,  param,  priority)
+
+    def __getattr__(self,  name):
+        if name not in configure:
+            raise AttributeError(name)
+        return lambda *args,  **kwargs: self.fleet.call(self.account,  name,  *args,  **kwargs)
+
+class fleet_shard:
+    """
+    Parent side of a worker process: its connection, accounts and messages not yet confirmed
+    """
+    def __init__(self,  index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.alive = False
+        self.accounts = []
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.restarts = 0
+        self.restart_at = None
+
+class dc09_fleet:
+    """
+    Run the diallers of many accounts in several worker processes
+
+    One process is limited to one core by the GIL, encrypting and encoding the messages of
+    tens of thousands of accounts is not. The fleet shards the accounts over -workers- processes
+    by a hash of the account, each process runs the dc09_aio_spt diallers of its accounts on one event loop.
+    The fleet keeps the configuration calls of every account and sends the messages over a pipe
+    to the worker. A message stays with the fleet until the worker has it in the journal of its dialler.
+
+    When a worker dies it is started again after -restart_delay- seconds: its diallers are configured
+    again, read the messages not sent from their journals and the messages the fleet still holds
+    are sent again. A message may then be sent twice, the receiver handles it as a duplicate.
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+    def __init__(self,  journal_dir,  workers=None,  restart_delay=1.0,  start_method='spawn'):
+        """
+        parameters
+            journal_dir
+                directory of the journals, one file per account
+            workers
+                number of worker processes, by default the number of cores
+            restart_delay
+                seconds before a worker that died is started again
+            start_method
+                multiprocessing start method of the workers, 'spawn' does not copy the threads
+                of the parent; the program then has to start the fleet under if __name__ == '__main__'
+        """
+        if workers == None:
+            workers = os.cpu_count() or 1
+        self.journal_dir = journal_dir
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context(start_method)
+        self.shards = [fleet_shard(n) for n in range(workers)]
+        self.accounts = {}
+        self.seq = itertools.count(1)
+        self.lock = threading.Condition()
+        self.answers = {}
+        self.running = False
+        self.monitor = None
+
+    def shard(self,  account):
+        """
+        Return the shard running -account-
+        """
+        return self.shards[zlib.crc32(str(account).encode()) % len(self.shards)]
+
+    def add(self,  account,  receiver=None,  line=None):
+        """
+        Add a dialler for -account-, see dc09_spt
+        returns a fleet_dialler to configure it and send messages
+        """
+        shard = self.shard(account)
+        with shard.lock:
+            if account not in self.accounts:
+                self.accounts[account] = {'receiver': receiver,  'line': line,  'calls': []}
+                shard.accounts.append(account)
+                if shard.alive:
+                    self.write(shard,  ('add',  account,  receiver,  line,  []))
+        return fleet_dialler(self,  account)
+
+    def call(self,  account,  name,  *args,  **kwargs):
+        """
+        Call configuration method -name- of the dialler of -account-, also after a restart of its worker
+        """
+        if name not in configure:
+            raise AttributeError(name)
+        shard = self.shard(account)
+        with shard.lock:
+            self.accounts[account]['calls'].append((name,  args,  kwargs))
+            if shard.alive:
+                self.write(shard,  ('call',  account,  name,  args,  kwargs))
+
+    def send_msg(self,  account,  type,  param,  priority=None):
+        """
+        Schedule a message for sending by the dialler of -account-, see dc09_spt.send_msg
+        """
+        if account not in self.accounts:
+            raise KeyError('account ' + str(account) + ' not in fleet')
+        shard = self.shard(account)
+        with shard.lock:
+            seq = next(self.seq)
+            cmd = ('send',  seq,  account,  type,  param,  priority)
+            shard.pending[seq] = cmd
+            if shard.alive:
+                self.write(shard,  cmd)
+
+    def write(self,  shard,  cmd):
+        """
+        Send -cmd- to the worker of -shard-, call with the shard lock held
+        a worker that died is noticed and restarted by the monitor thread
+        """
+        try:
+            shard.conn.send(cmd)
+        except (OSError,  ValueError) as e:
+            logging.error('Fleet worker %s send exception %s',  shard.index,  e)
+            shard.alive = False
+
+    def start(self):
+        """
+        Start the worker processes
+        """
+        if not os.path.isdir(self.journal_dir):
+            os.makedirs(self.journal_dir)
+        self.running = True
+        for shard in self.shards:
+            self.start_worker(shard)
+        self.monitor = threading.Thread(target=self.run,  name='dc09 fleet',  daemon=True)
+        self.monitor.start()
+
+    def start_worker(self,  shard):
+        with shard.lock:
+            conn,  child = self.context.Pipe()
+            process = self.context.Process(target=fleet_worker,  args=(child,  self.journal_dir,  logging.getLogger().level),
+                name='dc09 fleet ' + str(shard.index),  daemon=True)
+            process.start()
+            child.close()
+            shard.process = process
+            shard.conn = conn
+            shard.alive = True
+            shard.restart_at = None
+            for account in shard.accounts:
+                acc = self.accounts[account]
+                self.write(shard,  ('add',  account,  acc['receiver'],  acc['line'],  acc['calls']))
+            for seq in sorted(shard.pending):
+                self.write(shard,  shard.pending[seq])
+            if len(shard.pending):
+                logging.info('Fleet worker %s resent %s messages',  shard.index,  len(shard.pending))
+
+    def run(self):
+        """
+        Monitor thread: handle the answers of the workers and restart the ones that died
+        """
+        while self.running:
+            waits = {}
+            for shard in self.shards:
+                if shard.process != None and shard.restart_at == None:
+                    waits[shard.conn] = shard
+                    waits[shard.process.sentinel] = shard
+            timeout = 1.0
+            restarts = [shard.restart_at for shard in self.shards if shard.restart_at != None]
+            if len(restarts):
+                timeout = min(timeout,  max(0,  min(restarts) - time.monotonic()))
+            for ready in multiprocessing.connection.wait(list(waits),  timeout):
+                shard = waits[ready]
+                if shard.restart_at == None and not self.receive(shard):
+                    self.died(shard)
+            now = time.monotonic()
+            for shard in self.shards:
+                if self.running and shard.restart_at != None and shard.restart_at <= now:
+                    shard.restarts += 1
+                    self.start_worker(shard)
+
+    def receive(self,  shard):
+        """
+        Handle the waiting answers of -shard-, returns False when the worker is gone
+        """
+        try:
+            while shard.conn.poll():
+                answer = shard.conn.recv()
+                if answer[0] == 'queued':
+                    with shard.lock:
+                        for seq in answer[1]:
+                            shard.pending.pop(seq,  None)
+                elif answer[0] in ('state',  'metrics'):
+                    with self.lock:
+                        if answer[1] in self.answers:
+                            self.answers[answer[1]][shard.index] = answer[2]
+                            self.lock.notify_all()
+        except (EOFError,  OSError):
+            return False
+        return shard.process.is_alive()
+
+    def died(self,  shard):
+        with shard.lock:
+            shard.alive = False
+            shard.conn.close()
+            shard.process.join(1.0)
+            if shard.process.is_alive():
+                shard.process.terminate()
+                shard.process.join()
+            if self.running:
+                shard.restart_at = time.monotonic() + self.restart_delay
+                logging.error('Fleet worker %s stopped with exit code %s, %s messages waiting, restart in %s s',
+                    shard.index,  shard.process.exitcode,  len(shard.pending),  self.restart_delay)
+        with self.lock:
+            self.lock.notify_all()
+
+    def request(self,  kind,  timeout):
+        """
+        Ask all workers for the -kind- of their diallers, returns a map of shard index to their answer
+        """
+        id = next(self.seq)
+        with self.lock:
+            self.answers[id] = {}
+        asked = []
+        for shard in self.shards:
+            with shard.lock:
+                if shard.alive:
+                    self.write(shard,  (kind,  id))
+                    asked.append(shard)
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while any(shard.alive and shard.index not in self.answers[id] for shard in asked):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.lock.wait(remaining)
+            return self.answers.pop(id)
+
+    def state(self,  timeout=5.0):
+        """
+        Return the state of the fleet and its diallers
+
+        The map contains
+            workers, workers alive, worker restarts
+                the number of worker processes, how many are running and how often they were restarted
+            msgs queued, msgs sent
+                totals over the diallers
+            msgs in transit
+                messages the workers have not yet confirmed
+            accounts
+                map of account to the state of its dialler, see dc09_spt.state,
+                extended with 'worker'; a worker that did not answer within -timeout- gives {'worker': n}
+        """
+        answers = self.request('state',  timeout)
+        ret = {'workers': len(self.shards),  'workers alive': sum(1 for shard in self.shards if shard.alive),
+            'worker restarts': sum(shard.restarts for shard in self.shards),
+            'msgs in transit': sum(len(shard.pending) for shard in self.shards),
+            'msgs queued': 0,  'msgs sent': 0,  'accounts': {}}
+        for shard in self.shards:
+            states = answers.get(shard.index,  {})
+            for account in shard.accounts:
+                state = states.get(account,  {})
+                state['worker'] = shard.index
+                ret['msgs queued'] += state.get('msgs queued',  0)
+                ret['msgs sent'] += state.get('msgs sent',  0)
+                ret['accounts'][account] = state
+        return ret
+
+    def metrics(self,  timeout=5.0):
+        """
+        Return the list of the metrics of the diallers that answered within -timeout-, see dc09_spt.metrics
+        dc09_spt.metrics.prometheus renders the list
+        """
+        ret = []
+        for metrics in self.request('metrics',  timeout).values():
+            ret.extend(metrics.values())
+        return ret
+
+    def stop(self,  timeout=10.0):
+        """
+        Stop the diallers and the worker processes, the messages not sent stay in the journals
+        """
+        self.running = False
+        for shard in self.shards:
+            with shard.lock:
+                if shard.alive:
+                    self.write(shard,  ('stop', ))
+        if self.monitor != None:
+            self.monitor.join()
+            self.monitor = None
+        deadline = time.monotonic() + timeout
+        for shard in self.shards:
+            if shard.process != None:
+                shard.process.join(max(0,  deadline - time.monotonic()))
+                if shard.process.is_alive():
+                    logging.warning('Fleet worker %s did not stop, terminated',  shard.index)
+                    shard.process.terminate()
+                    shard.process.join()
+            shard.alive = False
+            if shard.conn != None:
+                shard.conn.close()
@@ -0,0 +1,200 @@
+# ----------------------------
+# Event journal class
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import os
+import mmap
+import json
+import struct
+import zlib
+import threading
+import logging
+
+class event_journal:
+    """
+    Append only journal to keep queued events over a restart of the process
+
+    Every queued event is written as an add record and made durable with fsync before
+    send_msg returns. Concurrent writers share one fsync (group commit): the first writer
+    waiting does the fsync for all records written up to then, the others wait for it.
+    A caller queueing a batch of events can append them with sync=False and call sync() once.
+    An acknowledged event only gets a small ack record without fsync; after a crash such
+    an event may be sent once more.
+    When the acknowledged records outnumber the unsent ones the journal is rewritten
+    with only the unsent events.
+
+    Each record is : kind (1 byte, 'A' or 'K'), id (8 bytes), length (4 bytes), crc32 (4 bytes), data
+    On opening, the journal is read through a memory map; a torn record at the end
+    (from a crash during a write) is cut off.
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+    header = struct.Struct('<cQII')
+
+    def __init__(self,  filename,  compact_min=1000):
+        """
+        Open or create a journal
+
+        parameters
+            filename
+                name of the journal file
+            compact_min
+                minimum number of ack records before the journal is compacted
+        """
+        self.filename = filename
+        self.compact_min = compact_min
+        self.lock = threading.Condition()
+        self.entries = {}
+        self.next_id = 1
+        self.acked = 0
+        self.written = 0
+        self.synced = 0
+        self.syncing = False
+        self.replay()
+        self.fd = os.open(self.filename,  os.O_WRONLY | os.O_CREAT | os.O_APPEND,  0o600)
+
+    @staticmethod
+    def record(kind,  id,  data=b''):
+        return event_journal.header.pack(kind,  id,  len(data),  zlib.crc32(data)) + data
+
+    def replay(self):
+        """
+        Read the journal and keep the events that are not acknowledged
+        """
+        if not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0:
+            return
+        size = event_journal.header.size
+        with open(self.filename,  'r+b') as f:
+            with mmap.mmap(f.fileno(),  0,  access=mmap.ACCESS_READ) as m:
+                pos = 0
+                end = len(m)
+                while pos + size <= end:
+                    kind,  id,  length,  crc = event_journal.header.unpack_from(m,  pos)
+                    if pos + size + length > end or kind not in (b'A',  b'K'):
+                        break
+                    data = m[pos + size:pos + size + length]
+                    if zlib.crc32(data) != crc:
+                        break
+                    if kind == b'A':
+                        self.entries[id] = tuple(json.loads(data.decode()))
+                    else:
+                        self.entries.pop(id,  None)
+                        self.acked += 1
+                    if id >= self.next_id:
+                        self.next_id = id + 1
+                    pos += size + length
+            if pos < end:
+                logging.warning('Journal %s damaged at offset %s, %s bytes dropped',  self.filename,  pos,  end - pos)
+                f.truncate(pos)
+
+    def pending(self):
+        """
+        Return a list of (id, event) of the events not acknowledged, in order of adding
+        """
+        with self.lock:
+            return sorted(self.entries.items())
+
+    def append(self,  event,  sync=True):
+        """
+        Add an event and wait until it is on disk
+
+        parameters
+            event
+                tuple of the event, it is stored as JSON
+            sync
+                False returns at once, the caller then calls sync() before relying on the event
+                being on disk, so one fsync serves a batch of events
+        returns the id to use with ack
+        """
+        data = json.dumps(list(event)).encode()
+        with self.lock:
+            id = self.next_id
+            self.next_id += 1
+            os.write(self.fd,  event_journal.record(b'A',  id,  data))
+            self.entries[id] = event
+            self.written += 1
+            seq = self.written
+        if sync:
+            self.commit(seq)
+        return id
+
+    def sync(self):
+        """
+        Wait until all events added so far are on disk
+        """
+        with self.lock:
+            seq = self.written
+        self.commit(seq)
+
+    def commit(self,  seq):
+        """
+        Wait until write number -seq- is on disk, one fsync serves all waiting writers
+        """
+        with self.lock:
+            while self.synced < seq:
+                if self.syncing:
+                    self.lock.wait()
+                    continue
+                self.syncing = True
+                target = self.written
+                fd = self.fd
+                self.lock.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self.lock.acquire()
+                    self.syncing = False
+                    if target > self.synced:
+                        self.synced = target
+                    self.lock.notify_all()
+
+    def ack(self,  id):
+        """
+        Mark an event as sent
+        """
+        with self.lock:
+            if self.entries.pop(id,  None) == None:
+                return
+            os.write(self.fd,  event_journal.record(b'K',  id))
+            self.acked += 1
+            if self.acked >= self.compact_min and self.acked > 2 * len(self.entries) and not self.syncing:
+                self.compact()
+
+    def compact(self):
+        """
+        Rewrite the journal with only the unsent events, call with the lock held
+        """
+        tmp = self.filename + '.tmp'
+        fd = os.open(tmp,  os.O_WRONLY | os.O_CREAT | os.O_TRUNC,  0o600)
+        try:
+            data = b''.join(event_journal.record(b'A',  id,  json.dumps(list(event)).encode()) for id,  event in sorted(self.entries.items()))
+            os.write(fd,  data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp,  self.filename)
+        os.close(self.fd)
+        self.fd = os.open(self.filename,  os.O_WRONLY | os.O_CREAT | os.O_APPEND,  0o600)
+        self.acked = 0
+        self.synced = self.written
+        logging.debug('Journal %s compacted to %s events',  self.filename,  len(self.entries))
+
+    def close(self):
+        with self.lock:
+            if self.fd != None:
+                os.fsync(self.fd)
+                os.close(self.fd)
+                self.fd = None
@@ -0,0 +1,263 @@
+# ----------------------------
+# Metrics classes
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import bisect
+import threading
+
+class histogram:
+    """
+    Histogram with fixed buckets, for latencies in seconds
+
+    Observing a value costs a binary search in the bucket bounds and three additions,
+    so it can be done for every transfer.
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+    bounds = (0.0005,  0.001,  0.0025,  0.005,  0.01,  0.025,  0.05,  0.1,  0.25,  0.5,  1.0,  2.5,  5.0,  10.0,  30.0,  60.0)
+
+    def __init__(self,  bounds=None):
+        """
+        parameters
+            bounds
+                optional ascending upper bounds of the buckets, a last bucket for larger values is added
+        """
+        if bounds != None:
+            self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self,  value):
+        i = bisect.bisect_left(self.bounds,  value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """
+        Return a map with 'count', 'sum' and 'buckets', a list of (upper bound, cumulative count)
+        the last bound is float('inf')
+        """
+        with self.lock:
+            counts = list(self.counts)
+            ret = {'count': self.count,  'sum': self.sum}
+        buckets = []
+        total = 0
+        for bound,  count in zip(self.bounds + (float('inf'), ),  counts):
+            total += count
+            buckets.append((bound,  total))
+        ret['buckets'] = buckets
+        return ret
+
+class path_metrics:
+    """
+    Metrics of one transmission path
+
+    histograms (seconds)
+        connect     getting a connection, including waiting for a shared persistent connection
+        send        handing the block to the socket
+        receive     waiting for the answer, for UDP this includes the sending and repeats
+        total       the whole transfer including encoding and decoding
+    counts
+        ACK, NAK, DUH   answers received
+        timeout         no answer received
+        error           connection failures and exceptions
+        retry           blocks sent again (after a NAK or on a fresh connection)
+    """
+    stages = ('connect',  'send',  'receive',  'total')
+    names = ('ACK',  'NAK',  'DUH',  'timeout',  'error',  'retry')
+
+    def __init__(self,  bounds=None):
+        self.histograms = {stage: histogram(bounds) for stage in self.stages}
+        self.counts = dict.fromkeys(self.names,  0)
+        self.lock = threading.Lock()
+
+    def observe(self,  stage,  seconds):
+        self.histograms[stage].observe(seconds)
+
+    def count(self,  name,  n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name,  0) + n
+
+    def snapshot(self):
+        """
+        Return a map with the histogram snapshots per stage and the counts
+        """
+        with self.lock:
+            counts = dict(self.counts)
+        return {'histograms': {stage: hist.snapshot() for stage,  hist in self.histograms.items()},
+            'counts': counts}
+
+class path_health:
+    """
+    Exponentially weighted moving averages of the round trip time and the success of a path
+
+    Every transfer, event or poll, adds a sample with weight -alpha-.
+    The score is the expected time to deliver a message: the average round trip time
+    plus the chance of failure times the timeout that a failure costs. Lower is better.
+    """
+    def __init__(self,  alpha=0.2,  timeout=5.0):
+        self.alpha = alpha
+        self.timeout = timeout
+        self.rtt = None
+        self.success = 1.0
+        self.samples = 0
+        self.lock = threading.Lock()
+
+    def record(self,  ok,  seconds):
+        """
+        Add the result of a transfer, -seconds- is its duration, only used when -ok-
+        """
+        with self.lock:
+            self.samples += 1
+            self.success += self.alpha * ((1.0 if ok else 0.0) - self.success)
+            if ok:
+                if self.rtt == None:
+                    self.rtt = seconds
+                else:
+                    self.rtt += self.alpha * (seconds - self.rtt)
+
+    def score(self):
+        """
+        Return the expected delivery time in seconds, None before the first sample
+        """
+        with self.lock:
+            if self.samples == 0:
+                return None
+            rtt = self.rtt
+            if rtt == None:
+                rtt = self.timeout
+            return rtt + (1.0 - self.success) * self.timeout
+
+    def snapshot(self):
+        score = self.score()
+        with self.lock:
+            return {'rtt': self.rtt,  'success': self.success,  'samples': self.samples,  'score': score}
+
+def _label(value):
+    return str(value).replace('\\',  '\\\\').replace('"',  '\\"').replace('\n',  '\\n')
+
+def _labels(labels):
+    return ','.join('{}="{}"'.format(name,  _label(value)) for name,  value in labels)
+
+def _bound(bound):
+    if bound == float('inf'):
+        return '+Inf'
+    return repr(float(bound))
+
+def _histogram(lines,  name,  labels,  snap):
+    for bound,  count in snap['buckets']:
+        lines.append('{}_bucket{{{}}} {}'.format(name,  _labels(labels + [('le',  _bound(bound))]),  count))
+    lines.append('{}_sum{{{}}} {!r}'.format(name,  _labels(labels),  snap['sum']))
+    lines.append('{}_count{{{}}} {}'.format(name,  _labels(labels),  snap['count']))
+
+# the metric of each path count, after the prefix
+_count_metrics = {
+    'timeout': ('_transfer_timeouts_total',  'Transfers without an answer in time'),
+    'error': ('_transfer_errors_total',  'Transfers that failed to connect or raised an exception'),
+    'retry': ('_transfer_retries_total',  'Blocks sent again on a path: repeated, resynced or reconnected'),
+}
+
+def prometheus(diallers,  prefix='dc09'):
+    """
+    Return the metrics of one or more diallers in the Prometheus text format (version 0.0.4)
+
+    parameters
+        diallers
+            a dc09_spt or dc09_aio_spt, or a list of them or of their metrics() maps
+        prefix
+            prefix of the metric names
+    """
+    if not isinstance(diallers,  (list,  tuple)):
+        diallers = [diallers]
+    families = {}
+
+    def family(name,  type,  help):
+        if name not in families:
+            families[name] = ['# HELP {} {}'.format(name,  help),  '# TYPE {} {}'.format(name,  type)]
+        return families[name]
+
+    for spt in diallers:
+        if isinstance(spt,  dict):
+            m = spt
+        else:
+            m = spt.metrics()
+        account = [('account',  m['account'])]
+        family(prefix + '_queue_length',  'gauge',  'Messages waiting to be sent').append(
+            '{}_queue_length{{{}}} {}'.format(prefix,  _labels(account),  m['queued']))
+        family(prefix + '_messages_total',  'counter',  'Messages queued for sending').append(
+            '{}_messages_total{{{}}} {}'.format(prefix,  _labels(account),  m['sent']))
+        family(prefix + '_send_retries_total',  'counter',  'Send attempts that failed on all paths').append(
+            '{}_send_retries_total{{{}}} {}'.format(prefix,  _labels(account),  m['send retries']))
+        family(prefix + '_dead_letters_total',  'counter',  'Messages given up after being refused by the receiver').append(
+            '{}_dead_letters_total{{{}}} {}'.format(prefix,  _labels(account),  m.get('dead letters',  0)))
+        _histogram(family(prefix + '_queue_wait_seconds',  'histogram',  'Time from queueing a message until its successful transfer started'),
+            prefix + '_queue_wait_seconds',  account,  m['queue wait'])
+        for path,  pm in m['paths'].items():
+            labels = account + [('path',  path)]
+            family(prefix + '_path_ok',  'gauge',  'Path state, 1 when the last transfer succeeded').append(
+                '{}_path_ok{{{}}} {}'.format(prefix,  _labels(labels),  pm['ok']))
+            breaker = pm.get('breaker')
+            if breaker != None:
+                family(prefix + '_path_breaker_open',  'gauge',  'Circuit breaker state, 0 closed, 0.5 half-open, 1 open').append(
+                    '{}_path_breaker_open{{{}}} {}'.format(prefix,  _labels(labels),  {'closed': 0,  'half-open': 0.5}.get(breaker['state'],  1)))
+                family(prefix + '_path_breaker_opened_total',  'counter',  'Times the circuit breaker opened').append(
+                    '{}_path_breaker_opened_total{{{}}} {}'.format(prefix,  _labels(labels),  breaker['opened']))
+            health = pm.get('health',  {})
+            if health.get('rtt') != None:
+                family(prefix + '_path_rtt_seconds',  'gauge',  'Moving average of the transfer time').append(
+                    '{}_path_rtt_seconds{{{}}} {!r}'.format(prefix,  _labels(labels),  health['rtt']))
+            if len(health):
+                family(prefix + '_path_success_ratio',  'gauge',  'Moving average of the transfer success').append(
+                    '{}_path_success_ratio{{{}}} {!r}'.format(prefix,  _labels(labels),  health['success']))
+            for stage,  snap in pm['histograms'].items():
+                _histogram(family(prefix + '_transfer_seconds',  'histogram',  'Duration of the stages of a transfer'),
+                    prefix + '_transfer_seconds',  labels + [('stage',  stage)],  snap)
+            for name,  value in pm['counts'].items():
+                if name in ('ACK',  'NAK',  'DUH'):
+                    family(prefix + '_answers_total',  'counter',  'Answers received').append(
+                        '{}_answers_total{{{}}} {}'.format(prefix,  _labels(labels + [('answer',  name)]),  value))
+                elif name in ('polls',  'implicit polls'):
+                    kind = 'explicit' if name == 'polls' else 'implicit'
+                    family(prefix + '_supervisions_total',  'counter',  'Path supervisions, by a poll or by an acknowledged event').append(
+                        '{}_supervisions_total{{{}}} {}'.format(prefix,  _labels(labels + [('kind',  kind)]),  value))
+                elif name in _count_metrics:
+                    metric,  help = _count_metrics[name]
+                    family(prefix + metric,  'counter',  help).append(
+                        '{}{}{{{}}} {}'.format(prefix,  metric,  _labels(labels),  value))
+                else:
+                    family(prefix + '_path_events_total',  'counter',  'Other transfer events').append(
+                        '{}_path_events_total{{{}}} {}'.format(prefix,  _labels(labels + [('event',  name)]),  value))
+            for name,  value in pm['connections'].items():
+                family(prefix + '_connections_total',  'counter',  'Connection events').append(
+                    '{}_connections_total{{{}}} {}'.format(prefix,  _labels(labels + [('event',  name)]),  value))
+            dns = pm.get('dns',  {})
+            if len(dns):
+                family(prefix + '_dns_lookups_total',  'counter',  'Name server lookups of the receiver host').append(
+                    '{}_dns_lookups_total{{{}}} {}'.format(prefix,  _labels(labels),  dns['lookups']))
+                family(prefix + '_dns_failures_total',  'counter',  'Failed name server lookups').append(
+                    '{}_dns_failures_total{{{}}} {}'.format(prefix,  _labels(labels),  dns['lookup failures']))
+                family(prefix + '_dns_stale_total',  'counter',  'Times cached addresses were used after a failed lookup').append(
+                    '{}_dns_stale_total{{{}}} {}'.format(prefix,  _labels(labels),  dns['stale used']))
+                family(prefix + '_dns_addresses',  'gauge',  'Known addresses of the receiver host').append(
+                    '{}_dns_addresses{{{}}} {}'.format(prefix,  _labels(labels),  dns['addresses']))
+    lines = []
+    for name in families:
+        lines.extend(families[name])
+    return '\n'.join(lines) + '\n'
@@ -1,5 +1,7 @@
 from dc09_spt.msg.dc03_msg import dc03_msg
 from dc09_spt.msg.dc05_msg import dc05_msg
 from dc09_spt.msg.dc09_msg import dc09_msg
+from dc09_spt.msg.dc09_crc import dc09_crc
+from dc09_spt.msg.dc09_crypt import dc09_crypt
 
-__all__ = ["dc03_msg", "dc05_msg", "dc09_msg"]
+__all__ = ["dc03_msg", "dc05_msg", "dc09_msg", "dc09_crc", "dc09_crypt"]
@@ -165,3 +165,97 @@ class dc03_msg:
                 else:
                     msg += '|A' + text
         return msg + ']'
+
+    @staticmethod
+    def dc03template(spt_account,  params={}):
+        """
+        Compile a DC03 message for repeated use
+        
+        Parameters
+            see dc03event
+        
+        returns a dc03_template, of which the render method builds the message
+        with only the zone, zonename, user, username and time taken from its parameters
+        """
+        return dc03_template(spt_account,  params)
+
+class dc03_template:
+    """
+    A precompiled DC03 message
+    
+    The account, code, area, text and their validation are handled once.
+    render() fills in the variable fields zone, user and time (and the zone and user names),
+    for fields not given the value used at compile time is taken.
+    The result is the same as dc03event with the combined parameters.
+    """
+    def __init__(self,  spt_account,  params={}):
+        account = param.strpar(params,  'account', spt_account)
+        area = param.numpar(params,  'area')
+        code = param.strpar(params,  'code', None)
+        text = param.strpar(params,  'text', None)
+        flavor = param.strpar(params,  'flavor', None)
+        self.zone = param.numpar(params,'zone')
+        self.zonename = params.get('zonename')
+        self.user = param.numpar(params,  'user')
+        self.username = params.get('username')
+        self.time = params.get('time')
+        self.fixed = None
+        if (code == None or code == 'A') and text != None:
+            # a text message has no variable fields
+            self.fixed = dc03_msg.dc03event(spt_account,  params)
+            return
+        if code == None:
+            code = 'RP'
+        self.code = code
+        self.user_code = dc03_codes.dc03_is_user(code)
+        self.area = None
+        if dc03_codes.dc03_is_area(code) and area != None:
+            self.area = area
+        self.head = '#' + account + '|N'
+        if area != None:
+            if not dc03_codes.dc03_is_area(code):
+                self.head += 'ri' + area
+                if 'areaname' in params:
+                    self.head += '^' + params['areaname'] + '^'
+        self.tail = ']'
+        if text != None:
+            if flavor == 'xsia':
+                self.tail = '*"' + text + '"NM]'
+            else:
+                self.tail = '|A' + text + ']'
+
+    def render(self,  params={}):
+        """
+        Build the message with the variable fields of -params-
+        """
+        if self.fixed != None:
+            return self.fixed
+        user = param.numpar(params,  'user',  self.user)
+        zone = param.numpar(params,  'zone',  self.zone)
+        msg = self.head
+        if user != None and not self.user_code:
+            msg += 'id' + user
+            username = params.get('username',  self.username)
+            if username != None:
+                msg += '^' + username + '^'
+        timep = params.get('time',  self.time)
+        if timep != None:
+            if timep == 'now':
+                timep = time.strftime('%H:%M:%S')
+            msg += 'ti' + timep
+        msg += self.code
+        if self.user_code:
+            if user != None:
+                msg += user
+            if zone != None:
+                logging.warning('Zone %s not included in message because code %s is user related',  zone,  self.code)
+        elif self.area != None:
+            msg += self.area
+            if zone != None:
+                logging.warning('Zone %s not included in message because code %s is area related',  zone,  self.code)
+        elif zone != None:
+            msg += zone
+            zonename = params.get('zonename',  self.zonename)
+            if zonename != None:
+                msg += '^' + zonename + '^'
+        return msg + self.tail
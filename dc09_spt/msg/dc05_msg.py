@@ -79,7 +79,7 @@ class dc05_msg:
         if len(code) != 3:
              raise Exception('Code should be 3 positions')
         q = param.numpar(params,  'q', '1')
-        if  q != '1' and q != '3' and q != '3':
+        if  q != '1' and q != '3' and q != '6':
              raise Exception('Qualifier q should be 1 or 3 or 6')
         area = param.numpar(params,  'area', '00')
         if len(area) != 2:
@@ -92,4 +92,64 @@ class dc05_msg:
             if len(zone) != 3:
                 zone = ('000' + zone)[-3:]
             msg += q + code + ' ' + area + ' ' + zone + ']'
-        return msg 
+        return msg
+
+    @staticmethod
+    def dc05template(spt_account,  params={}):
+        """
+        Compile a DC05 message for repeated use
+        
+        Parameters
+            see dc05event
+        
+        returns a dc05_template, of which the render method builds the message
+        with only the zone, user and qualifier q taken from its parameters
+        """
+        return dc05_template(spt_account,  params)
+
+class dc05_template:
+    """
+    A precompiled DC05 message
+    
+    The account, code, area and their validation are handled once.
+    render() fills in the variable fields zone, user and q,
+    for fields not given the value used at compile time is taken.
+    The result is the same as dc05event with the combined parameters.
+    """
+    def __init__(self,  spt_account,  params={}):
+        account = param.strpar(params,  'account',  spt_account)
+        self.zone = param.numpar(params,'zone',  '000')
+        self.user = param.numpar(params,'user',  None)
+        code = param.numpar(params,  'code',  '602')
+        if len(code) != 3:
+             raise Exception('Code should be 3 positions')
+        self.q = dc05_template.qualifier(param.numpar(params,  'q', '1'))
+        area = param.numpar(params,  'area', '00')
+        if len(area) != 2:
+            area = ('00' + area)[-2: ]
+        self.user_code = dc05_codes.dc05_is_user(code)
+        self.head = '#' + account + '|'
+        self.body = code + ' ' + area + ' '
+
+    @staticmethod
+    def qualifier(q):
+        if  q != '1' and q != '3' and q != '6':
+             raise Exception('Qualifier q should be 1 or 3 or 6')
+        return q
+
+    def render(self,  params={}):
+        """
+        Build the message with the variable fields of -params-
+        """
+        if 'q' in params:
+            q = dc05_template.qualifier(param.numpar(params,  'q'))
+        else:
+            q = self.q
+        user = param.numpar(params,'user',  self.user)
+        if self.user_code and user != None:
+            tail = user
+        else:
+            tail = param.numpar(params,'zone',  self.zone)
+        if len(tail) != 3:
+            tail = ('000' + tail)[-3:]
+        return self.head + q + self.body + tail + ']'
@@ -0,0 +1,100 @@
+# ----------------------------
+# Class to implement the SIA DC07 CRC16
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+"""
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+def _crc_table():
+    """
+    Precompute the CRC16 (polynomial 0xA001, reflected) for every byte value
+    """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for i in range(0, 8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xa001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+class dc09_crc:
+    """
+    Table driven CRC16 according to SIA DC07
+
+    The data can be given as bytes, bytearray, memoryview or str.
+    An instance can be fed in pieces with update(), the static method calc()
+    calculates the CRC of a complete block in one call.
+
+    example:
+        crc = dc09_crc()
+        crc.update(b'"NULL"0000')
+        crc.update(b'#1234[]')
+        value = crc.value()
+    """
+    table = _crc_table()
+
+    def __init__(self,  data=None,  crc=0):
+        """
+        Create a CRC calculator
+
+        parameters
+            data
+                optional first chunk of data
+            crc
+                optional start value, e.g. the value of an earlier calculation
+        """
+        self.crc = crc
+        if data != None:
+            self.update(data)
+
+    def update(self,  data):
+        """
+        Add a chunk of data to the CRC and return self
+        """
+        self.crc = dc09_crc.calc(data,  self.crc)
+        return self
+
+    def value(self):
+        """
+        Return the CRC of all data added so far
+        """
+        return self.crc
+
+    def copy(self):
+        return dc09_crc(crc=self.crc)
+
+    @staticmethod
+    def calc(data,  crc=0):
+        """
+        Static method to calculate the CRC16 of -data- starting at -crc-
+        """
+        if isinstance(data, str):
+            try:
+                data = data.encode('latin-1')
+            except UnicodeEncodeError:
+                # the bitwise implementation only used the lower 8 bits of each character
+                data = bytes(ord(c) & 0xff for c in data)
+        elif isinstance(data, memoryview) and data.format != 'B':
+            data = data.cast('B')
+        table = dc09_crc.table
+        for byte in data:
+            crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+        return crc
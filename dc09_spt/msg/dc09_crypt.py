@@ -0,0 +1,146 @@
+# ----------------------------
+# Class to implement the SIA DC09 encryption context
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+"""
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import os
+import time
+import threading
+from Crypto.Cipher import AES
+
+# padding characters allowed by DC09, everything from chr(20) to chr(125) except [ ] and |
+_pad_delete = bytes(b for b in range(256) if b < 20 or b > 125 or b in b'[]|')
+
+class dc09_crypt:
+    """
+    AES CBC encryption context for one key
+    
+    A context is meant to be kept per transmission path and reused for every block.
+    The AES key schedule is made once, random padding is taken from a prefiltered pool
+    and the timestamp is formatted at most once per second.
+    
+    DC09 uses CBC with an all zero IV for every block. To avoid building a new cipher
+    for each block, the context keeps one running CBC cipher per direction and cancels
+    the chaining by xor-ing the first block with the last ciphertext block of the chain.
+    
+    All methods are thread safe.
+    """
+    pool_size = 1024
+
+    def __init__(self,  key):
+        """
+        Create an encryption context
+        
+        parameters
+            key
+                the encryption key in either 16 or 32 bytes
+        """
+        if len(key) != 16 and len(key) != 32:
+            raise Exception('Keylength is {} but must be either 16 or 32'.format(len(key)))
+        self.key = key
+        self.lock = threading.Lock()
+        self.enc = AES.new(key,  AES.MODE_CBC,  bytes(16))
+        self.enc_last = 0
+        self.dec = AES.new(key,  AES.MODE_CBC,  bytes(16))
+        self.dec_last = 0
+        self.pool = b''
+        self.pool_pos = 0
+        self.stamp_sec = None
+        self.stamp = None
+
+    def padding(self,  count):
+        """
+        Return -count- random padding characters as bytes
+        """
+        pos = self.pool_pos
+        if pos + count > len(self.pool):
+            pool = self.pool[pos:]
+            while len(pool) < count + self.pool_size:
+                pool += os.urandom(self.pool_size).translate(None,  _pad_delete)
+            self.pool = pool
+            pos = 0
+        self.pool_pos = pos + count
+        return self.pool[pos:pos + count]
+
+    def timestamp(self,  offset=0):
+        """
+        Return the DC09 timestamp '_HH:MM:SS,MM-DD-YYYY' in UTC corrected with -offset- seconds
+        """
+        sec = int(time.time() + offset)
+        if sec != self.stamp_sec:
+            tm = time.gmtime(sec)
+            self.stamp = '_{:02d}:{:02d}:{:02d},{:02d}-{:02d}-{:04d}'.format(tm.tm_hour, tm.tm_min, tm.tm_sec,
+                tm.tm_mon, tm.tm_mday, tm.tm_year).encode()
+            self.stamp_sec = sec
+        return self.stamp
+
+    def plain(self,  data,  offset=0):
+        """
+        Build the padded plain text for -data- with timestamp
+        """
+        if isinstance(data,  str):
+            data = data.encode()
+        pad = (len(data) + 21) % 16
+        return self.padding(17 - pad) + data + self.timestamp(offset)
+
+    def encrypt_block(self,  plain):
+        """
+        Encrypt a plain text of a multiple of 16 bytes as if it was the start of a CBC chain
+        """
+        first = (int.from_bytes(plain[:16],  'big') ^ self.enc_last).to_bytes(16,  'big')
+        ret = self.enc.encrypt(first + plain[16:])
+        self.enc_last = int.from_bytes(ret[-16:],  'big')
+        return ret
+
+    def encrypt(self,  data,  offset=0):
+        """
+        Pad, timestamp and encrypt -data-
+        
+        parameters
+            data
+                the message as str or bytes
+            offset
+                the time offset of the receiver in seconds
+        """
+        with self.lock:
+            return self.encrypt_block(self.plain(data,  offset))
+
+    def encrypt_many(self,  datas,  offset=0):
+        """
+        Pad, timestamp and encrypt a sequence of messages in one call
+        
+        returns a list with the encrypted messages in the same order
+        """
+        with self.lock:
+            plains = [self.plain(data,  offset) for data in datas]
+            return [self.encrypt_block(plain) for plain in plains]
+
+    def decrypt(self,  data):
+        """
+        Decrypt -data- as if it was the start of a CBC chain
+        """
+        if len(data) % 16 != 0:
+            raise Exception('Data length not a multiple of 16')
+        if len(data) == 0:
+            return b''
+        with self.lock:
+            ret = self.dec.decrypt(data)
+            first = (int.from_bytes(ret[:16],  'big') ^ self.dec_last).to_bytes(16,  'big')
+            self.dec_last = int.from_bytes(data[-16:],  'big')
+        return first + ret[16:]
@@ -3,9 +3,51 @@
 # (c 2018 van Ovost Automatisering b.v.
 # Author : Jacq. van Ovost
 # ----------------------------
-import datetime
-import random
-from Crypto.Cipher import AES
+import time
+import calendar
+import binascii
+import collections
+from dc09_spt.msg.dc03_msg import dc03_msg
+from dc09_spt.msg.dc05_msg import dc05_msg
+from dc09_spt.msg.dc09_crc import dc09_crc
+from dc09_spt.msg.dc09_crypt import dc09_crypt
+from dc09_spt import trace
+
+dc09_answer = collections.namedtuple('dc09_answer',  ['answer',  'offset',  'msg_nr'])
+
+_answers = {b'ACK': 'ACK',  b'NAK': 'NAK',  b'DUH': 'DUH',  b'RSP': 'RSP'}
+
+_days = {}
+
+def _timestamp(tm):
+    """
+    Convert a receiver timestamp b'HH:MM:SS,MM-DD-YYYY' to seconds since the epoch (UTC)
+    the date part is only converted once per day
+    an impossible date or time raises ValueError, as datetime.strptime did
+    """
+    day = _days.get(tm[9:19])
+    if day == None:
+        date = bytes(tm[9:19])
+        if len(date) != 10 or date[2:3] != b'-' or date[5:6] != b'-' or not (date[0:2] + date[3:5] + date[6:10]).isdigit():
+            raise ValueError('invalid answer timestamp')
+        month = int(date[0:2])
+        mday = int(date[3:5])
+        year = int(date[6:10])
+        if year < 1 or not 1 <= month <= 12 or not 1 <= mday <= calendar.monthrange(year,  month)[1]:
+            raise ValueError('invalid answer timestamp')
+        day = calendar.timegm((year,  month,  mday,  0,  0,  0))
+        if len(_days) > 16:
+            _days.clear()
+        _days[date] = day
+    clock = bytes(tm[0:9])
+    if len(tm) != 19 or clock[2:3] != b':' or clock[5:6] != b':' or clock[8:9] != b',' or not (clock[0:2] + clock[3:5] + clock[6:8]).isdigit():
+        raise ValueError('invalid answer timestamp')
+    hour = int(clock[0:2])
+    minute = int(clock[3:5])
+    second = int(clock[6:8])
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError('invalid answer timestamp')
+    return day + hour * 3600 + minute * 60 + second
 
 class dc09_msg:
     """
@@ -37,7 +79,7 @@ class dc09_msg:
     See the License for the specific language governing permissions and
     limitations under the License.
     """ 
-    def __init__(self, account,  key=None,  receiver=None,  line=None, offset=0 ):
+    def __init__(self, account,  key=None,  receiver=None,  line=None, offset=0,  crypt=None ):
         """
         dc09_msg class initialisator
        
@@ -53,6 +95,9 @@ class dc09_msg:
                 an optional integer to be used as line number in the block header
             offset
                 the time offset for this receiver in seconds
+            crypt
+                an optional dc09_crypt encryption context for the key to (re)use,
+                e.g. the one kept by the transmission path
         """
         self.account = account
         self.key = key
@@ -61,52 +106,31 @@ class dc09_msg:
         self.offset=offset
         if self.key != None and len(self.key) != 16 and len(self.key) != 32:
             raise Exception('Keylength is {} but must be either 16 or 32'.format(len(key)))
+        if crypt == None and self.key != None:
+            crypt = dc09_crypt(self.key)
+        self.crypt = crypt
     
     @staticmethod
     def dc09crc(data):
         """
         Static method to calculate CRC16 According to SIA DC07
+
+        data can be a str, bytes, bytearray or memoryview.
+        for incremental calculation use the dc09_crc class
         """
-        def calc_crc(crc, debyte):
-            deze = ord(debyte)
-            for i in range(0, 8):
-                deze ^= crc & 1
-                crc >>= 1
-                if deze & 1:
-                    crc ^= 0xa001
-                deze >>= 1
-            return crc
-        crc = 0
-        for j in range(0, len(data)):
-            crc = calc_crc(crc, data[j])
-        return crc
+        return dc09_crc.calc(data)
         
     def dc09crypt(self,  data):
         """
         Encrypt -data- with -key- in AES CBC mode
         """
-        crypt = ''
-        pad = (len(data) + 21) % 16
-        for i in range (0, 17-pad):
-            rnd = '['
-            while rnd == '[' or rnd == ']' or rnd == '|':
-                rnd = chr(random.randint(20, 125))
-            crypt += rnd
-        now = datetime.datetime.utcnow()+datetime.timedelta(seconds=self.offset)
-        crypt += data + '_{:%H:%M:%S,%m-%d-%Y}'.format(now)
-        iv = 16 * chr(0)
-        encryption_suite = AES.new(self.key , AES.MODE_CBC, iv )
-        return encryption_suite.encrypt(crypt)
+        return self.crypt.encrypt(data,  self.offset)
 
     def dc09decrypt(self,  data):
         """
         Decrypt -data- with -key- in AES CBC mode
         """
-        if len(data) % 16 != 0:
-            raise Exception('Data length not a multiple of 16')
-        iv = 16 * chr(0)
-        encryption_suite = AES.new(self.key , AES.MODE_CBC, iv )
-        return encryption_suite.decrypt(data)
+        return self.crypt.decrypt(data)
 
     def dc09block(self,  msg_nr=0,  dc09type="NULL",  msg="]"):   
         """
@@ -128,6 +152,8 @@ class dc09_msg:
                 
                 the payload may be extended with the extra data constructed with dc09_extra
         """
+        if trace.hooks:
+            trace.begin('dc09block',  msg_nr,  type=dc09type)
         if self.key==None:
             ret = '"' + dc09type + '"'
         else :
@@ -143,10 +169,122 @@ class dc09_msg:
         else:
             if type != "NULL":
                 msg = '|' + msg
+            if trace.hooks:
+                trace.begin('encrypt',  msg_nr)
             ret += self.dc09crypt( msg).hex().upper()
+            if trace.hooks:
+                trace.end('encrypt',  msg_nr)
         ret = '\n' + '{0:04X}'.format(self.dc09crc(ret)) + '{0:04X}'.format(len(ret)) + ret + '\r'
+        if trace.hooks:
+            trace.end('dc09block',  msg_nr)
         return ret
 
+    def dc09blocks(self,  messages,  buffer=None):
+        """
+        Construct a number of DC09 message blocks as bytes in one buffer
+        
+        The result is the same as dc09block for each message, but the blocks are
+        written directly into the buffer without intermediate strings.
+        
+        Parameters:
+            messages
+                a sequence of (msg_nr, dc09type, msg) tuples, see dc09block
+            buffer
+                an optional bytearray to reuse, it is overwritten from the start
+                and cut off after the last block, so it holds exactly the blocks;
+                memoryviews of an earlier call must be released before it is reused
+        Return values
+            [0]
+                the buffer
+            [1]
+                a list of (msg_nr, offset, length) for each block in the buffer,
+                memoryview(buffer)[offset:offset+length] gives a block without copying
+        """
+        if buffer == None:
+            buffer = bytearray()
+        if self.key==None:
+            head = b'"'
+            datas = [msg.encode() for nr,  dc09type,  msg in messages]
+        else:
+            head = b'"*'
+            datas = [binascii.hexlify(ct).upper() for ct in self.crypt.encrypt_many(['|' + msg for nr,  dc09type,  msg in messages],  self.offset)]
+        tail = ''
+        if self.receiver != None:
+            tail += 'R{0:X}'.format(self.receiver)
+        if self.line != None:
+            tail += 'L{0:X}'.format(self.line)
+        tail = (tail + '#' + self.account + '[').encode()
+        blocks = []
+        pos = 0
+        for (nr,  dc09type,  msg),  data in zip(messages,  datas):
+            body = b'%s%s"%04X%s%s' % (head,  dc09type.encode(),  nr,  tail,  data)
+            offset = pos
+            for part in (b'\n%04X%04X' % (dc09_crc.calc(body),  len(body)),  body,  b'\r'):
+                buffer[pos:pos + len(part)] = part
+                pos += len(part)
+            blocks.append((nr,  offset,  pos - offset))
+        del buffer[pos:]
+        return buffer,  blocks
+
+    def dc09batch(self,  events,  msg_nr=1,  buffer=None):
+        """
+        Construct DC09 message blocks for a sequence of events in one buffer
+        
+        Parameters:
+            events
+                a sequence of maps as used with send_msg, with the extra key 'type'
+                ('SIA-DCS' (default) or 'ADM-CID') and optionally 'msg_nr'
+            msg_nr
+                the message number of the first event without 'msg_nr',
+                the following events are numbered from there
+            buffer
+                an optional bytearray to reuse, see dc09blocks
+        Return values
+            see dc09blocks
+        """
+        messages = []
+        for event in events:
+            nr = event.get('msg_nr',  msg_nr)
+            dc09type,  msg = dc09_msg.dc09payload(self.account,  event.get('type',  'SIA-DCS'),  event)
+            messages.append((nr,  dc09type,  msg))
+            msg_nr = nr + 1
+            if msg_nr > 9999:
+                msg_nr = 1
+        return self.dc09blocks(messages,  buffer)
+
+    @staticmethod
+    def dc09payload(account,  type,  params):
+        """
+        Static method to build the payload of a message
+        
+        Parameters:
+            account
+                the account to use when not in params
+            type
+                'SIA' or 'SIA-DCS' for a SIA-DC03 payload,
+                'CID' or 'ADM-CID' for a SIA-DC05 payload
+            params
+                a map with the content, see dc03event and dc05event,
+                extended with the extra data of dc09_extra
+        Return values
+            [0]
+                the DC09 type
+            [1]
+                the payload
+        """
+        if type == 'SIA' or type == 'SIA-DCS':
+            msg = dc03_msg.dc03event(account,  params)
+            dc09type = 'SIA-DCS'
+        elif type == 'CID' or type == 'ADM-CID':
+            msg = dc05_msg.dc05event(account,  params)
+            dc09type = 'ADM-CID'
+        else:
+            raise Exception('Unknown message type ' + str(type))
+        extra = dc09_msg.dc09_extra(params)
+        if extra != None:
+            msg = msg + extra
+        return dc09type,  msg
+
     def dc09poll(self):
         """
         Construct a DC09 poll block
@@ -163,51 +301,113 @@ class dc09_msg:
         """
         Check the validity of the answer block
         
+        The answer is parsed directly from the received bytes, without decoding it to a string.
+        
         Parameters:
             msg_nr  
                 the expected message number
             answer
-                the received answer block
+                the received answer block as bytes, bytearray, memoryview or str
         Return values
-            [0]
+            a dc09_answer, of which
+            [0] or answer
                 the answer ('ACK', 'NAK', 'DUH' or RSP')
-            [1]
+            [1] or offset
                 the calculated time offset for this receiver in seconds
+            [2] or msg_nr
+                the message number in the answer
         """
-        alen = len(answer)
-        if alen < 10:
-            raise Exception("Answer too short")
-        length = int(answer[5:9], 16)
-        if length != alen - 10:
-            raise Exception("Answer length ({0}) not equals content of message {1}".format(alen, length))
-        crc = self.dc09crc(answer[9:-1])
-        i = int(answer[1:5], 16)
-        if crc != i:
-            raise Exception("CRC of Answer incorrect")
-        if answer[10] == '*':
-            mnr = int(answer[15:19], 16)
-            ret = answer[11:14]
-        else:
-            mnr = int(answer[14:18], 16)
-            ret = answer[10:13]
-        if mnr != msg_nr and ret != 'NAK':
-            raise Exception("Invalid message number")
-        offset=None
-        if answer[10] == '*':
-            bracket = answer.find('[')
-            ct = bytes.fromhex(answer[bracket+1:alen-1])
-            answer = self.dc09decrypt(ct)
-            answer = answer[-21:].decode()
-        tm = None
-        if len(answer) > 22 and answer[-22:-20] == ']_':
-            tm = answer[-20:-1]
-        if len(answer) > 20 and answer[-21:-19] == ']_':
-            tm = answer[-19:]
-        if tm != None:
-            now = datetime.datetime.utcnow()
-            receivertime = datetime.datetime.strptime(tm, "%H:%M:%S,%m-%d-%Y")
-            offset = (receivertime-now).total_seconds()
-        return ret, offset
+        if trace.hooks:
+            trace.begin('dc09answer',  msg_nr)
+        try:
+            if isinstance(answer,  str):
+                answer = answer.encode('latin-1')
+            mv = memoryview(answer)
+            alen = len(mv)
+            if alen < 10:
+                raise Exception("Answer too short")
+            length = int(mv[5:9].tobytes(), 16)
+            if length != alen - 10:
+                raise Exception("Answer length ({0}) not equals content of message {1}".format(alen, length))
+            crc = dc09_crc.calc(mv[9:-1])
+            i = int(mv[1:5].tobytes(), 16)
+            if crc != i:
+                raise Exception("CRC of Answer incorrect")
+            encrypted = mv[10] == 0x2a
+            if encrypted:
+                mnr = int(mv[15:19].tobytes(), 16)
+                ret = mv[11:14].tobytes()
+            else:
+                mnr = int(mv[14:18].tobytes(), 16)
+                ret = mv[10:13].tobytes()
+            ret = _answers.get(ret) or ret.decode('latin-1')
+            if mnr != msg_nr and ret != 'NAK':
+                raise Exception("Invalid message number")
+            offset=None
+            tm = None
+            if encrypted:
+                bracket = 19
+                while bracket < alen and mv[bracket] != 0x5b:
+                    bracket += 1
+                plain = self.dc09decrypt(binascii.unhexlify(mv[bracket+1:alen-1]))
+                if len(plain) > 20 and plain[-21] == 0x5d and plain[-20] == 0x5f:
+                    tm = plain[-19:]
+            elif alen > 22 and mv[-22] == 0x5d and mv[-21] == 0x5f:
+                tm = mv[-20:-1].tobytes()
+            if tm != None:
+                offset = _timestamp(tm) - time.time()
+        except Exception as e:
+            if trace.hooks:
+                trace.end('dc09answer',  msg_nr,  error=str(e))
+            raise
+        if trace.hooks:
+            trace.end('dc09answer',  msg_nr,  answer=ret)
+        return dc09_answer(ret,  offset,  mnr)
+
+    @staticmethod
+    def dc09answer_nr(answer):
+        """
+        Return the message number of an answer block, without checking the block
+        """
+        if isinstance(answer,  str):
+            return dc09_msg.dc09answer_nr(answer.encode('latin-1'))
+        if answer[10] == 0x2a:
+            return int(bytes(answer[15:19]), 16)
+        return int(bytes(answer[14:18]), 16)
+
+    @staticmethod
+    def dc09split(data):
+        """
+        Split a stream of received bytes in complete blocks
+        
+        Parameters:
+            data
+                the bytes received so far
+        Return values
+            [0]
+                list with the complete blocks found
+            [1]
+                the remaining bytes of an incomplete block
+        """
+        blocks = []
+        pos = 0
+        while True:
+            start = data.find(b'\n',  pos)
+            if start < 0:
+                return blocks,  b''
+            if len(data) - start < 9:
+                return blocks,  data[start:]
+            try:
+                length = int(data[start+5:start+9],  16)
+            except ValueError:
+                # not a block header, look for the next one
+                pos = start + 1
+                continue
+            end = start + length + 10
+            if end > len(data):
+                return blocks,  data[start:]
+            blocks.append(data[start:end])
+            pos = end
 
     @staticmethod
     def dc09_extra(params={}):   
@@ -236,4 +436,7 @@ class dc09_msg:
             extra += '[M' + params['mac'] + ']'
         if 'verification' in params:
             extra += '[V' + params['verification'] + ']'
+        if len(extra):
+            return extra
+        return None
 
@@ -0,0 +1,392 @@
+# ----------------------------
+# Receiver simulator class
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import asyncio
+import binascii
+import random
+import threading
+import time
+import logging
+from dc09_spt.msg.dc09_msg import dc09_msg,  _timestamp
+from dc09_spt.msg.dc09_crc import dc09_crc
+from dc09_spt.msg.dc09_crypt import dc09_crypt
+
+class dc09_receiver:
+    """
+    Local SIA DC09 receiver to test diallers against
+
+    The receiver listens on TCP and/or UDP on an asyncio event loop and answers each block:
+        ACK     the block is correct (for encrypted blocks the answer is encrypted as well)
+        NAK     the timestamp of an encrypted block is outside the window of the receiver,
+                or a NAK is simulated (nak_rate)
+        DUH     the block could not be handled (unknown key, decryption failed, bad format)
+    Blocks with an incorrect length or CRC are not answered.
+
+    To simulate the network and a real receiver, answers can be delayed (latency, jitter),
+    blocks can be dropped (loss) and the clock of the receiver can deviate (skew).
+
+    The counters of the receiver are available with stats().
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+
+    def __init__(self,  keys=None,  *,  latency=0.0,  jitter=0.0,  loss=0.0,  nak_rate=0.0,  skew=0,  window=(40,  20),  seed=None,  handler=None):
+        """
+        Define a receiver
+
+        parameters
+            keys
+                an encryption key (16 or 32 bytes) used for all accounts,
+                or a map of account to key
+            latency
+                delay in seconds before an answer is sent
+            jitter
+                maximum random delay in seconds added to latency
+            loss
+                probability (0.0 - 1.0) that a received block is dropped without answer
+            nak_rate
+                probability (0.0 - 1.0) that a correct block is answered with a NAK
+            skew
+                deviation in seconds of the clock of the receiver
+            window
+                (before, after) the number of seconds the timestamp of an encrypted block
+                may be before or after the time of the receiver
+            seed
+                seed for the random generator, to repeat a test with the same losses and NAK's
+            handler
+                optional function called as handler(account, dc09type, msg_nr, msg) for each
+                accepted block that is not a poll, msg is the payload as bytes.
+                When it returns 'DUH' or 'NAK' the block is refused with that answer
+        """
+        if isinstance(keys,  (bytes,  bytearray)):
+            self.key = dc09_crypt(bytes(keys))
+            self.keys = {}
+        else:
+            self.key = None
+            self.keys = {account:  dc09_crypt(key) for account,  key in (keys or {}).items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.nak_rate = nak_rate
+        self.skew = skew
+        self.window = window
+        self.random = random.Random(seed)
+        self.handler = handler
+        self.counters = {'blocks': 0,  'polls': 0,  'events': 0,  'ACK': 0,  'NAK': 0,  'DUH': 0,  'lost': 0,  'errors': 0}
+        self.servers = []
+        self.clients = {}
+        self.loop = None
+        self.thread = None
+        self.stamp_sec = None
+        self.stamp = None
+
+    def stats(self):
+        """
+        Return a copy of the counters of the receiver
+        """
+        return dict(self.counters)
+
+    def timestamp(self):
+        """
+        Return the timestamp of the receiver as b'_HH:MM:SS,MM-DD-YYYY'
+        """
+        sec = int(time.time() + self.skew)
+        if sec != self.stamp_sec:
+            tm = time.gmtime(sec)
+            self.stamp = b'_%02d:%02d:%02d,%02d-%02d-%04d' % (tm.tm_hour,  tm.tm_min,  tm.tm_sec,  tm.tm_mon,  tm.tm_mday,  tm.tm_year)
+            self.stamp_sec = sec
+        return self.stamp
+
+    @staticmethod
+    def frame(body):
+        """
+        Pack the content of an answer in a block
+        """
+        return b'\n%04X%04X%s\r' % (dc09_crc.calc(body),  len(body),  body)
+
+    def answer(self,  answer,  msg_nr=0,  header=b'',  account=b'',  crypt=None):
+        """
+        Build an answer block
+
+        parameters
+            answer
+                b'ACK', b'NAK' or b'DUH'
+            msg_nr
+                the message number to answer, a NAK always gets 0
+            header
+                the receiver and line part of the received block, returned as is
+            account
+                the account of the received block
+            crypt
+                the dc09_crypt of the account to encrypt the answer with
+        """
+        self.counters[answer.decode()] += 1
+        if answer == b'NAK':
+            msg_nr = 0
+        if crypt == None:
+            body = b'"%s"%04X%s#%s[]%s' % (answer,  msg_nr,  header,  account,  self.timestamp())
+        else:
+            data = binascii.hexlify(crypt.encrypt(b'|]',  self.skew)).upper()
+            body = b'"*%s"%04X%s#%s[%s' % (answer,  msg_nr,  header,  account,  data)
+        return self.frame(body)
+
+    def handle(self,  block):
+        """
+        Check a received block and return the answer block, or None when no answer is sent
+        """
+        self.counters['blocks'] += 1
+        if self.loss and self.random.random() < self.loss:
+            self.counters['lost'] += 1
+            return None
+        block = bytes(block)
+        try:
+            if len(block) < 10 or block[0] != 0x0a or block[-1] != 0x0d:
+                raise ValueError('no block')
+            if int(block[5:9],  16) != len(block) - 10 or int(block[1:5],  16) != dc09_crc.calc(block[9:-1]):
+                raise ValueError('length or CRC incorrect')
+        except ValueError as e:
+            self.counters['errors'] += 1
+            logging.debug('Receiver dropped block %s : %s',  block,  e)
+            return None
+        body = block[9:-1]
+        quote = body.find(b'"',  1)
+        bracket = body.find(b'[',  quote)
+        hash = body.rfind(b'#',  quote,  bracket)
+        if body[:1] != b'"' or quote < 0 or bracket < 0 or hash < 0:
+            return self.answer(b'DUH')
+        dc09type = body[1:quote]
+        header = body[quote + 5:hash]
+        account = body[hash + 1:bracket]
+        try:
+            msg_nr = int(body[quote + 1:quote + 5],  16)
+        except ValueError:
+            return self.answer(b'DUH',  0,  header,  account)
+        crypt = None
+        msg = body[bracket + 1:]
+        if dc09type[:1] == b'*':
+            dc09type = dc09type[1:]
+            crypt = self.keys.get(account.decode('latin-1'),  self.key)
+            if crypt == None:
+                return self.answer(b'DUH',  msg_nr,  header,  account)
+            try:
+                plain = crypt.decrypt(binascii.unhexlify(msg))
+                bar = plain.index(b'|')
+                sent = _timestamp(plain[-19:])
+            except Exception:
+                return self.answer(b'DUH',  msg_nr,  header,  account)
+            diff = sent - (time.time() + self.skew)
+            if diff < -self.window[0] or diff > self.window[1]:
+                return self.answer(b'NAK',  msg_nr,  header,  account)
+            msg = plain[bar + 1:-20]
+        if self.nak_rate and self.random.random() < self.nak_rate:
+            return self.answer(b'NAK',  msg_nr,  header,  account)
+        if dc09type == b'NULL':
+            self.counters['polls'] += 1
+        else:
+            if self.handler != None:
+                try:
+                    refuse = self.handler(account.decode('latin-1'),  dc09type.decode('latin-1'),  msg_nr,  msg)
+                except Exception as e:
+                    refuse = None
+                    logging.error('Receiver handler exception %s',  e)
+                if refuse in ('DUH',  'NAK'):
+                    return self.answer(refuse.encode(),  msg_nr,  header,  account)
+            self.counters['events'] += 1
+        return self.answer(b'ACK',  msg_nr,  header,  account,  crypt)
+
+    def delay(self):
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.uniform(0,  self.jitter)
+        return delay
+
+    def reply(self,  send,  *args):
+        """
+        Send an answer now or after the simulated latency
+        """
+        delay = self.delay()
+        if delay > 0:
+            self.loop.call_later(delay,  send,  *args)
+        else:
+            send(*args)
+
+    async def tcp_client(self,  reader,  writer):
+        buf = b''
+        task = asyncio.current_task()
+        self.clients[task] = writer
+        try:
+            while True:
+                data = await reader.read(4096)
+                if len(data) == 0:
+                    break
+                blocks,  buf = dc09_msg.dc09split(buf + data)
+                for block in blocks:
+                    antw = self.handle(block)
+                    if antw != None:
+                        self.reply(self.tcp_send,  writer,  antw)
+        except Exception as e:
+            logging.debug('Receiver TCP connection exception %s',  e)
+        finally:
+            self.clients.pop(task,  None)
+            writer.close()
+
+    @staticmethod
+    def tcp_send(writer,  antw):
+        if not writer.is_closing():
+            writer.write(antw)
+
+    async def start_tcp(self,  host='127.0.0.1',  port=0):
+        """
+        Listen for TCP connections, returns the port number used
+        """
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.tcp_client,  host,  port)
+        self.servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    async def start_udp(self,  host='127.0.0.1',  port=0):
+        """
+        Listen for UDP datagrams, returns the port number used
+        """
+        self.loop = asyncio.get_running_loop()
+        transport,  protocol = await self.loop.create_datagram_endpoint(lambda: _receiver_udp(self),  local_addr=(host,  port))
+        self.servers.append(transport)
+        return transport.get_extra_info('sockname')[1]
+
+    async def close(self):
+        """
+        Stop listening and close the open connections
+        """
+        for server in self.servers:
+            server.close()
+        clients = list(self.clients)
+        for writer in self.clients.values():
+            writer.close()
+        await asyncio.gather(*clients,  return_exceptions=True)
+        for server in self.servers:
+            if isinstance(server,  asyncio.AbstractServer):
+                await server.wait_closed()
+        self.servers = []
+
+    def start_thread(self,  host='127.0.0.1',  tcp_port=0,  udp_port=0):
+        """
+        Run the receiver on its own event loop in a background thread,
+        for use with the threaded dialler
+
+        parameters
+            host
+                address to listen on
+            tcp_port
+                TCP port, 0 for any free port, None for no TCP
+            udp_port
+                UDP port, 0 for any free port, None for no UDP
+        returns (tcp port, udp port)
+        """
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        ports = [None,  None]
+
+        async def listen():
+            if tcp_port != None:
+                ports[0] = await self.start_tcp(host,  tcp_port)
+            if udp_port != None:
+                ports[1] = await self.start_udp(host,  udp_port)
+
+        def run():
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(listen())
+            finally:
+                started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.close())
+            loop.close()
+
+        self.thread = threading.Thread(target=run,  name='dc09 receiver',  daemon=True)
+        self.thread.start()
+        started.wait()
+        return tuple(ports)
+
+    def stop_thread(self):
+        """
+        Stop a receiver started with start_thread
+        """
+        if self.thread != None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
+
+class _receiver_udp(asyncio.DatagramProtocol):
+    def __init__(self,  receiver):
+        self.receiver = receiver
+        self.transport = None
+
+    def connection_made(self,  transport):
+        self.transport = transport
+
+    def datagram_received(self,  data,  addr):
+        antw = self.receiver.handle(data)
+        if antw != None:
+            self.receiver.reply(self.transport.sendto,  antw,  addr)
+
+def main(args=None):
+    """
+    Run a receiver from the command line
+
+    run with : python -m dc09_spt.receiver --tcp 12128 --udp 12128 --key 0123=<hex key>
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Local SIA DC09 receiver for testing diallers')
+    parser.add_argument('--host',  default='127.0.0.1')
+    parser.add_argument('--tcp',  type=int,  default=None,  help='TCP port to listen on')
+    parser.add_argument('--udp',  type=int,  default=None,  help='UDP port to listen on')
+    parser.add_argument('--key',  action='append',  default=[],  help='hex key for all accounts, or account=hex key')
+    parser.add_argument('--latency',  type=float,  default=0.0)
+    parser.add_argument('--jitter',  type=float,  default=0.0)
+    parser.add_argument('--loss',  type=float,  default=0.0)
+    parser.add_argument('--nak-rate',  type=float,  default=0.0)
+    parser.add_argument('--skew',  type=int,  default=0)
+    parser.add_argument('--seed',  type=int,  default=None)
+    parser.add_argument('--stats',  type=float,  default=10.0,  help='interval in seconds to log the counters')
+    opts = parser.parse_args(args)
+    keys = {}
+    for key in opts.key:
+        if '=' in key:
+            account,  key = key.split('=',  1)
+            keys[account] = bytes.fromhex(key)
+        else:
+            keys = bytes.fromhex(key)
+    rcv = dc09_receiver(keys,  latency=opts.latency,  jitter=opts.jitter,  loss=opts.loss,
+        nak_rate=opts.nak_rate,  skew=opts.skew,  seed=opts.seed)
+
+    async def run():
+        if opts.tcp != None:
+            logging.info('Receiver listening on TCP port %s',  await rcv.start_tcp(opts.host,  opts.tcp))
+        if opts.udp != None:
+            logging.info('Receiver listening on UDP port %s',  await rcv.start_udp(opts.host,  opts.udp))
+        while True:
+            await asyncio.sleep(opts.stats)
+            logging.info('Receiver %s',  rcv.stats())
+
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s',  level=logging.INFO)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+# ----------------------------
+# Timer scheduler class
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import random
+import threading
+import time
+import logging
+import zlib
+
+class timer:
+    """
+    Handle of a scheduled callback, used to cancel it
+    """
+    __slots__ = ('when',  'callback',  'args',  'cancelled')
+
+    def __init__(self,  when,  callback,  args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+class timer_scheduler(threading.Thread):
+    """
+    Run callbacks at their deadline from a single thread
+
+    The timers are kept in a heap, so scheduling costs O(log n) and cancelling O(1).
+    Cancelled timers stay in the heap until they reach the top or the heap is compacted.
+    The thread sleeps until the next deadline or until an earlier timer is scheduled.
+
+    Callbacks run on the scheduler thread and should only do short work,
+    like handing the actual transfer to one of the workers with submit.
+
+    One scheduler is shared by all diallers in the process, see shared().
+    The deadlines are in time.monotonic(), so they do not move with the wall clock.
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+    instance = None
+    instance_lock = threading.Lock()
+    workers = 16
+
+    def __init__(self):
+        threading.Thread.__init__(self,  name='dc09 scheduler',  daemon=True)
+        self.heap = []
+        self.cancelled = 0
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.executor = None
+
+    @staticmethod
+    def shared():
+        """
+        Return the scheduler of this process, start it when needed
+        """
+        with timer_scheduler.instance_lock:
+            if timer_scheduler.instance == None:
+                timer_scheduler.instance = timer_scheduler()
+                timer_scheduler.instance.start()
+            return timer_scheduler.instance
+
+    def schedule(self,  when,  callback,  *args):
+        """
+        Call callback(*args) at time -when- (as time.monotonic())
+
+        returns a timer to use with cancel
+        """
+        tmr = timer(when,  callback,  args)
+        with self.cond:
+            heapq.heappush(self.heap,  (when,  next(self.seq),  tmr))
+            if self.heap[0][2] is tmr:
+                self.cond.notify()
+        return tmr
+
+    def cancel(self,  tmr):
+        """
+        Cancel a scheduled timer, a timer that already fired is ignored
+        """
+        if tmr != None and not tmr.cancelled:
+            with self.cond:
+                tmr.cancelled = True
+                self.cancelled += 1
+                if self.cancelled > 64 and self.cancelled > len(self.heap) // 2:
+                    self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+                    heapq.heapify(self.heap)
+                    self.cancelled = 0
+
+    def pending(self):
+        return len(self.heap) - self.cancelled
+
+    def submit(self,  work,  *args):
+        """
+        Run work(*args) on one of the shared worker threads, at most -workers- run at once
+
+        returns False when the process is ending and the work was not started
+        """
+        with self.cond:
+            if self.executor == None:
+                self.executor = ThreadPoolExecutor(self.workers,  thread_name_prefix='dc09 worker')
+        try:
+            self.executor.submit(work,  *args)
+        except RuntimeError:
+            return False
+        return True
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    while len(self.heap) and self.heap[0][2].cancelled:
+                        heapq.heappop(self.heap)
+                        self.cancelled -= 1
+                    if len(self.heap) == 0:
+                        self.cond.wait()
+                        continue
+                    delay = self.heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self.cond.wait(delay)
+                tmr = heapq.heappop(self.heap)[2]
+                # a fired timer can no longer be cancelled
+                tmr.cancelled = True
+            try:
+                tmr.callback(*tmr.args)
+            except Exception as e:
+                logging.error('Timer callback %s exception %s',  tmr.callback,  e)
+
+class schedule_spread:
+    """
+    Spread the polls and routine reports of many diallers over time
+
+    Without it every dialler started at the same moment, or recovering from the same
+    network failure, polls at the same instant and keeps doing so every interval.
+    With -phase- each poll or routine gets a fixed slot within its interval,
+    derived from the account: the deadlines are on a grid of the interval shifted by that slot,
+    so diallers with different accounts are spread evenly and a dialler returns to its own
+    slot after every poll. The slot is computed with crc32, so it is the same in every process.
+
+    With -jitter- a random part of the interval, at most -max_jitter- seconds,
+    is taken off every deadline. Deadlines only move earlier, so a path is never supervised
+    later than its interval (EN 50136). Retries after a failed poll are spread by -jitter-
+    both ways, so diallers that failed together do not retry together.
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+    """
+    def __init__(self,  key,  phase=True,  jitter=0.1,  max_jitter=30.0,  seed=None):
+        """
+        parameters
+            key
+                value the slots are derived from, normally the account
+            phase
+                True to give every poll and routine a slot within its interval
+            jitter
+                part of the interval taken off a deadline at random, 0 for none
+            max_jitter
+                seconds taken off a deadline at most
+            seed
+                seed for the random generator, to repeat a test with the same jitter
+        """
+        self.key = str(key)
+        self.phase = phase
+        self.jitter = jitter
+        self.max_jitter = max_jitter
+        self.random = random.Random(seed)
+
+    def offset(self,  name,  interval):
+        """
+        Return the slot of -name- ('main', 'back-up', a routine) in [0, interval)
+        """
+        if not self.phase or not interval:
+            return 0.0
+        return zlib.crc32((self.key + ' ' + name).encode()) / 4294967296.0 * interval
+
+    def bound(self,  interval):
+        """
+        Return the most seconds a deadline of -interval- may be taken earlier
+        """
+        if not self.jitter or not interval:
+            return 0.0
+        return min(self.jitter * interval,  self.max_jitter,  interval / 2)
+
+    def early(self,  interval):
+        """
+        Return a random number of seconds to take a deadline of -interval- earlier
+        """
+        return self.random.uniform(0,  self.bound(interval))
+
+    def first(self,  now,  name,  interval):
+        """
+        Return the time of the first poll of -name-: its slot within the coming interval,
+        or without -phase- a random moment within the jitter
+        """
+        if not self.phase:
+            return now + self.early(interval)
+        period = interval - self.bound(interval)
+        return now + (self.offset(name,  period) - now) % period
+
+    def next(self,  now,  name,  interval):
+        """
+        Return the time of the next poll of -name- after one at -now-, at most -interval- later
+
+        The slots are -interval- minus the jitter apart, so a deadline taken early
+        followed by one that is not stays within -interval-.
+        """
+        bound = self.bound(interval)
+        early = self.early(interval)
+        if not self.phase:
+            return now + interval - early
+        period = interval - bound
+        # the poll at -now- served the slot at most -bound- after it
+        after = now + bound
+        slot = after + (self.offset(name,  period) - after) % period
+        if slot <= after:
+            slot += period
+        return max(now,  slot - early)
+
+    def routine_offset(self,  n,  routine,  interval):
+        """
+        Return the slot of routine -n-, within its 'spread' seconds after its 'start',
+        or within its interval when it has no start
+        """
+        if 'spread' in routine:
+            window = routine['spread']
+        elif 'start' in routine:
+            window = 0
+        else:
+            window = interval
+        return self.offset('routine ' + str(n),  min(window,  interval))
+
+    def routine_next(self,  slots,  n,  now,  interval):
+        """
+        Move the slot of routine -n- in -slots- one interval on, past -now-, and return its deadline
+        the deadline is taken earlier by the jitter, the slots are not so the routine does not drift
+        """
+        slot = slots[n] + interval
+        while slot <= now:
+            slot += interval
+        slots[n] = slot
+        return max(now,  slot - self.early(interval))
+
+    def retry(self,  now,  delay):
+        """
+        Return the time to retry after a failed poll, -delay- spread by -jitter- both ways
+        """
+        if not self.jitter:
+            return now + delay
+        return now + delay * self.random.uniform(1 - self.jitter,  1 + self.jitter)
@@ -0,0 +1,142 @@
+# ----------------------------
+# Tracing hooks
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+"""
+    Hooks to follow the stages of a transfer
+
+    The transfer code reports the begin and end of each stage to the registered hooks:
+        transfer_msg    a complete transfer of one message (id is the message number)
+        transfer_window a window of messages (id is the first message number)
+        dc09block       building a block, including encryption (id is the message number)
+        encrypt         encryption of the payload
+        connect         getting a connection to the receiver
+        dns             looking up the addresses of the receiver host (not when they are cached)
+        send            writing the block to the socket
+        receive         waiting for the answer of the receiver (for UDP including the send)
+        dc09answer      checking and decrypting the answer (id is the message number)
+        nak resync      sending the block again with the time of the receiver after a NAK
+
+    Timestamps are time.monotonic() seconds. The arguments are passed as a map, at the end of
+    transfer_msg it contains 'result', at the end of connect 'reused'.
+
+    When no hook is registered each stage only costs the test of the hooks list.
+
+    Copyright (c) 2018  van Ovost Automatisering b.v.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    you may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import logging
+
+hooks = []
+
+def add_hook(hook):
+    """
+    Register a hook, an object with begin(stage, id, ts, args) and end(stage, id, ts, args) methods
+    """
+    global hooks
+    hooks = hooks + [hook]
+
+def remove_hook(hook):
+    global hooks
+    hooks = [h for h in hooks if h is not hook]
+
+def begin(stage,  id=None,  **args):
+    ts = time.monotonic()
+    for hook in hooks:
+        try:
+            hook.begin(stage,  id,  ts,  args)
+        except Exception as e:
+            logging.error('Trace hook %s exception %s',  hook,  e)
+
+def end(stage,  id=None,  **args):
+    ts = time.monotonic()
+    for hook in hooks:
+        try:
+            hook.end(stage,  id,  ts,  args)
+        except Exception as e:
+            logging.error('Trace hook %s exception %s',  hook,  e)
+
+class trace_hook:
+    """
+    Base class of a hook, does nothing
+    """
+    def begin(self,  stage,  id,  ts,  args):
+        pass
+
+    def end(self,  stage,  id,  ts,  args):
+        pass
+
+class chrome_trace(trace_hook):
+    """
+    Write the stages to a file in the Chrome trace event format,
+    to be opened in chrome://tracing or https://ui.perfetto.dev
+
+    The events are written while tracing, as a JSON array that may be left open,
+    so the file can also be read when the process stopped without calling close.
+    Stages of asyncio tasks are shown per task, other stages per thread.
+
+    example
+        hook = chrome_trace('dc09.json')
+        trace.add_hook(hook)
+        ...
+        trace.remove_hook(hook)
+        hook.close()
+    """
+    def __init__(self,  filename):
+        self.file = open(filename,  'w')
+        self.file.write('[')
+        self.separator = '\n'
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    @staticmethod
+    def tid():
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task != None:
+            return id(task)
+        return threading.get_ident()
+
+    def write(self,  phase,  stage,  id,  ts,  args):
+        event = {'name': stage,  'ph': phase,  'ts': ts * 1e6,  'pid': self.pid,  'tid': self.tid()}
+        if id != None:
+            args = dict(args,  id=id)
+        if len(args):
+            event['args'] = args
+        data = json.dumps(event,  default=str)
+        with self.lock:
+            if self.file != None:
+                self.file.write(self.separator + data)
+                self.separator = ',\n'
+
+    def begin(self,  stage,  id,  ts,  args):
+        self.write('B',  stage,  id,  ts,  args)
+
+    def end(self,  stage,  id,  ts,  args):
+        self.write('E',  stage,  id,  ts,  args)
+
+    def close(self):
+        with self.lock:
+            if self.file != None:
+                self.file.write('\n]\n')
+                self.file.close()
+                self.file = None
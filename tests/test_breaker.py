@@ -0,0 +1,88 @@
+# ----------------------------
+# Tests of the circuit breaker of a transmission path
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import time
+import unittest
+from dc09_spt.comm.breaker import circuit_breaker
+from dc09_spt.dc09_spt import dc09_spt
+from dc09_spt.receiver import dc09_receiver
+
+class test_breaker(unittest.TestCase):
+    def test_open(self):
+        breaker = circuit_breaker(failures=3,  reset=0.05,  maximum=0.15)
+        breaker.record(0)
+        breaker.record(1)
+        # a success in between resets the count
+        breaker.record(0)
+        breaker.record(0)
+        self.assertEqual(breaker.state,  circuit_breaker.CLOSED)
+        breaker.record(0)
+        self.assertEqual(breaker.state,  circuit_breaker.OPEN)
+        self.assertFalse(breaker.usable())
+        self.assertEqual(breaker.snapshot(),  {'state': 'open',  'failed': 3,  'opened': 1})
+
+    def test_half_open(self):
+        breaker = circuit_breaker(failures=1,  reset=0.05,  maximum=0.15)
+        breaker.record(0)
+        time.sleep(0.06)
+        self.assertTrue(breaker.usable())
+        breaker.attempt()
+        self.assertEqual(breaker.state,  circuit_breaker.HALF_OPEN)
+        # only one trial at a time
+        self.assertFalse(breaker.usable())
+        breaker.record(0)
+        self.assertEqual(breaker.state,  circuit_breaker.OPEN)
+        self.assertEqual(breaker.open_time,  0.1)
+        breaker.until = 0
+        breaker.attempt()
+        breaker.record(0)
+        # the open time doubles up to the maximum
+        self.assertEqual(breaker.open_time,  0.15)
+        breaker.until = 0
+        breaker.attempt()
+        breaker.record(1)
+        self.assertEqual(breaker.state,  circuit_breaker.CLOSED)
+        self.assertEqual(breaker.open_time,  0.05)
+        self.assertEqual(breaker.opened,  1)
+
+    def test_usable(self):
+        spt = dc09_spt('1234')
+        spt.set_path('main',  'primary',  '127.0.0.1',  1,  breaker_failures=1)
+        spt.set_path('back-up',  'primary',  '127.0.0.1',  2,  breaker_failures=1)
+        spt.tpaths['main']['primary']['path'].breaker.record(0)
+        self.assertEqual(dc09_spt.usable_paths(spt.tpaths),  {('back-up',  'primary')})
+        # with every breaker open all paths are tried again
+        spt.tpaths['back-up']['primary']['path'].breaker.record(0)
+        self.assertEqual(dc09_spt.usable_paths(spt.tpaths),  {('main',  'primary'),  ('back-up',  'primary')})
+
+    def test_dialler(self):
+        main = dc09_receiver()
+        main_port,  udp = main.start_thread('127.0.0.1')
+        backup = dc09_receiver()
+        backup_port,  udp = backup.start_thread('127.0.0.1')
+        spt = dc09_spt('1234')
+        try:
+            spt.set_path('main',  'primary',  '127.0.0.1',  main_port,  breaker_failures=2,  breaker_reset=60.0)
+            spt.set_path('back-up',  'primary',  '127.0.0.1',  backup_port)
+            spt.tpaths['main']['primary']['path'].timeout = 0.3
+            main.loss = 1.0
+            for zone in range(4):
+                # keep the main path ranked first, so only the breaker keeps it out
+                spt.tpaths['main']['primary']['ok'] = 1
+                spt.send_msg('SIA-DCS',  {'code': 'BA',  'zone': zone})
+                deadline = time.monotonic() + 10
+                while (spt.notSent() or spt.send.running) and time.monotonic() < deadline:
+                    time.sleep(0.005)
+            self.assertEqual(spt.state()['main primary path breaker'],  'open')
+            # once open the main path is skipped, all events reach the back-up
+            self.assertEqual(main.stats()['lost'],  2)
+            self.assertEqual(backup.stats()['ACK'],  4)
+        finally:
+            spt.stop_send()
+            main.stop_thread()
+            backup.stop_thread()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# ----------------------------
+# Tests of the table driven CRC16
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import os
+import unittest
+from dc09_spt.msg.dc09_crc import dc09_crc
+
+def bitwise_crc(data):
+    """
+    The bitwise CRC16 of SIA DC07 the table replaces
+    """
+    crc = 0
+    for char in data:
+        deze = ord(char) if isinstance(char,  str) else char
+        for i in range(0, 8):
+            deze ^= crc & 1
+            crc >>= 1
+            if deze & 1:
+                crc ^= 0xa001
+            deze >>= 1
+    return crc
+
+class test_crc(unittest.TestCase):
+    def test_table(self):
+        for byte in range(256):
+            self.assertEqual(dc09_crc.table[byte],  bitwise_crc(bytes([byte])))
+
+    def test_blocks(self):
+        for data in (b'',  b'"NULL"0000R0L0#1234[]',  b'"SIA-DCS"0001L0#1234[#1234|NBA01]',  os.urandom(1000)):
+            self.assertEqual(dc09_crc.calc(data),  bitwise_crc(data))
+
+    def test_types(self):
+        data = '"SIA-DCS"0001L0#1234[#1234|NBA01]'
+        expected = bitwise_crc(data)
+        self.assertEqual(dc09_crc.calc(data),  expected)
+        self.assertEqual(dc09_crc.calc(bytearray(data.encode())),  expected)
+        self.assertEqual(dc09_crc.calc(memoryview(data.encode())),  expected)
+
+    def test_wide_characters(self):
+        # the bitwise version only used the lower 8 bits of each character
+        data = '#1234|Nri1/BA01^Café €^]'
+        self.assertEqual(dc09_crc.calc(data),  bitwise_crc(bytes(ord(c) & 0xff for c in data)))
+
+    def test_update(self):
+        data = os.urandom(300)
+        crc = dc09_crc()
+        for pos in range(0,  len(data),  7):
+            crc.update(data[pos:pos + 7])
+        self.assertEqual(crc.value(),  bitwise_crc(data))
+        self.assertEqual(dc09_crc(data[:100]).copy().update(data[100:]).value(),  bitwise_crc(data))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# ----------------------------
+# Tests of the reused AES CBC encryption context
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import os
+import re
+import unittest
+from Crypto.Cipher import AES
+from dc09_spt.msg.dc09_crypt import dc09_crypt
+
+# the timestamp may be of the next second, so only its form is checked
+stamp = re.compile(rb'_\d\d:\d\d:\d\d,\d\d-\d\d-\d{4}$')
+
+def fresh_encrypt(key,  plain):
+    return AES.new(key,  AES.MODE_CBC,  bytes(16)).encrypt(plain)
+
+def fresh_decrypt(key,  data):
+    return AES.new(key,  AES.MODE_CBC,  bytes(16)).decrypt(data)
+
+class test_crypt(unittest.TestCase):
+    def test_encrypt_block(self):
+        for key in (os.urandom(16),  os.urandom(32)):
+            crypt = dc09_crypt(key)
+            for length in (16,  32,  16,  64,  48):
+                plain = os.urandom(length)
+                self.assertEqual(crypt.encrypt_block(plain),  fresh_encrypt(key,  plain))
+
+    def test_encrypt(self):
+        key = os.urandom(16)
+        crypt = dc09_crypt(key)
+        for data in ('#1234|NBA01]',  b'#1234|NRP]',  '#1234|Nri1/BA01^a longer text to span several blocks^]'):
+            encrypted = crypt.encrypt(data,  offset=-3600)
+            self.assertEqual(len(encrypted) % 16,  0)
+            plain = fresh_decrypt(key,  encrypted)
+            if isinstance(data,  str):
+                data = data.encode()
+            self.assertEqual(plain[-20 - len(data):-20],  data)
+            self.assertRegex(plain,  stamp)
+            self.assertFalse(any(c in b'[]|' or c < 20 or c > 125 for c in plain[:-20 - len(data)]))
+
+    def test_encrypt_many(self):
+        key = os.urandom(32)
+        crypt = dc09_crypt(key)
+        datas = ['#1234|NBA%02d]' % n for n in range(10)]
+        for data,  encrypted in zip(datas,  crypt.encrypt_many(datas)):
+            plain = fresh_decrypt(key,  encrypted)
+            self.assertEqual(plain[-20 - len(data):-20],  data.encode())
+            self.assertRegex(plain,  stamp)
+
+    def test_decrypt(self):
+        key = os.urandom(16)
+        crypt = dc09_crypt(key)
+        for length in (16,  48,  32,  16):
+            plain = os.urandom(length)
+            self.assertEqual(crypt.decrypt(fresh_encrypt(key,  plain)),  plain)
+        self.assertEqual(crypt.decrypt(b''),  b'')
+        with self.assertRaises(Exception):
+            crypt.decrypt(b'x' * 15)
+
+if __name__ == '__main__':
+    unittest.main()
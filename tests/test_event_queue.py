@@ -0,0 +1,87 @@
+# ----------------------------
+# Tests of the priority event queue
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import time
+import unittest
+from dc09_spt.event_queue import event_queue,  event_priority,  ALARM,  TROUBLE,  NORMAL,  ROUTINE
+from dc09_spt.dc09_spt import dc09_spt
+
+def mess(nr,  priority):
+    return (nr,  'SIA-DCS',  '#1234|NBA]',  0.0,  None,  priority)
+
+class test_event_queue(unittest.TestCase):
+    def test_priority(self):
+        self.assertEqual(event_priority('BA'),  ALARM)
+        self.assertEqual(event_priority('YS'),  TROUBLE)
+        self.assertEqual(event_priority('RP'),  ROUTINE)
+        self.assertEqual(event_priority('OP'),  NORMAL)
+        self.assertEqual(event_priority(130),  ALARM)
+        self.assertEqual(event_priority('602'),  ROUTINE)
+        self.assertEqual(event_priority(None,  default=ROUTINE),  ROUTINE)
+        # the longest matching code wins
+        self.assertEqual(event_priority('BC',  {'B': 3,  'BC': 1}),  1)
+        self.assertEqual(event_priority('BA',  {'B': 3,  'BC': 1}),  3)
+
+    def test_order(self):
+        queue = event_queue()
+        for nr,  priority in ((1,  NORMAL),  (2,  ROUTINE),  (3,  ALARM),  (4,  NORMAL),  (5,  ALARM)):
+            queue.append(mess(nr,  priority))
+        self.assertEqual(queue[0][0],  3)
+        self.assertEqual(queue.counts(),  {ALARM: 2,  NORMAL: 2,  ROUTINE: 1})
+        first = queue.popleft()
+        queue.append(mess(6,  ALARM))
+        # a message put back goes in front of its priority
+        queue.appendleft(first)
+        self.assertEqual([queue.popleft()[0] for n in range(len(queue))],  [3,  5,  6,  1,  4,  2])
+        with self.assertRaises(IndexError):
+            queue.popleft()
+
+    def test_defer(self):
+        queue = event_queue()
+        refused = mess(1,  ALARM)
+        queue.append(refused)
+        queue.append(mess(2,  NORMAL))
+        until = time.monotonic() + 60
+        self.assertEqual(queue.defer(queue.popleft(),  until),  1)
+        # the deferred message is counted but waits, the others go on
+        self.assertEqual(len(queue),  2)
+        self.assertEqual(queue.ready(),  1)
+        self.assertEqual(queue.next_due(),  until)
+        self.assertEqual(queue.popleft()[0],  2)
+        self.assertEqual(queue.ready(),  0)
+        self.assertEqual(queue.counts(),  {ALARM: 1})
+
+    def test_promote(self):
+        queue = event_queue()
+        refused = mess(1,  NORMAL)
+        queue.defer(refused,  time.monotonic() - 1)
+        self.assertEqual(queue.defer(refused,  time.monotonic() - 1),  2)
+        queue.append(mess(2,  NORMAL))
+        queue.append(mess(3,  ALARM))
+        # due deferred messages return in front of their priority
+        self.assertEqual(queue.ready(),  4)
+        self.assertEqual([queue.popleft()[0] for n in range(4)],  [3,  1,  1,  2])
+        self.assertEqual(queue.tries(refused),  2)
+        queue.done(refused)
+        self.assertEqual(queue.tries(refused),  0)
+        self.assertEqual(queue.next_due(),  None)
+
+    def test_dialler(self):
+        spt = dc09_spt('1234')
+        spt.set_send_retry([60.0])
+        spt.set_dead_letter(attempts=2)
+        spt.queue.append(mess(1,  ALARM))
+        refused = spt.queue.popleft()
+        spt.reject(refused,  'DUH')
+        self.assertEqual(spt.queue.ready(),  0)
+        self.assertEqual(spt.state()['msgs queued priority 3'],  1)
+        # the second refusal gives it up
+        spt.reject(refused,  'DUH')
+        self.assertEqual(len(spt.queue),  1)
+        self.assertEqual(spt.dead_count,  1)
+        self.assertEqual(spt.dead_letters[0]['attempts'],  2)
+
+if __name__ == '__main__':
+    unittest.main()
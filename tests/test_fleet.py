@@ -0,0 +1,80 @@
+# ----------------------------
+# Tests of the fleet of diallers: a worker killed is restarted and loses no message
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import collections
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from dc09_spt.fleet import dc09_fleet
+from dc09_spt.receiver import dc09_receiver
+
+def free_port():
+    s = socket.socket(socket.AF_INET,  socket.SOCK_STREAM)
+    s.bind(('127.0.0.1',  0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+class test_fleet(unittest.TestCase):
+    def wait(self,  check,  timeout=20.0):
+        deadline = time.monotonic() + timeout
+        while not check():
+            if time.monotonic() > deadline:
+                self.fail('timeout waiting for the fleet')
+            time.sleep(0.05)
+
+    def test_restart(self):
+        received = collections.Counter()
+        lock = threading.Lock()
+        def handler(account,  type,  nr,  msg):
+            with lock:
+                received[(account,  bytes(msg))] += 1
+        journals = tempfile.TemporaryDirectory()
+        self.addCleanup(journals.cleanup)
+        port = free_port()
+        fleet = dc09_fleet(journals.name,  workers=2,  restart_delay=0.2)
+        accounts = ['%04d' % n for n in range(1,  7)]
+        spts = [fleet.add(account) for account in accounts]
+        fleet.start()
+        self.addCleanup(fleet.stop)
+        # configured after the start, so the restarted worker only has them from the calls kept by the fleet
+        for spt in spts:
+            spt.set_path('main',  'primary',  '127.0.0.1',  port)
+            spt.set_send_retry([0.1])
+        # the receiver is not there yet, the messages wait in the journals
+        for zone in range(5):
+            for spt in spts:
+                spt.send_msg('SIA-DCS',  {'code': 'BA',  'zone': zone})
+        self.wait(lambda: fleet.state()['msgs in transit'] == 0)
+        shard = next(shard for shard in fleet.shards if len(shard.accounts))
+        shard.process.kill()
+        for zone in range(5,  10):
+            for spt in spts:
+                spt.send_msg('SIA-DCS',  {'code': 'BA',  'zone': zone})
+        self.wait(lambda: shard.restarts == 1 and shard.alive)
+        receiver = dc09_receiver(handler=handler)
+        receiver.start_thread('127.0.0.1',  tcp_port=port,  udp_port=None)
+        self.addCleanup(receiver.stop_thread)
+        self.wait(lambda: sum(received.values()) >= 60)
+        state = self.wait_sent(fleet)
+        self.assertEqual(state['worker restarts'],  1)
+        self.assertEqual(state['workers alive'],  2)
+        # every message exactly once: the journal of the killed worker and the messages it had not confirmed
+        expected = {(account,  b'#%s|NBA%d]' % (account.encode(),  zone)) for account in accounts for zone in range(10)}
+        self.assertEqual(set(received),  expected)
+        self.assertEqual(set(received.values()),  {1})
+
+    def wait_sent(self,  fleet):
+        states = []
+        def sent():
+            states.append(fleet.state())
+            return states[-1]['msgs queued'] == 0 and states[-1]['msgs in transit'] == 0
+        self.wait(sent)
+        return states[-1]
+
+if __name__ == '__main__':
+    unittest.main()
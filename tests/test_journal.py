@@ -0,0 +1,74 @@
+# ----------------------------
+# Tests of the event journal
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import os
+import shutil
+import tempfile
+import unittest
+from dc09_spt.journal import event_journal
+
+class test_journal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir,  'test.jnl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_replay(self):
+        journal = event_journal(self.filename)
+        ids = [journal.append((n,  'SIA-DCS',  '#1234|NBA%02d]' % n,  3)) for n in range(1,  6)]
+        journal.ack(ids[1])
+        journal.ack(ids[3])
+        journal.close()
+        journal = event_journal(self.filename)
+        self.assertEqual(journal.pending(),  [(ids[0],  (1,  'SIA-DCS',  '#1234|NBA01]',  3)),
+            (ids[2],  (3,  'SIA-DCS',  '#1234|NBA03]',  3)),  (ids[4],  (5,  'SIA-DCS',  '#1234|NBA05]',  3))])
+        # new events get ids after the replayed ones
+        self.assertGreater(journal.append((6,  'SIA-DCS',  '#1234|NBA06]')),  ids[-1])
+        journal.close()
+
+    def test_torn_record(self):
+        journal = event_journal(self.filename)
+        journal.append((1,  'SIA-DCS',  '#1234|NBA01]'))
+        journal.append((2,  'SIA-DCS',  '#1234|NBA02]'))
+        journal.close()
+        size = os.path.getsize(self.filename)
+        with open(self.filename,  'r+b') as f:
+            f.truncate(size - 5)
+        journal = event_journal(self.filename)
+        self.assertEqual([event[0] for id,  event in journal.pending()],  [1])
+        journal.append((3,  'SIA-DCS',  '#1234|NBA03]'))
+        journal.close()
+        journal = event_journal(self.filename)
+        self.assertEqual([event[0] for id,  event in journal.pending()],  [1,  3])
+        journal.close()
+
+    def test_compact(self):
+        journal = event_journal(self.filename,  compact_min=10)
+        ids = [journal.append((n,  'SIA-DCS',  '#1234|NBA]')) for n in range(30)]
+        for id in ids[:25]:
+            journal.ack(id)
+        # compacted at the 21st ack, when the acks outnumber twice the 9 unsent events
+        self.assertEqual(journal.acked,  4)
+        self.assertLess(os.path.getsize(self.filename),  30 * event_journal.header.size + 30 * 30)
+        journal.close()
+        journal = event_journal(self.filename)
+        self.assertEqual([id for id,  event in journal.pending()],  ids[25:])
+        self.assertEqual(journal.append((30,  'SIA-DCS',  '#1234|NBA]')),  ids[-1] + 1)
+        journal.close()
+
+    def test_batch(self):
+        journal = event_journal(self.filename)
+        for n in range(5):
+            journal.append((n,  'SIA-DCS',  '#1234|NBA]'),  sync=False)
+        self.assertEqual(journal.synced,  0)
+        journal.sync()
+        self.assertEqual(journal.synced,  5)
+        journal.close()
+        self.assertEqual(len(event_journal(self.filename).pending()),  5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# ----------------------------
+# Tests of the host resolution cache with a stubbed getaddrinfo
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import socket
+import unittest
+from unittest import mock
+from dc09_spt.comm import resolver
+from dc09_spt.comm.resolver import host_cache
+
+first = (socket.AF_INET,  ('192.0.2.1',  9000))
+second = (socket.AF_INET,  ('192.0.2.2',  9000))
+
+def infos(*addresses):
+    return [(family,  socket.SOCK_STREAM,  6,  '',  sockaddr) for family,  sockaddr in addresses]
+
+class test_resolver(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.answer = infos(first)
+        clock = mock.patch.object(resolver.time,  'monotonic',  lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        lookup = mock.patch.object(resolver.socket,  'getaddrinfo',  self.getaddrinfo)
+        lookup.start()
+        self.addCleanup(lookup.stop)
+
+    def getaddrinfo(self,  host,  port,  family=0,  type=0):
+        if isinstance(self.answer,  Exception):
+            raise self.answer
+        return self.answer
+
+    def test_numeric(self):
+        self.answer = infos((socket.AF_INET,  ('127.0.0.1',  9000)))
+        cache = host_cache('127.0.0.1',  9000,  ttl=300.0)
+        cache.resolve()
+        self.now += 1e6
+        # an IP address is neither expired nor refreshed
+        self.assertNotEqual(cache.cached(),  None)
+        self.assertFalse(cache.refresh_due())
+        self.assertEqual(cache.lookups,  1)
+
+    def test_ttl(self):
+        cache = host_cache('receiver.example',  9000,  ttl=300.0)
+        self.assertEqual(cache.resolve(),  [first])
+        self.now += 239
+        self.assertFalse(cache.refresh_due())
+        self.now += 2
+        # the refresh is claimed once, before the addresses expire
+        self.assertTrue(cache.refresh_due())
+        self.assertFalse(cache.refresh_due())
+        self.assertEqual(cache.cached(),  [first])
+        self.answer = infos(second)
+        self.now += 60
+        self.assertEqual(cache.cached(),  None)
+        self.assertEqual(cache.resolve(),  [second])
+        self.assertEqual(cache.lookups,  2)
+
+    def test_stale(self):
+        cache = host_cache('receiver.example',  9000,  ttl=300.0,  stale=600.0,  retry=30.0)
+        cache.resolve()
+        self.answer = socket.gaierror('name server down')
+        self.now += 301
+        self.assertEqual(cache.resolve(),  [first])
+        self.assertEqual(cache.counters(),  {'lookups': 2,  'lookup failures': 1,  'stale used': 1,  'addresses': 1})
+        # the stale addresses are used until the next retry
+        self.now += 29
+        self.assertEqual(cache.resolve(),  [first])
+        self.assertEqual(cache.lookups,  2)
+        self.now += 301
+        with self.assertRaises(OSError):
+            cache.resolve()
+
+    def test_failover(self):
+        self.answer = infos(first,  second,  first)
+        cache = host_cache('receiver.example',  9000)
+        self.assertEqual(cache.resolve(),  [first,  second])
+        self.assertTrue(cache.failed(first))
+        self.assertEqual(cache.resolve(),  [second,  first])
+        # the address that works stays the first one after a new lookup
+        self.answer = infos(first,  second)
+        cache.lookup(force=True)
+        self.assertEqual(cache.resolve(),  [second,  first])
+        cache.succeeded(first)
+        self.assertEqual(cache.resolve(),  [first,  second])
+        self.answer = infos(first)
+        cache.lookup(force=True)
+        self.assertFalse(cache.failed(first))
+
+if __name__ == '__main__':
+    unittest.main()
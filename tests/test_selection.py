@@ -0,0 +1,76 @@
+# ----------------------------
+# Tests of the choice between the primary and secondary path
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import unittest
+from dc09_spt.dc09_spt import dc09_spt
+from dc09_spt.metrics import path_health
+
+class test_selection(unittest.TestCase):
+    def setUp(self):
+        self.spt = dc09_spt('1234')
+        self.spt.set_path('main',  'primary',  '127.0.0.1',  1)
+        self.spt.set_path('main',  'secondary',  '127.0.0.1',  2)
+        for ps in ('primary',  'secondary'):
+            self.spt.tpaths['main'][ps]['ok'] = 1
+
+    def health(self,  ps,  seconds):
+        """
+        Give the path a single transfer of -seconds-
+        """
+        health = path_health()
+        health.record(1,  seconds)
+        self.spt.tpaths['main'][ps]['path'].health = health
+
+    def first(self):
+        return self.spt.path_order()[0][1]
+
+    def test_hysteresis(self):
+        self.health('primary',  1.0)
+        self.health('secondary',  0.75)
+        # 25 % faster is not enough
+        self.assertEqual(self.first(),  'primary')
+        self.health('secondary',  0.69)
+        self.assertEqual(self.first(),  'secondary')
+        self.assertEqual(self.spt.path_order(),  [('main',  'secondary'),  ('main',  'primary')])
+        # slightly better is not enough to move back
+        self.health('primary',  0.6)
+        self.assertEqual(self.first(),  'secondary')
+        self.health('primary',  0.48)
+        self.assertEqual(self.first(),  'primary')
+
+    def test_margin(self):
+        self.health('primary',  0.1)
+        self.health('secondary',  0.06)
+        # 40 % faster but only 40 ms
+        self.assertEqual(self.first(),  'primary')
+        self.health('secondary',  0.049)
+        self.assertEqual(self.first(),  'secondary')
+
+    def test_failures(self):
+        self.health('primary',  0.1)
+        self.health('secondary',  0.1)
+        # a failure costs the timeout times its chance
+        self.spt.tpaths['main']['primary']['path'].health.record(0,  5.0)
+        self.assertEqual(self.first(),  'secondary')
+
+    def test_fixed(self):
+        self.health('primary',  1.0)
+        self.health('secondary',  0.1)
+        self.spt.set_selection(None)
+        self.assertEqual(self.spt.path_order(),  [('main',  'primary'),  ('main',  'secondary')])
+        self.spt.set_selection()
+        self.assertEqual(self.first(),  'secondary')
+        # back to the fixed order, even after the secondary was preferred
+        self.spt.set_selection(None)
+        self.assertEqual(self.first(),  'primary')
+
+    def test_unmeasured(self):
+        self.health('secondary',  0.01)
+        # no move before both paths have a score
+        self.spt.tpaths['main']['primary']['path'].health = path_health()
+        self.assertEqual(self.first(),  'primary')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# ----------------------------
+# Tests of spreading the polls and routine reports of many diallers
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import unittest
+from dc09_spt.scheduler import schedule_spread
+
+class test_spread(unittest.TestCase):
+    def test_slot(self):
+        interval = 60.0
+        spread = schedule_spread('1234',  seed=1)
+        # the slot depends on the account only, not on the process or the random generator
+        self.assertEqual(spread.offset('main',  interval),  schedule_spread('1234',  seed=2).offset('main',  interval))
+        self.assertNotEqual(spread.offset('main',  interval),  schedule_spread('1235').offset('main',  interval))
+        self.assertNotEqual(spread.offset('main',  interval),  spread.offset('back-up',  interval))
+        offsets = [schedule_spread(account).offset('main',  interval) for account in range(1000,  2000)]
+        self.assertTrue(all(0 <= offset < interval for offset in offsets))
+        # spread over the whole interval
+        self.assertEqual(len(set(int(offset / 6) for offset in offsets)),  10)
+        self.assertEqual(schedule_spread('1234',  phase=False).offset('main',  interval),  0.0)
+
+    def test_bound(self):
+        self.assertEqual(schedule_spread('1',  jitter=0.1,  max_jitter=30.0).bound(60),  6.0)
+        self.assertEqual(schedule_spread('1',  jitter=0.1,  max_jitter=30.0).bound(3600),  30.0)
+        self.assertEqual(schedule_spread('1',  jitter=0.9,  max_jitter=300.0).bound(60),  30.0)
+        self.assertEqual(schedule_spread('1',  jitter=0).bound(60),  0.0)
+
+    def test_next(self):
+        interval = 90.0
+        for phase in (True,  False):
+            spread = schedule_spread('1234',  phase=phase,  jitter=0.2,  max_jitter=10.0,  seed=7)
+            period = interval - spread.bound(interval)
+            slot = spread.offset('main',  period)
+            now = 1e6 + 0.3
+            for n in range(2000):
+                due = spread.next(now,  'main',  interval)
+                # never later than the interval, only earlier by at most max_jitter
+                self.assertTrue(now <= due <= now + interval,  (phase,  n))
+                if phase:
+                    # at most max_jitter before a slot of the account
+                    self.assertLessEqual((slot - due) % period,  10.0 + 1e-6)
+                else:
+                    self.assertGreaterEqual(due,  now + interval - 10.0)
+                now = due
+
+    def test_first(self):
+        spread = schedule_spread('1234',  seed=3)
+        period = 60.0 - spread.bound(60.0)
+        for now in (1e6,  1e6 + 17.5,  2e6 + 59.9):
+            first = spread.first(now,  'main',  60.0)
+            self.assertTrue(now <= first < now + period)
+            self.assertAlmostEqual((first - spread.offset('main',  period)) % period,  0.0,  places=6)
+
+    def test_seed(self):
+        one = schedule_spread('1234',  seed=5)
+        two = schedule_spread('1234',  seed=5)
+        self.assertEqual([one.next(1e6,  'main',  600) for n in range(10)],  [two.next(1e6,  'main',  600) for n in range(10)])
+        self.assertEqual([one.retry(0,  5) for n in range(10)],  [two.retry(0,  5) for n in range(10)])
+
+    def test_retry(self):
+        spread = schedule_spread('1234',  jitter=0.2,  seed=11)
+        retries = [spread.retry(100.0,  5.0) for n in range(1000)]
+        # spread both ways
+        self.assertTrue(all(104.0 <= retry <= 106.0 for retry in retries))
+        self.assertTrue(min(retries) < 104.5 and max(retries) > 105.5)
+        self.assertEqual(schedule_spread('1234',  jitter=0).retry(100.0,  5.0),  105.0)
+
+    def test_routine(self):
+        interval = 3600.0
+        spread = schedule_spread('1234',  jitter=0.1,  max_jitter=30.0,  seed=13)
+        slots = [1000.0]
+        now = 1000.0
+        for n in range(100):
+            due = spread.routine_next(slots,  0,  now,  interval)
+            # the slots do not drift, the deadlines are at most max_jitter early
+            self.assertEqual(slots[0],  1000.0 + (n + 1) * interval)
+            self.assertTrue(slots[0] - 30.0 <= due <= slots[0])
+            now = due
+        self.assertEqual(spread.routine_offset(0,  {'start': 3600},  interval),  0.0)
+        self.assertTrue(0 <= spread.routine_offset(0,  {'start': 3600,  'spread': 300},  interval) < 300)
+
+if __name__ == '__main__':
+    unittest.main()
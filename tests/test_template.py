@@ -0,0 +1,54 @@
+# ----------------------------
+# Tests of the precompiled DC03 and DC05 messages against dc03event and dc05event
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import itertools
+import unittest
+from dc09_spt.msg.dc03_msg import dc03_msg
+from dc09_spt.msg.dc05_msg import dc05_msg
+
+class test_template(unittest.TestCase):
+    # fixed fields of the template, including codes with the user or the area after the code
+    dc03_fixed = [{},  {'code': 'BA'},  {'code': 'BA',  'area': 2},  {'code': 'BA',  'area': 2,  'areaname': 'hall'},
+        {'code': 'OP'},  {'code': 'OP',  'area': 3},  {'code': 'CL',  'area': 1,  'areaname': 'shop'},
+        {'code': 'YS',  'text': 'mains'},  {'code': 'BA',  'text': 'door',  'flavor': 'xsia'},
+        {'text': 'free text'},  {'code': 'A',  'text': 'free text'},  {'code': 'RP',  'account': '9876'}]
+    # variable fields, given when the template is compiled or when it is rendered
+    dc03_variable = [{},  {'zone': 5},  {'zone': 5,  'zonename': 'front'},  {'user': 12},  {'user': 12,  'username': 'jan'},
+        {'zone': 7,  'user': 3},  {'time': '12:34:56'},  {'zone': 1,  'user': 2,  'username': 'piet',  'zonename': 'back',  'time': '01:02:03'}]
+
+    def test_dc03(self):
+        for fixed,  compiled,  rendered in itertools.product(self.dc03_fixed,  self.dc03_variable,  self.dc03_variable):
+            if ('text' in fixed and fixed.get('code',  'A') == 'A') and (compiled or rendered):
+                # a text message has no variable fields
+                continue
+            template = dc03_msg.dc03template('1234',  {**fixed,  **compiled})
+            expected = dc03_msg.dc03event('1234',  {**fixed,  **compiled,  **rendered})
+            self.assertEqual(template.render(rendered),  expected,  (fixed,  compiled,  rendered))
+
+    dc05_fixed = [{},  {'code': 130},  {'code': '130',  'area': 1},  {'code': 401,  'area': 12},  {'code': '401'},
+        {'code': 602,  'account': '9876'},  {'code': 130,  'q': 3},  {'code': 130,  'q': 6}]
+    dc05_variable = [{},  {'zone': 5},  {'zone': 1234},  {'user': 7},  {'zone': 5,  'user': 7},  {'q': 1},  {'q': '3',  'zone': 9},  {'q': 6,  'user': 42}]
+
+    def test_dc05(self):
+        for fixed,  compiled,  rendered in itertools.product(self.dc05_fixed,  self.dc05_variable,  self.dc05_variable):
+            template = dc05_msg.dc05template('1234',  {**fixed,  **compiled})
+            expected = dc05_msg.dc05event('1234',  {**fixed,  **compiled,  **rendered})
+            self.assertEqual(template.render(rendered),  expected,  (fixed,  compiled,  rendered))
+
+    def test_dc05_qualifier(self):
+        # 6 (old alarm) is accepted, other qualifiers are refused by both
+        self.assertEqual(dc05_msg.dc05event('1234',  {'code': 130,  'q': 6}),  '#1234|6130 00 000]')
+        template = dc05_msg.dc05template('1234',  {'code': 130})
+        self.assertEqual(template.render({'q': 6,  'zone': 3}),  '#1234|6130 00 003]')
+        for q in (0,  2,  4):
+            with self.assertRaises(Exception):
+                dc05_msg.dc05event('1234',  {'code': 130,  'q': q})
+            with self.assertRaises(Exception):
+                dc05_msg.dc05template('1234',  {'code': 130,  'q': q})
+            with self.assertRaises(Exception):
+                template.render({'q': q})
+
+if __name__ == '__main__':
+    unittest.main()
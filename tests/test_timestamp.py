@@ -0,0 +1,47 @@
+# ----------------------------
+# Tests of the receiver timestamp parser against datetime.strptime
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import calendar
+import datetime
+import unittest
+from dc09_spt.msg.dc09_msg import _timestamp
+
+def strptime(tm):
+    """
+    The parser used before, the receiver time is in UTC
+    """
+    return calendar.timegm(datetime.datetime.strptime(tm.decode(),  "%H:%M:%S,%m-%d-%Y").timetuple())
+
+class test_timestamp(unittest.TestCase):
+    valid = [b'00:00:00,01-01-1970',  b'12:34:56,10-17-2026',  b'23:59:59,12-31-2099',
+        b'01:02:03,02-29-2024',  b'01:02:03,02-29-2000',  b'07:00:00,04-30-2026',  b'00:00:00,01-01-0001']
+    invalid = [b'01:02:03,02-29-2023',  b'01:02:03,02-29-1900',  b'01:02:03,02-31-2026',  b'01:02:03,04-31-2026',
+        b'01:02:03,00-10-2026',  b'01:02:03,13-10-2026',  b'01:02:03,10-00-2026',  b'01:02:03,10-32-2026',
+        b'24:00:00,10-17-2026',  b'23:60:00,10-17-2026',  b'23:59:60,10-17-2026',  b'23:59:61,10-17-2026',
+        b'01:02:03,01-01-0000',  b' 1:02:03,10-17-2026',  b'01:02:03,10-17-202 ',  b'01:02:03,+1-17-2026',
+        b'01-02-03,10-17-2026',  b'01:02:03,10/17/2026',  b'01:02:03 10-17-2026',  b'01:02:03,10-17-26',
+        b'ab:cd:ef,10-17-2026',  b'']
+
+    def test_valid(self):
+        for tm in self.valid:
+            self.assertEqual(_timestamp(tm),  strptime(tm),  tm)
+            # a second time from the cached day
+            self.assertEqual(_timestamp(tm),  strptime(tm),  tm)
+
+    def test_invalid(self):
+        for tm in self.invalid:
+            with self.assertRaises(ValueError,  msg=tm):
+                strptime(tm)
+            with self.assertRaises(ValueError,  msg=tm):
+                _timestamp(tm)
+
+    def test_cached_day(self):
+        # a valid day in the cache does not let an invalid time through
+        _timestamp(b'01:02:03,10-17-2026')
+        with self.assertRaises(ValueError):
+            _timestamp(b'25:02:03,10-17-2026')
+
+if __name__ == '__main__':
+    unittest.main()
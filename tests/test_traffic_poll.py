@@ -0,0 +1,71 @@
+# ----------------------------
+# Tests of acknowledged events counting as polls
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import time
+import unittest
+from dc09_spt.dc09_spt import dc09_spt
+
+class test_traffic_poll(unittest.TestCase):
+    def setUp(self):
+        self.spt = dc09_spt('1234')
+        self.spt.set_path('main',  'primary',  '127.0.0.1',  1)
+        self.spt.set_path('main',  'secondary',  '127.0.0.1',  2)
+        self.spt.set_path('back-up',  'primary',  '127.0.0.1',  3)
+        for mb,  ps in (('main',  'primary'),  ('main',  'secondary'),  ('back-up',  'primary')):
+            self.spt.tpaths[mb][ps]['ok'] = 1
+        # the schedule only, without a poll runner that would poll the paths
+        self.spt.traffic_as_poll = True
+        self.polls = self.spt.polls
+        self.polls.set_poll(60,  300,  5,  None,  None)
+        self.due = time.monotonic() - 1
+        self.polls.main_next = self.polls.backup_next = self.due
+
+    def path(self,  mb,  ps):
+        return self.spt.tpaths[mb][ps]['path']
+
+    def acked(self,  mb,  ps,  msg_nr=1):
+        self.spt.transfer_done(self.path(mb,  ps),  msg_nr,  1,  1,  time.perf_counter())
+
+    def test_polled_path(self):
+        before = time.monotonic()
+        self.acked('main',  'primary')
+        # only the main poll moves, to at most one interval ahead
+        self.assertTrue(before + 60 <= self.polls.main_next <= time.monotonic() + 60)
+        self.assertEqual(self.polls.backup_next,  self.due)
+        self.acked('back-up',  'primary')
+        self.assertTrue(before + 300 <= self.polls.backup_next <= time.monotonic() + 300)
+        self.assertEqual(self.polls.suppressed,  2)
+
+    def test_other_path(self):
+        # the poll checks the primary, an event over the secondary says nothing about it
+        self.acked('main',  'secondary')
+        self.assertEqual((self.polls.main_next,  self.polls.backup_next),  (self.due,  self.due))
+        self.assertEqual(self.polls.suppressed,  0)
+
+    def test_path_down(self):
+        self.spt.tpaths['main']['primary']['ok'] = 0
+        self.acked('main',  'primary')
+        self.assertEqual(self.polls.main_next,  self.due)
+        self.assertEqual(self.polls.suppressed,  0)
+
+    def test_poll(self):
+        # a poll (message nr 0) and a failed transfer are no traffic
+        self.acked('main',  'primary',  msg_nr=0)
+        self.spt.transfer_done(self.path('main',  'primary'),  1,  0,  1,  time.perf_counter())
+        self.assertEqual(self.polls.main_next,  self.due)
+
+    def test_disabled(self):
+        self.spt.traffic_as_poll = False
+        self.acked('main',  'primary')
+        self.assertEqual(self.polls.main_next,  self.due)
+
+    def test_not_earlier(self):
+        later = time.monotonic() + 1000
+        self.polls.main_next = later
+        self.acked('main',  'primary')
+        self.assertEqual(self.polls.main_next,  later)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+# ----------------------------
+# Tests of the TCP connection of a transmission path
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import socket
+import unittest
+from dc09_spt.comm.transpathtcp import TransPathTCP
+
+class test_transpathtcp(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET,  socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1',  0))
+        self.server.listen(1)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_receive_timeout(self):
+        conn = TransPathTCP('127.0.0.1',  self.server.getsockname()[1],  timeout=0.05)
+        s = conn.connect()
+        self.assertEqual(conn.receive(),  None)
+        # the failed connection is closed, not only dropped
+        self.assertEqual(conn.s,  None)
+        self.assertEqual(s.fileno(),  -1)
+
+    def test_send_failure(self):
+        conn = TransPathTCP('127.0.0.1',  self.server.getsockname()[1],  timeout=0.05)
+        s = conn.connect()
+        s.close()
+        self.assertEqual(conn.sendAndReceive(b'\n'),  None)
+        self.assertEqual(conn.s,  None)
+
+if __name__ == '__main__':
+    unittest.main()
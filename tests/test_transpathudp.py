@@ -0,0 +1,87 @@
+# ----------------------------
+# Tests of the UDP exchange: retransmission, back off and answer matching
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import unittest
+from dc09_spt.comm.transpathudp import TransPathUDP,  rtt_estimator,  answer_matches,  answer_sample
+from dc09_spt.msg.dc09_msg import dc09_msg
+from dc09_spt.receiver import dc09_receiver
+
+class test_rtt(unittest.TestCase):
+    def test_estimator(self):
+        rtt = rtt_estimator(1.0,  minimum=0.2,  maximum=2.0)
+        self.assertEqual(rtt.rto,  1.0)
+        rtt.sample(0.1)
+        self.assertAlmostEqual(rtt.srtt,  0.1)
+        self.assertAlmostEqual(rtt.rto,  0.3)
+        rtt.sample(0.1)
+        self.assertAlmostEqual(rtt.rto,  0.25)
+        for n in range(20):
+            rtt.sample(0.01)
+        # the timeout does not go under the minimum
+        self.assertEqual(rtt.rto,  0.2)
+        self.assertEqual(rtt.backoff(1.5),  2.0)
+
+    def test_answers(self):
+        receiver = dc09_receiver()
+        ack = receiver.answer(b'ACK',  5,  account=b'1234')
+        nak = receiver.answer(b'NAK',  5,  account=b'1234')
+        duh = receiver.answer(b'DUH',  5,  account=b'1234')
+        self.assertTrue(answer_matches(ack,  5))
+        self.assertFalse(answer_matches(ack,  6))
+        self.assertFalse(answer_matches(nak,  5))
+        self.assertTrue(answer_sample(ack,  5))
+        self.assertTrue(answer_sample(duh,  5))
+        self.assertFalse(answer_sample(ack,  6))
+        self.assertFalse(answer_sample(nak,  None))
+        self.assertFalse(answer_sample(b'\n',  5))
+
+class test_transpathudp(unittest.TestCase):
+    def exchange(self,  receiver,  msg_nr=1,  timeout=1.0):
+        tcp,  udp = receiver.start_thread('127.0.0.1')
+        self.addCleanup(receiver.stop_thread)
+        conn = TransPathUDP('127.0.0.1',  udp,  timeout=timeout,  rtt=rtt_estimator(0.2,  minimum=0.1,  maximum=0.4))
+        conn.connect()
+        self.addCleanup(conn.disconnect)
+        block = str.encode(dc09_msg('1234').dc09block(msg_nr,  'SIA-DCS',  '#1234|NBA]'))
+        return conn,  conn.sendAndReceive(block,  msg_nr=msg_nr)
+
+    def test_answer(self):
+        conn,  antw = self.exchange(dc09_receiver())
+        self.assertTrue(answer_matches(antw,  1))
+        self.assertEqual(conn.retransmits,  0)
+        self.assertNotEqual(conn.rtt.srtt,  None)
+
+    def test_nak(self):
+        receiver = dc09_receiver(nak_rate=1.0)
+        conn,  antw = self.exchange(receiver)
+        # the NAK is held until the block would be repeated, it is no round trip time sample
+        self.assertEqual(dc09_msg('1234').dc09answer(1,  antw)[0],  'NAK')
+        self.assertEqual(receiver.stats()['blocks'],  1)
+        self.assertEqual(conn.rtt.srtt,  None)
+        self.assertEqual(conn.rtt.rto,  0.2)
+
+    def test_loss(self):
+        receiver = dc09_receiver(loss=1.0)
+        conn,  antw = self.exchange(receiver)
+        self.assertEqual(antw,  None)
+        # sent at 0, 0.2, 0.6, the next repeat at 1.0 is past the timeout
+        self.assertEqual(receiver.stats()['lost'],  3)
+        self.assertEqual(conn.retransmits,  2)
+        self.assertEqual(conn.rtt.srtt,  None)
+        self.assertEqual(conn.rtt.rto,  0.4)
+
+    def test_repeat(self):
+        receiver = dc09_receiver(loss=0.5,  seed=3)
+        conn,  antw = self.exchange(receiver,  msg_nr=7,  timeout=3.0)
+        self.assertTrue(answer_matches(antw,  7))
+        # with this seed the first block is lost and the repeat is answered
+        self.assertEqual(receiver.stats()['lost'],  1)
+        self.assertEqual(conn.retransmits,  1)
+        # no sample from a repeated block (Karn), the backed off timeout is kept
+        self.assertEqual(conn.rtt.srtt,  None)
+        self.assertEqual(conn.rtt.rto,  0.4)
+
+if __name__ == '__main__':
+    unittest.main()
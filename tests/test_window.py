@@ -0,0 +1,102 @@
+# ----------------------------
+# Tests of sending a window of messages against the receiver simulator
+# (c 2018 van Ovost Automatisering b.v.
+# Author : Jacq. van Ovost
+# ----------------------------
+import time
+import unittest
+from dc09_spt.dc09_spt import dc09_spt
+from dc09_spt.dc09_base import window_exchange
+from dc09_spt.msg.dc09_msg import dc09_msg
+from dc09_spt.comm.transpath import TransPath
+from dc09_spt.receiver import dc09_receiver
+
+class test_window(unittest.TestCase):
+    def exchange(self):
+        path = TransPath('127.0.0.1',  1,  '1234')
+        dc09 = dc09_msg(path.get_account(), path.get_key(), path.get_receiver(), path.get_line(), path.get_offset(), crypt=path.get_crypt())
+        messages = [(nr,  'SIA-DCS',  '#1234|NBA%d]' % nr) for nr in range(1,  4)]
+        rejected = {}
+        exchange = window_exchange(dc09,  messages,  path,  rejected)
+        exchange.sent()
+        return exchange,  rejected
+
+    def test_unknown(self):
+        receiver = dc09_receiver()
+        exchange,  rejected = self.exchange()
+        # a stray answer, an ACK without message number and a repeated ACK are not counted as answers
+        exchange.received(receiver.answer(b'ACK',  9,  account=b'1234'))
+        exchange.received(receiver.answer(b'ACK',  0,  account=b'1234'))
+        exchange.received(receiver.answer(b'ACK',  1,  account=b'1234'))
+        exchange.received(receiver.answer(b'ACK',  1,  account=b'1234'))
+        self.assertTrue(exchange.waiting())
+        exchange.received(receiver.answer(b'DUH',  2,  account=b'1234') + receiver.answer(b'ACK',  3,  account=b'1234'))
+        self.assertFalse(exchange.waiting())
+        self.assertEqual(exchange.acked,  {1,  3})
+        self.assertEqual(rejected,  {2: 'DUH'})
+        self.assertEqual(exchange.resend(),  None)
+
+    def test_invalid(self):
+        receiver = dc09_receiver()
+        exchange,  rejected = self.exchange()
+        exchange.received(receiver.answer(b'ACK',  1,  account=b'1234'))
+        bad = bytearray(receiver.answer(b'ACK',  2,  account=b'1234'))
+        bad[1:5] = b'0000'
+        # an answer with a wrong CRC is skipped, the acknowledged messages stay acknowledged
+        exchange.received(bytes(bad))
+        self.assertEqual(exchange.path.metrics.counts['error'],  1)
+        self.assertTrue(exchange.waiting())
+        exchange.received(receiver.answer(b'ACK',  3,  account=b'1234'))
+        self.assertEqual(exchange.acked,  {1,  3})
+        self.assertEqual(list(exchange.pending),  [2])
+        self.assertEqual(rejected,  {})
+
+    def test_resync(self):
+        key = b'0123456789abcdef'
+        receiver = dc09_receiver(key,  skew=300)
+        tcp,  udp = receiver.start_thread('127.0.0.1')
+        try:
+            spt = dc09_spt('1234')
+            spt.set_path('main',  'primary',  '127.0.0.1',  tcp,  key=key,  persistent=True)
+            path = spt.tpaths['main']['primary']['path']
+            messages = [(nr,  'SIA-DCS',  '#1234|NBA%d]' % nr) for nr in range(1,  6)]
+            rejected = {}
+            # the clock of the receiver is off, the whole window is NAK'ed once and sent again
+            self.assertEqual(sorted(spt.transfer_window(messages,  path,  rejected)),  [1,  2,  3,  4,  5])
+            self.assertEqual(rejected,  {})
+            stats = receiver.stats()
+            self.assertEqual((stats['blocks'],  stats['NAK'],  stats['ACK']),  (10,  5,  5))
+            self.assertEqual(path.metrics.counts['retry'],  5)
+            path.close()
+        finally:
+            receiver.stop_thread()
+
+    def test_refused(self):
+        def handler(account,  type,  nr,  message):
+            return 'DUH' if nr in (2,  4) else None
+        main = dc09_receiver(handler=handler)
+        main_port,  udp = main.start_thread('127.0.0.1')
+        backup = dc09_receiver(handler=handler)
+        backup_port,  udp = backup.start_thread('127.0.0.1')
+        spt = dc09_spt('1234')
+        try:
+            spt.set_path('main',  'primary',  '127.0.0.1',  main_port,  persistent=True)
+            spt.set_path('back-up',  'primary',  '127.0.0.1',  backup_port,  persistent=True)
+            spt.set_window(8)
+            for zone in range(6):
+                spt.send_msg('SIA-DCS',  {'code': 'BA',  'zone': zone})
+            deadline = time.monotonic() + 5
+            while (main.stats()['ACK'] < 4 or spt.send.running) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # refused messages wait for a retry on the same path, the back-up is not used
+            self.assertEqual(main.stats()['ACK'],  4)
+            self.assertEqual(backup.stats()['blocks'],  0)
+            self.assertEqual(spt.state()['msgs queued'],  2)
+            self.assertEqual(spt.state()['main primary path ok'],  1)
+        finally:
+            spt.stop_send()
+            main.stop_thread()
+            backup.stop_thread()
+
+if __name__ == '__main__':
+    unittest.main()